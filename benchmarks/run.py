@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from benchmarks.synthetic import build_traits
+from src.core.main import Generator
+from src.core.render import Renderer, plan_prefixes
+from src.utils.cache import ImageCache, PrefixCache
+from src.utils.composite import TraitLayer
+from src.utils.encoding import ImageEncoder
+
+# the repository root, where main.py lives
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    """
+    Times a benchmark stage, keeping the fastest of `repeat` runs, then runs
+    it once more under tracemalloc for the peak of Python and NumPy
+    allocations, which would otherwise skew the timings.
+
+    :param function: Runs the stage, returning the number of items processed
+        and any extra results.
+    :param repeat: The number of timed runs.
+    :return: The stage's results.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items, extra = function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "items": items,
+        "seconds": seconds,
+        "items_per_second": items / seconds if seconds else None,
+        "peak_bytes": peak,
+        **extra,
+    }
+
+
+def generator_args(config: str, output: str, params: dict) -> dict:
+    """
+    The arguments `main.py` would pass to the generator for a benchmark run.
+    """
+    return {
+        "command": "generate",
+        "config": config,
+        "amount": str(params["amount"]),
+        "output": output,
+        "seed": str(params["seed"]),
+        "verbose": 0,
+        "start_at": 0,
+        "image_path": None,
+        "trait_dir": None,
+        "no_pad": False,
+        "allow_duplicates": params["allow_duplicates"],
+        "max_retries": 10000,
+        "sampler": params["sampler"],
+        "image_cache_size": 512,
+        "prefix_cache_size": 256,
+        "workers": params["workers"],
+        "render_backend": params["render_backend"],
+        "encode_workers": None,
+        "write_workers": 4,
+        "queue_size": 4,
+        "objects_format": "json",
+        "compact_metadata": False,
+        "resume": False,
+        "shard": None,
+        "profile": False,
+        "cprofile": False,
+        "no_validation_cache": True,
+        "format": params["format"],
+        "compress_level": None,
+        "optimize": None,
+        "quality": None,
+        "lossless": None,
+        "drop_alpha": None,
+    }
+
+
+def run_benchmarks(params: dict, workdir: str) -> dict:
+    """
+    Runs every benchmark stage on a synthetic collection.
+
+    :param params: The scale and settings of the benchmark.
+    :param workdir: The folder to build the trait set and outputs in.
+    :return: The results of every stage.
+    """
+    config = build_traits(
+        workdir,
+        params["layers"],
+        params["values"],
+        params["size"],
+        params["incompatibilities"],
+        seed=params["seed"],
+    )
+    output = os.path.join(workdir, "output")
+    args = generator_args(config, output, params)
+    results = {}
+
+    # sampling: the genomes of the whole collection, with a fresh generator
+    # per run that is built before the clock starts
+    generators = iter([Generator(**args) for _ in range(params["repeat"] + 1)])
+
+    def sample():
+        genomes = [genome for _, genome in next(generators).sample()]
+        return len(genomes), {}
+
+    results["sampling"] = measure(sample, params["repeat"])
+    generator = Generator(**args)
+    genomes = sorted(tuple(genome) for _, genome in generator.sample())
+    trait_paths = generator.compiled.trait_paths
+
+    # decode: every trait image, split up for compositing
+    def decode():
+        paths = sorted({path for paths in trait_paths for path in paths})
+        pixels = sum(TraitLayer.open(path).pixels[..., 0].size for path in paths)
+        return len(paths), {"megapixels": pixels / 1e6}
+
+    results["decode"] = measure(decode, params["repeat"])
+
+    # composite: every genome, in genome order and chunks like the generator,
+    # with and without prefix composites
+    chunk_size = max(1, min(16, len(genomes) // (params["workers"] * 4)))
+
+    def composite(prefix_bytes: int) -> Callable:
+        def run():
+            prefixes = PrefixCache(prefix_bytes)
+            renderer = Renderer(
+                trait_paths, generator.encoder, ImageCache(512 << 20), prefixes
+            )
+            for start in range(0, len(genomes), chunk_size):
+                chunk = genomes[start : start + chunk_size]
+                for genome, keep in zip(chunk, plan_prefixes(chunk)):
+                    renderer.composite(genome, keep)
+            return len(genomes), {"prefix_hit_rate": prefixes.hits / len(genomes)}
+
+        return run
+
+    results["composite"] = measure(composite(256 << 20), params["repeat"])
+    results["composite_uncached"] = measure(composite(0), params["repeat"])
+
+    # encode: a sample of the composites
+    renderer = Renderer(
+        trait_paths, generator.encoder, ImageCache(512 << 20), PrefixCache(256 << 20)
+    )
+    composites = [
+        renderer.composite(genome).copy()
+        for genome in genomes[: params["encode_sample"]]
+    ]
+    encoder = ImageEncoder(**({"format": params["format"]} if params["format"] else {}))
+
+    def encode():
+        size = sum(len(encoder.encode(pixels)) for pixels in composites)
+        return len(composites), {"megabytes": size / 1e6}
+
+    results["encode"] = measure(encode, params["repeat"])
+
+    # generate: the whole command end to end, in a separate process so its
+    # peak memory, including its render workers, is measured on its own
+    command = [sys.executable, os.path.join(ROOT, "main.py"), "generate"]
+    for key in ["config", "amount", "seed", "output", "sampler", "workers"]:
+        command += ["--{}".format(key), str(args[key])]
+    command += ["--render-backend", args["render_backend"]]
+    if args["format"]:
+        command += ["--format", args["format"]]
+    if args["allow_duplicates"]:
+        command += ["--allow-duplicates"]
+    # validate every run, as a first run would
+    command += ["--no-validation-cache"]
+    # start from an empty output folder, which would otherwise be reused
+    shutil.rmtree(output, ignore_errors=True)
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, check=True, capture_output=True)
+    seconds = time.perf_counter() - start
+    results["generate"] = {
+        "items": params["amount"],
+        "seconds": seconds,
+        "items_per_second": params["amount"] / seconds,
+        # kilobytes on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss << 10,
+    }
+    return results
+
+
+def environment() -> dict:
+    """
+    Describes the machine and commit the benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """
+    Compares the throughput and memory of every stage against a baseline.
+
+    :return: A line per stage.
+    """
+    lines = []
+    for stage, result in results["results"].items():
+        before = baseline["results"].get(stage)
+        if not before:
+            continue
+        line = "{:<10} {:>8.2f}x throughput".format(
+            stage, result["items_per_second"] / before["items_per_second"]
+        )
+        for key in ["peak_bytes", "peak_rss_bytes"]:
+            if result.get(key) and before.get(key):
+                line += ", {:>6.2f}x memory".format(result[key] / before[key])
+        lines.append(line)
+    return lines
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Benchmarks generation on a synthetic collection.",
+    )
+    parser.add_argument("--layers", type=int, default=8, help="Number of layers")
+    parser.add_argument(
+        "--values", type=int, default=10, help="Number of values per layer"
+    )
+    parser.add_argument(
+        "--size", type=int, default=512, help="Width and height of the images"
+    )
+    parser.add_argument(
+        "--incompatibilities",
+        type=int,
+        default=10,
+        help="Number of incompatibility rules",
+    )
+    parser.add_argument(
+        "-n", "--amount", type=int, default=500, help="Amount to generate"
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed for everything")
+    parser.add_argument(
+        "--sampler", choices=["legacy", "batch", "unique"], default="batch"
+    )
+    parser.add_argument("--allow-duplicates", action="store_true", default=False)
+    parser.add_argument("--format", choices=["png", "webp", "jpeg"], default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--render-backend", choices=["process", "thread"], default="process"
+    )
+    parser.add_argument(
+        "--encode-sample",
+        type=int,
+        default=100,
+        help="Number of composites to time encoding on",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Timed runs per stage, keeping the fastest",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Folder for the trait set, defaults to a temporary one",
+    )
+    parser.add_argument(
+        "-o", "--output", default="benchmark.json", help="Path to the JSON results"
+    )
+    parser.add_argument(
+        "--compare", default=None, help="Path to JSON results to compare against"
+    )
+    params = vars(parser.parse_args(argv))
+    output, baseline, workdir = (
+        params.pop("output"),
+        params.pop("compare"),
+        params.pop("workdir"),
+    )
+
+    with tempfile.TemporaryDirectory() as temp:
+        results = {
+            **environment(),
+            "params": params,
+            "results": run_benchmarks(params, workdir or temp),
+        }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    for stage, result in results["results"].items():
+        print(
+            "{:<10} {:>10,.1f} items/s  {:>8.3f} s".format(
+                stage, result["items_per_second"], result["seconds"]
+            )
+        )
+    if baseline:
+        with open(baseline) as f:
+            print("\n".join(compare(results, json.load(f))))
+    return results
+
+
+if __name__ == "__main__":
+    main()
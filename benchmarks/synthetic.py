@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def build_traits(
+    root: str,
+    layers: int,
+    values: int,
+    size: int,
+    incompatibilities: int,
+    seed: int = 0,
+) -> str:
+    """
+    Builds a synthetic trait set and its configuration. The first layer is
+    an opaque background, later layers are shapes with opaque and partially
+    transparent pixels over a transparent canvas, like typical trait art.
+
+    :param root: The folder to build the trait images and config in.
+    :param layers: The number of layers.
+    :param values: The number of values of every layer.
+    :param size: The width and height of every image, in pixels.
+    :param incompatibilities: The number of incompatibility rules.
+    :param seed: The seed everything is derived from.
+    :return: The path to the configuration file.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[:size, :size]
+    config_layers = []
+    for layer in range(layers):
+        trait_path = os.path.join(root, "traits", "layer{}".format(layer))
+        os.makedirs(trait_path, exist_ok=True)
+        for value in range(values):
+            pixels = np.zeros((size, size, 4), dtype=np.uint8)
+            pixels[..., :3] = rng.integers(0, 256, 3)
+            if layer == 0:
+                pixels[..., 3] = 255
+            else:
+                # an ellipse with a soft edge
+                center = rng.uniform(0.2, 0.8, 2) * size
+                radius = rng.uniform(0.1, 0.3, 2) * size
+                distance = np.hypot(
+                    (rows - center[0]) / radius[0], (cols - center[1]) / radius[1]
+                )
+                pixels[..., 3] = np.clip((1.2 - distance) * 5, 0, 1) * 255
+            Image.fromarray(pixels).save(
+                os.path.join(trait_path, "{}.png".format(value)), compress_level=1
+            )
+
+        weights = rng.integers(1, 10, values).astype(float)
+        weights = list(weights * 100 / weights.sum())
+        weights[-1] = 100 - sum(weights[:-1])
+        config_layers.append(
+            {
+                "name": "Layer {}".format(layer),
+                "values": ["Layer {} Value {}".format(layer, v) for v in range(values)],
+                "trait_path": trait_path,
+                "filename": [str(value) for value in range(values)],
+                "weights": weights,
+            }
+        )
+
+    rules = []
+    for rule in range(incompatibilities if layers > 1 else 0):
+        layer, other = rng.choice(layers, 2, replace=False).tolist()
+        incompatibility = {
+            "layer": "Layer {}".format(layer),
+            "value": "Layer {} Value {}".format(layer, rng.integers(values)),
+            "incompatible_with": [
+                "Layer {} Value {}".format(other, rng.integers(values))
+            ],
+        }
+        # half of the rules swap in a default rather than resampling
+        if rule % 2:
+            incompatibility["default"] = {
+                "value": "Default {}".format(rule),
+                "filename": os.path.join(root, "traits", "layer{}".format(other), "0"),
+            }
+        rules.append(incompatibility)
+
+    path = os.path.join(root, "config.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "layers": config_layers,
+                "incompatibilities": rules,
+                "baseURI": ".",
+                "name": "Benchmark #",
+                "description": "A synthetic collection for benchmarks.",
+            },
+            f,
+            indent=4,
+        )
+    return path
@@ -3,6 +3,7 @@ import argparse
 from src.core.config import generate_config
 from src.core.main import Generator
 from src.core.metadata import update_metadata
+from src.core.shards import merge_shards
 
 # add CLI arguments
 generator = argparse.ArgumentParser(
@@ -12,7 +13,7 @@ generator = argparse.ArgumentParser(
 # add subcommands
 generator.add_argument(
     "command",
-    choices=["generate", "validate", "update_metadata", "build_config"],
+    choices=["generate", "validate", "update_metadata", "build_config", "merge"],
     help="Command to execute",
 )
 
@@ -39,6 +40,75 @@ generator.add_argument(
     "--image-path", help="Path to the image folder, or the IPFS CID."
 )
 generator.add_argument("--trait-dir", help="Path to the trait directory")
+generator.add_argument(
+    "--max-retries",
+    help="Maximum resampling attempts per token before giving up",
+    default=10000,
+)
+generator.add_argument(
+    "--sampler",
+    help="Trait sampling strategy",
+    choices=["legacy", "batch", "unique"],
+    default="batch",
+)
+generator.add_argument(
+    "--image-cache-size",
+    help="Memory budget in MB for decoded trait images, per render worker process",
+    default=512,
+)
+generator.add_argument(
+    "--prefix-cache-size",
+    help="Memory budget in MB for partial composites, per render worker process",
+    default=256,
+)
+generator.add_argument(
+    "--workers",
+    help="Number of render workers, defaults to the CPU count",
+    default=None,
+)
+generator.add_argument(
+    "--encode-workers",
+    help="Number of image encoding threads with the thread render backend, defaults to --workers",
+    default=None,
+)
+generator.add_argument(
+    "--write-workers",
+    help="Number of image and metadata writing threads",
+    default=4,
+)
+generator.add_argument(
+    "--queue-size",
+    help="Number of chunks of tokens buffered between pipeline stages",
+    default=4,
+)
+generator.add_argument(
+    "--render-backend",
+    help="Render images in worker processes, or in threads as a fallback",
+    choices=["process", "thread"],
+    default="process",
+)
+generator.add_argument(
+    "--format",
+    help="Output image format",
+    choices=["png", "webp", "jpeg"],
+    default=None,
+)
+generator.add_argument(
+    "--compress-level",
+    help="PNG compression level, from 0 (fastest) to 9 (smallest)",
+    default=None,
+)
+generator.add_argument(
+    "--quality",
+    help="WebP and JPEG quality, from 0 to 100",
+    default=None,
+)
+generator.add_argument(
+    "--objects-format",
+    help="Format of the combined metadata file, a JSON array or JSON Lines",
+    choices=["json", "jsonl"],
+    default="json",
+)
 
 # add flags
 generator.add_argument(
@@ -53,6 +123,59 @@ generator.add_argument(
     action="store_true",
     default=False,
 )
+generator.add_argument(
+    "--shard",
+    help="Generate only the i-th of N slices of the collection, given as i/N and counting from 0",
+    default=None,
+)
+generator.add_argument(
+    "--profile",
+    help="Write a report of the time spent in each generation stage to the output folder",
+    action="store_true",
+    default=False,
+)
+generator.add_argument(
+    "--cprofile",
+    help="With --profile, also dump the cProfile stats of each stage",
+    action="store_true",
+    default=False,
+)
+generator.add_argument(
+    "--no-validation-cache",
+    help="Validate the configuration even if it and its trait files are unchanged since it was last validated",
+    action="store_true",
+    default=False,
+)
+generator.add_argument(
+    "--resume",
+    help="Resume an interrupted generation in the output folder, with its original settings",
+    action="store_true",
+    default=False,
+)
+generator.add_argument(
+    "--compact-metadata",
+    help="Write token metadata files without indentation",
+    action="store_true",
+    default=False,
+)
+generator.add_argument(
+    "--optimize",
+    help="Spend extra encoding time minimizing PNG and JPEG file sizes",
+    action="store_true",
+    default=None,
+)
+generator.add_argument(
+    "--lossless",
+    help="Encode WebP images losslessly",
+    action="store_true",
+    default=None,
+)
+generator.add_argument(
+    "--drop-alpha",
+    help="Save fully opaque images without an alpha channel",
+    action="store_true",
+    default=None,
+)
 
 # parse and validate arguments
 args = vars(generator.parse_args())
@@ -67,7 +190,15 @@ elif args["command"] == "generate":
     generator.generate()
 
 elif args["command"] == "update_metadata":
-    update_metadata(args["image_path"], args["output"], args["verbose"])
+    update_metadata(
+        args["image_path"],
+        args["output"],
+        args["verbose"],
+        workers=int(args["write_workers"]),
+    )
+
+elif args["command"] == "merge":
+    merge_shards(args["output"], args["verbose"])
 
 elif args["command"] == "build_config":
     if args["output"] == "./output":
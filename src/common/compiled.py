@@ -0,0 +1,210 @@
+import os
+
+import numpy as np
+
+
+class CompiledConfig:
+    """
+    Lookup tables derived once from a validated configuration, so that
+    sampling, incompatibility checks and rendering never have to scan the raw
+    config dict per token.
+
+    Genomes are represented as a list of per-layer value indices. Each layer's
+    value table holds its distinct values first, followed by any default
+    incompatibility values, since a default can replace the trait of any layer.
+    """
+
+    def __init__(self, config: dict):
+        """
+        :param config: The validated configuration dict.
+        """
+        self.config = config
+        self.layer_names = [layer["name"] for layer in config["layers"]]
+        self.layer_positions = {}
+        for position, name in enumerate(self.layer_names):
+            self.layer_positions.setdefault(name, position)
+
+        self.values = []
+        self.value_indices = []
+        self.canonical = []
+        self.trait_values_and_weights = []
+        self.cum_weights = []
+        self.value_weights = []
+        self.trait_paths = []
+        for layer in config["layers"]:
+            value_indices = {}
+            trait_paths = []
+            for value, filename in zip(layer["values"], layer["filename"]):
+                if value not in value_indices:
+                    value_indices[value] = len(value_indices)
+                    trait_paths.append(
+                        os.path.abspath(
+                            "{}/{}.png".format(layer["trait_path"], filename)
+                        )
+                    )
+
+            # sampled positions map onto the first value with the same name
+            self.canonical.append(
+                np.array(
+                    [value_indices[value] for value in layer["values"]], dtype=np.intp
+                )
+            )
+
+            # total weight of each distinct value, defaults are never sampled
+            value_weights = np.zeros(len(value_indices), dtype=np.float64)
+            np.add.at(value_weights, self.canonical[-1], layer["weights"])
+            self.value_weights.append(value_weights)
+
+            for incompatibility in config["incompatibilities"]:
+                default = incompatibility.get("default")
+                if default and default["value"] not in value_indices:
+                    value_indices[default["value"]] = len(value_indices)
+                    trait_paths.append(
+                        os.path.abspath("{}.png".format(default["filename"]))
+                    )
+
+            self.values.append(list(value_indices))
+            self.value_indices.append(value_indices)
+            self.trait_paths.append(trait_paths)
+            self.trait_values_and_weights.append(
+                list(zip(layer["values"], layer["weights"]))
+            )
+            self.cum_weights.append(
+                np.cumsum(np.asarray(layer["weights"], dtype=np.float64))
+            )
+
+        self.rules = [
+            self.__compile_rule(incompatibility)
+            for incompatibility in config["incompatibilities"]
+        ]
+
+        # per (layer, value) bitsets of the rules that value triggers, and per
+        # rule the bitsets / lookup tables of the values it forbids per layer
+        self.trigger_masks = [[0] * len(values) for values in self.values]
+        self.forbidden_masks = []
+        self.forbidden_tables = []
+        for rule, (layer, value, forbidden, _) in enumerate(self.rules):
+            masks = []
+            tables = []
+            for trait, trait_forbidden in enumerate(forbidden):
+                if trait_forbidden:
+                    masks.append((trait, sum(1 << index for index in trait_forbidden)))
+                    table = np.zeros(len(self.values[trait]), dtype=bool)
+                    table[list(trait_forbidden)] = True
+                    tables.append((trait, table))
+            if value is not None and masks:
+                self.trigger_masks[layer][value] |= 1 << rule
+            self.forbidden_masks.append(masks)
+            self.forbidden_tables.append(tables)
+
+    def __compile_rule(self, incompatibility: dict) -> tuple:
+        """
+        Translates an incompatibility into index space.
+
+        :return: A tuple of the trigger layer, the trigger value index (or
+            None if the layer never takes that value), the forbidden value
+            indices of every layer, and the default value index of every layer
+            (or None if the incompatibility has no default).
+        """
+        layer = self.layer_positions[incompatibility["layer"]]
+        forbidden = [
+            {
+                value_indices[value]
+                for value in incompatibility["incompatible_with"]
+                if value in value_indices
+            }
+            for value_indices in self.value_indices
+        ]
+        default = None
+        if "default" in incompatibility:
+            default = [
+                value_indices[incompatibility["default"]["value"]]
+                for value_indices in self.value_indices
+            ]
+        return (
+            layer,
+            self.value_indices[layer].get(incompatibility["value"]),
+            forbidden,
+            default,
+        )
+
+    def apply_incompatibilities(self, genome: list, rules: int = None) -> bool:
+        """
+        Applies the incompatibilities to a candidate genome in place, swapping
+        in default values where one is set. Rules are evaluated in config
+        order, exactly like the trait-name based check they replace, but only
+        the rules triggered by one of the genome's values are visited.
+
+        :param genome: The candidate genome's value indices.
+        :param rules: A bitset of the rule indices to apply, defaults to all.
+        :return: False if the candidate hit an incompatibility without a
+            default, True otherwise.
+        """
+        pending = 0
+        for layer, value in enumerate(genome):
+            pending |= self.trigger_masks[layer][value]
+        if rules is not None:
+            pending &= rules
+
+        while pending:
+            rule = (pending & -pending).bit_length() - 1
+            pending &= pending - 1
+            layer, value, _, default = self.rules[rule]
+            for trait, mask in self.forbidden_masks[rule]:
+                if genome[layer] == value and mask >> genome[trait] & 1:
+                    # if a default incompatibility value is set, use it instead
+                    if default is None:
+                        return False
+                    genome[trait] = default[trait]
+
+                    # the default may in turn trigger one of the later rules
+                    triggered = self.trigger_masks[trait][default[trait]]
+                    triggered = triggered >> (rule + 1) << (rule + 1)
+                    pending |= triggered if rules is None else triggered & rules
+        return True
+
+    def check_batch(self, genomes: np.ndarray) -> np.ndarray:
+        """
+        Applies the incompatibilities to a matrix of candidate genomes in place,
+        one vectorized pass per rule that any of the candidates triggers.
+
+        :param genomes: The candidate genomes' value indices, one per row.
+        :return: A boolean array marking the candidates that are valid.
+        """
+        valid = np.ones(len(genomes), dtype=bool)
+        pending = 0
+        for layer, masks in enumerate(self.trigger_masks):
+            for value in np.unique(genomes[:, layer]).tolist():
+                pending |= masks[value]
+
+        while pending:
+            rule = (pending & -pending).bit_length() - 1
+            pending &= pending - 1
+            layer, value, _, default = self.rules[rule]
+            active = valid & (genomes[:, layer] == value)
+            for trait, table in self.forbidden_tables[rule]:
+                hit = active & table[genomes[:, trait]]
+                if not hit.any():
+                    continue
+                if default is None:
+                    valid &= ~hit
+                    active &= ~hit
+                    continue
+                genomes[hit, trait] = default[trait]
+                if trait == layer:
+                    active &= genomes[:, layer] == value
+                triggered = self.trigger_masks[trait][default[trait]]
+                pending |= triggered >> (rule + 1) << (rule + 1)
+        return valid
+
+    def genome_traits(self, genome: list) -> list[str]:
+        """
+        Resolves a genome's value indices to their trait values.
+        """
+        return [values[index] for values, index in zip(self.values, genome)]
+
+    def genome_paths(self, genome: list) -> list[str]:
+        """
+        Resolves a genome's value indices to the trait image files to layer.
+        """
+        return [paths[index] for paths, index in zip(self.trait_paths, genome)]
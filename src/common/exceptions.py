@@ -1,2 +1,6 @@
 class ConfigValidationError(Exception):
     pass
+
+
+class GenerationError(Exception):
+    pass
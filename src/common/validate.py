@@ -1,15 +1,207 @@
+import hashlib
+import json
 import os
+import struct
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from src.common.exceptions import ConfigValidationError
+from src.utils.encoding import ImageEncoder
+from src.utils.io import write_json
 
+# bumped whenever validation gets stricter, so earlier results are not reused
+VALIDATION_VERSION = 1
+# the number of validated configurations the cache remembers
+CACHE_ENTRIES = 64
 
-def validate_config(config: dict) -> bool:
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the bit depths allowed for every PNG color type
+PNG_BIT_DEPTHS = {
+    0: (1, 2, 4, 8, 16),
+    2: (8, 16),
+    3: (1, 2, 4, 8),
+    4: (8, 16),
+    6: (8, 16),
+}
+
+
+def read_png_header(path: str) -> tuple[int, int, int, int]:
+    """
+    Reads the image header of a PNG file, without decoding any pixels.
+
+    :param path: The PNG file path.
+    :return: The width, height, bit depth and color type of the image.
+    """
+    with open(path, "rb") as f:
+        header = f.read(33)
+    if len(header) < 33 or not header.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    length, chunk, data, crc = struct.unpack(">I4s13sI", header[8:])
+    if length != 13 or chunk != b"IHDR" or zlib.crc32(chunk + data) != crc:
+        raise ValueError("Corrupt PNG header")
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", data[:10])
+    if not width or not height or bit_depth not in PNG_BIT_DEPTHS.get(color_type, ()):
+        raise ValueError("Corrupt PNG header")
+    return width, height, bit_depth, color_type
+
+
+def _check_trait_file(path: str):
+    """
+    Checks that a trait file exists and has a valid PNG header.
+
+    :return: The image size, or an error message.
+    """
+    if not os.path.isfile(path):
+        return "File not found"
+    try:
+        width, height, bit_depth, color_type = read_png_header(path)
+    except (OSError, ValueError) as e:
+        return "{}".format(e.strerror if isinstance(e, OSError) else e)
+    if color_type == 0 and bit_depth == 16:
+        # Pillow clips 16-bit grayscale rather than scaling it to 8 bits
+        return "16-bit grayscale images are not supported"
+    return width, height
+
+
+def validate_trait_files(files: list[tuple[str, str]], workers: int = None):
+    """
+    Checks every trait file's PNG header in parallel, and reports every
+    missing, unreadable or differently sized file at once.
+
+    :param files: The config location and path of every trait file.
+    :param workers: The number of threads reading headers, defaults to the
+        thread pool's default.
+    """
+    paths = list(dict.fromkeys(path for _, path in files))
+    with ThreadPoolExecutor(workers) as executor:
+        results = dict(zip(paths, executor.map(_check_trait_file, paths)))
+
+    # images are composited onto each other, so they all need the same size
+    sizes = Counter(result for result in results.values() if isinstance(result, tuple))
+    expected = max(sizes, key=sizes.get) if sizes else None
+
+    errors = []
+    for location, path in files:
+        result = results[path]
+        if isinstance(result, str):
+            errors.append("{}: {}: '{}'".format(location, result, path))
+        elif result != expected:
+            errors.append(
+                "{}: Invalid image size: {}x{}. Expected size: {}x{}: '{}'".format(
+                    location, *result, *expected, path
+                )
+            )
+    if errors:
+        raise ConfigValidationError(
+            "Found {} invalid trait file{}:\n{}".format(
+                len(errors), "s" if len(errors) > 1 else "", "\n".join(errors)
+            )
+        )
+
+
+def default_validation_cache() -> str:
+    """
+    The path of the validation cache in the user's cache directory.
+    """
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "nft-generator-py",
+        "validation.json",
+    )
+
+
+def list_trait_files(config: dict) -> list[tuple[str, str]]:
+    """
+    Lists the trait files of a structurally valid configuration.
+
+    :param config: The configuration dict.
+    :return: The config location and path of every layer file and default
+        incompatibility file.
+    """
+    files = []
+    for i, layer in enumerate(config["layers"]):
+        for j, filename in enumerate(layer["filename"]):
+            files.append(
+                (
+                    'config["layers"][{}]["filename"][{}]'.format(i, j),
+                    "{}/{}.png".format(layer["trait_path"], filename),
+                )
+            )
+    for i, incompatibility in enumerate(config["incompatibilities"]):
+        if "default" in incompatibility:
+            files.append(
+                (
+                    'config["incompatibilities"][{}]["default"]["filename"]'.format(i),
+                    "{}.png".format(incompatibility["default"]["filename"]),
+                )
+            )
+    return files
+
+
+def _fingerprint(files: list[tuple[str, str]]) -> str:
+    """
+    Hashes the modification time and size of every trait file, or returns
+    None if one of them can't be read.
+    """
+    digest = hashlib.blake2b(os.getcwd().encode(), digest_size=16)
+    for path in dict.fromkeys(path for _, path in files):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        digest.update(
+            "{}\0{}\0{}\n".format(path, stat.st_mtime_ns, stat.st_size).encode()
+        )
+    return digest.hexdigest()
+
+
+def _read_cache(path: str) -> dict:
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+
+def _write_cache(path: str, entries: dict, key: str, fingerprint: str):
+    entries.pop(key, None)
+    entries[key] = fingerprint
+    # forget the least recently validated configurations
+    for old in list(entries)[:-CACHE_ENTRIES]:
+        del entries[old]
+    try:
+        write_json(path, entries)
+    except OSError:
+        # the cache only saves time, so a read-only cache directory is fine
+        pass
+
+
+def validate_config(config: dict, workers: int = None, cache: str = None) -> bool:
     """
     Validates the generation configuration
 
     :param config: The provided configuration dict
+    :param workers: The number of threads checking trait files.
+    :param cache: The path of a cache of validated configurations, keyed by
+        the configuration and the modification times and sizes of its trait
+        files. An unchanged configuration is not validated again.
     :return: True if the configuration is valid, panics otherwise.
     """
+    if cache is not None:
+        key = "{}:{}".format(
+            VALIDATION_VERSION,
+            hashlib.blake2b(
+                json.dumps(config, sort_keys=True).encode(), digest_size=16
+            ).hexdigest(),
+        )
+        entries = _read_cache(cache)
+        # only valid configurations are cached, so listing their files is safe
+        if key in entries and entries[key] == _fingerprint(list_trait_files(config)):
+            return
+
     all_trait_values = []
     required_config_values = list(
         zip(
@@ -111,16 +303,6 @@ def validate_config(config: dict) -> bool:
                             )
                         )
 
-                    # check that the file exists
-                    if not os.path.isfile(
-                        "{}/{}.png".format(layer["trait_path"], filename)
-                    ):
-                        raise ConfigValidationError(
-                            'config["layers"][{}]["{}"][{}]: File not found: \'{}/{}.png\''.format(
-                                i, required_key[0], j, layer["trait_path"], filename
-                            )
-                        )
-
         # ensure each layer["values"] has a corresponding layer["filename"] and layer["weights"]
         if len(layer["values"]) != len(layer["filename"]) or len(
             layer["values"]
@@ -134,6 +316,10 @@ def validate_config(config: dict) -> bool:
                 )
             )
 
+    # sets of the values and layers incompatibilities can refer to
+    trait_values = set(all_trait_values)
+    layer_names = {layer["name"] for layer in config["layers"]}
+
     # check the incompatibilities and their config values
     for i, incompatibility in enumerate(config["incompatibilities"]):
         # check if all required incompatibility keys are present
@@ -155,7 +341,7 @@ def validate_config(config: dict) -> bool:
 
             # check if the incompatibility values are valid
             if required_key[0] == "value":
-                if incompatibility["value"] not in all_trait_values:
+                if incompatibility["value"] not in trait_values:
                     raise ConfigValidationError(
                         'config["incompatibilities"][{}]["{}"]: Invalid incompatibility value: \'{}\'. Expected one of: {}'.format(
                             i,
@@ -177,7 +363,7 @@ def validate_config(config: dict) -> bool:
                             )
                         )
 
-                    if incompatible_with not in all_trait_values:
+                    if incompatible_with not in trait_values:
                         raise ConfigValidationError(
                             'config["incompatibilities"][{}]["{}"][{}]: Invalid incompatibility incompatible_with: \'{}\'. Expected one of: {}'.format(
                                 i,
@@ -190,9 +376,7 @@ def validate_config(config: dict) -> bool:
 
             # check if the incompatibility default values are valid
             if required_key[0] == "layer":
-                if incompatibility["layer"] not in [
-                    layer["name"] for layer in config["layers"]
-                ]:
+                if incompatibility["layer"] not in layer_names:
                     raise ConfigValidationError(
                         'config["incompatibilities"][{}]["{}"]: Invalid incompatibility layer: \'{}\'. Expected one of: {}'.format(
                             i,
@@ -201,3 +385,45 @@ def validate_config(config: dict) -> bool:
                             [layer["name"] for layer in config["layers"]],
                         )
                     )
+
+        # check the optional default incompatibility value
+        if "default" in incompatibility:
+            default = incompatibility["default"]
+            if not isinstance(default, dict):
+                raise ConfigValidationError(
+                    "config[\"incompatibilities\"][{}]: Invalid incompatibility configuration value: 'default'. Expected type: {}".format(
+                        i, dict
+                    )
+                )
+            for key in ["value", "filename"]:
+                if not isinstance(default.get(key), str):
+                    raise ConfigValidationError(
+                        'config["incompatibilities"][{}]["default"]: Invalid default {}: \'{}\'. Expected type: {}'.format(
+                            i, key, default.get(key), str
+                        )
+                    )
+
+    # check the optional output encoding settings
+    if "output" in config:
+        if not isinstance(config["output"], dict):
+            raise ConfigValidationError(
+                "Invalid configuration value: 'output'. Expected type: {}".format(dict)
+            )
+        for key in config["output"]:
+            if key not in ImageEncoder.OPTIONS:
+                raise ConfigValidationError(
+                    "config[\"output\"]: Invalid output setting: '{}'. Expected one of: {}".format(
+                        key, ImageEncoder.OPTIONS
+                    )
+                )
+        try:
+            ImageEncoder(**config["output"])
+        except (TypeError, ValueError) as e:
+            raise ConfigValidationError('config["output"]: {}'.format(e))
+
+    # files changed while their headers are read are validated again next time
+    trait_files = list_trait_files(config)
+    fingerprint = _fingerprint(trait_files) if cache is not None else None
+    validate_trait_files(trait_files, workers)
+    if fingerprint is not None:
+        _write_cache(cache, entries, key, fingerprint)
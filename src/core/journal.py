@@ -0,0 +1,94 @@
+import json
+import os
+
+import numpy as np
+
+from src.core.manifest import DIGEST_SIZE
+
+
+class Journal:
+    """
+    An append-only record of the tokens whose image was written or failed to
+    render, kept next to `.generatorrc` so an interrupted generation can be
+    resumed. Records are flushed to disk as they are written, and a record
+    cut short by a crash is ignored when the journal is read back.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path to the journal file.
+        """
+        self.path = path
+        self.file = None
+
+    def read(self, tokens: range) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Reads back the outcome of every token recorded so far. The last record
+        of a token wins, so a failed token that was re-rendered counts as done.
+
+        :param tokens: The token ids to read the records of, others are
+            skipped.
+        :return: The render input hash of every token, indexed by its offset
+            in the range, and masks of the written and the failed tokens.
+        """
+        keys = np.zeros((len(tokens), DIGEST_SIZE), dtype=np.uint8)
+        done = np.zeros(len(tokens), dtype=bool)
+        failed = np.zeros(len(tokens), dtype=bool)
+        if not os.path.exists(self.path):
+            return keys, done, failed
+        with open(self.path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                status, _, rest = line.rstrip("\n").partition(" ")
+                token_id, _, detail = rest.partition(" ")
+                if not token_id.isnumeric() or int(token_id) not in tokens:
+                    continue
+                index = int(token_id) - tokens.start
+                if status == "done":
+                    try:
+                        key = bytes.fromhex(detail)
+                    except ValueError:
+                        continue
+                    if len(key) != DIGEST_SIZE:
+                        continue
+                    keys[index] = np.frombuffer(key, dtype=np.uint8)
+                    done[index], failed[index] = True, False
+                elif status == "failed":
+                    done[index], failed[index] = False, True
+        return keys, done, failed
+
+    def open(self, append: bool = False) -> "Journal":
+        """
+        Opens the journal for writing.
+
+        :param append: Whether to keep the existing records, or start over.
+        """
+        self.file = open(self.path, "a" if append else "w")
+        return self
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def record(self, results: list):
+        """
+        Records the outcome of a chunk of tokens and syncs it to disk.
+
+        :param results: The token id, render input hash and error message, if
+            any, of every token.
+        """
+        self.file.write(
+            "".join(
+                (
+                    "done {} {}\n".format(token_id, key.hex())
+                    if error is None
+                    else "failed {} {}\n".format(token_id, json.dumps(error))
+                )
+                for token_id, key, error in results
+            )
+        )
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def __exit__(self, *exc_info):
+        self.file.close()
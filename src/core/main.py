@@ -1,20 +1,63 @@
+import hashlib
+import itertools
+import json
 import os
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Iterator
 
-from PIL import Image
+import numpy as np
 
-from src.common.validate import validate_config
-from src.utils.calc import calculate_possible_combinations
-from src.utils.io import read_json, write_file, write_json
+from src.common.compiled import CompiledConfig
+from src.common.exceptions import GenerationError
+from src.common.validate import default_validation_cache, validate_config
+from src.core.journal import Journal
+from src.core.manifest import Manifest, hash_bytes, hash_file
+from src.core.metadata import MetadataWriter
+from src.core.pipeline import Pipeline
+from src.core.profiler import Profiler
+from src.core.render import (
+    Renderer,
+    init_worker,
+    map_tasks,
+    plan_prefixes,
+    render_in_worker,
+)
+from src.core.shards import parse_shard, shard_range, shard_suffix
+from src.core.stats import SamplingStats
+from src.core.store import GenomeStore
+from src.utils.cache import ImageCache, PrefixCache
+from src.utils.calc import count_possible_combinations
+from src.utils.composite import TraitLayer
+from src.utils.encoding import ImageEncoder
+from src.utils.io import (
+    JsonStreamWriter,
+    list_token_files,
+    read_json,
+    read_toml,
+    tomlify,
+    write_bytes,
+    write_file,
+)
 from src.utils.logger import get_logger, get_progress_bar
-from src.utils.random import seeded_weighted_selection
+from src.utils.random import BatchSampler, UniqueSampler, seeded_weighted_selection
 
 
 class Generator:
+    # tokens sampled at once by the batch sampler
+    BATCH_SIZE = 4096
+
     def __init__(self, **args):
         # set verbosity level and initialize logger
         self.logger = get_logger(args["verbose"])
+        self.profiler = Profiler(args["profile"], cprofile=args["cprofile"])
+
+        # resumed generations reuse the settings they were started with
+        self.resume = args["command"] == "generate" and args["resume"]
+        if self.resume:
+            args = self.__resume_args(args)
 
         if args["command"] in ["generate", "validate"]:
             if not args["config"]:
@@ -35,8 +78,37 @@ class Generator:
             # read configuration and validate it
             self.logger.debug("Loading configuration from '%s'", args["config"])
             self.config = read_json(args["config"])
+            self.config_path = os.path.abspath(args["config"])
+            self.config_hash = hashlib.blake2b(
+                json.dumps(self.config, sort_keys=True).encode(), digest_size=16
+            ).hexdigest()
+            if self.resume and self.config_hash != args["config_hash"]:
+                raise ValueError(
+                    "Configuration file '{}' changed since the generation was started".format(
+                        args["config"]
+                    )
+                )
             self.logger.debug("Validating configuration")
-            validate_config(self.config)
+            with self.profiler.stage("validate"):
+                validate_config(
+                    self.config,
+                    cache=(
+                        None
+                        if args["no_validation_cache"]
+                        else default_validation_cache()
+                    ),
+                )
+
+            # derive the lookup tables used by every per-token hot path
+            with self.profiler.stage("compile"):
+                self.compiled = CompiledConfig(self.config)
+
+            # output settings from the CLI take precedence over the config
+            encoding = dict(self.config.get("output", {}))
+            for option in ImageEncoder.OPTIONS:
+                if args[option] is not None:
+                    encoding[option] = args[option]
+            self.encoder = ImageEncoder(**encoding)
 
         # set arguments
         self.seed = (
@@ -48,175 +120,732 @@ class Generator:
         self.output = args["output"]
         self.allow_duplicates = args["allow_duplicates"]
         self.image_path = args["image_path"]
+        self.max_retries = int(args["max_retries"])
+        self.sampler = args["sampler"]
+        self.image_cache = ImageCache(
+            int(args["image_cache_size"]) << 20,
+            load=self.profiler.wrap("decode", TraitLayer.open),
+        )
+        self.prefix_cache = PrefixCache(int(args["prefix_cache_size"]) << 20)
+        self.workers = int(args["workers"]) if args["workers"] else os.cpu_count()
+        self.render_backend = args["render_backend"]
+        self.objects_format = args["objects_format"]
+        self.compact_metadata = args["compact_metadata"]
+        self.encode_workers = (
+            int(args["encode_workers"]) if args["encode_workers"] else self.workers
+        )
+        self.write_workers = int(args["write_workers"])
+        self.queue_size = int(args["queue_size"])
+        self.shard, self.shards = parse_shard(args["shard"])
+        if self.sampler == "unique" and self.allow_duplicates:
+            raise ValueError("The unique sampler cannot allow duplicates.")
 
         # initialize state
         self.nonce = 0
-        self.all_genomes = []
-        self.all_combinations = []
+        self.stats = SamplingStats()
+
+    def __resume_args(self, args: dict) -> dict:
+        """
+        Replaces the generation settings with the ones recorded in the
+        output folder's `.generatorrc`.
+        """
+        path = "{}/.generatorrc".format(args["output"])
+        if not os.path.exists(path):
+            raise ValueError("No generation to resume in '{}'".format(args["output"]))
+        settings = read_toml(path)
+
+        args = dict(args)
+        for key in [
+            "config",
+            "config_hash",
+            "seed",
+            "start_at",
+            "allow_duplicates",
+            "no_pad",
+            "sampler",
+            "objects_format",
+            "compact_metadata",
+            *ImageEncoder.OPTIONS,
+        ]:
+            args[key] = settings.get(key)
+        args["amount"] = str(settings["amount"])
+        args["shard"] = self.__resume_shard(args, settings)
+
+        # the recorded path ends up in the metadata, unless the folder moved
+        if os.path.exists(settings["output"]) and os.path.samefile(
+            settings["output"], args["output"]
+        ):
+            args["output"] = settings["output"]
+        return args
+
+    def __resume_shard(self, args: dict, settings: dict) -> str:
+        """
+        Picks the shard to resume. Shards can share an output folder, so its
+        `.generatorrc` records the last shard started: another shard of the
+        same generation can be chosen with `--shard`.
+        """
+        shards = settings.get("shards", 1)
+        if args["shard"] is not None:
+            shard, count = parse_shard(args["shard"])
+            if count != shards:
+                raise ValueError(
+                    "Cannot resume shard {} in '{}', which was generated in {} shard{}".format(
+                        args["shard"], args["output"], shards, "s" if shards > 1 else ""
+                    )
+                )
+            return args["shard"]
+        if shards == 1:
+            return None
 
-    def __tomlify(self) -> str:
+        started = [
+            shard
+            for shard in range(shards)
+            if os.path.exists(
+                "{}/.generator-journal{}".format(
+                    args["output"], shard_suffix(shard, shards)
+                )
+            )
+        ]
+        if len(started) > 1:
+            raise ValueError(
+                "Shards {} of {} were generated in '{}', choose the one to resume with --shard".format(
+                    started, shards, args["output"]
+                )
+            )
+        shard = started[0] if started else settings.get("shard", 0)
+        return "{}/{}".format(shard, shards)
+
+    def __settings(self) -> dict:
         """
-        Converts a dictionary to TOML format.
+        The settings that determine the generated output, as recorded in
+        `.generatorrc`.
         """
-        toml = ""
-        obj = {
+        return {
             "amount": self.amount,
             "seed": self.seed,
             "start_at": self.start_at,
             "output": self.output,
             "allow_duplicates": self.allow_duplicates,
             "no_pad": self.no_pad,
+            "sampler": self.sampler,
+            "format": self.encoder.format,
+            "objects_format": self.objects_format,
+            "compact_metadata": self.compact_metadata,
+            "shard": self.shard,
+            "shards": self.shards,
+            **{
+                option: getattr(self.encoder, option)
+                for option in ImageEncoder.OPTIONS
+                if option != "format"
+            },
+            "config": self.config_path,
+            "config_hash": self.config_hash,
         }
-        for key, value in obj.items():
-            if isinstance(value, dict):
-                toml += "[{}]\n".format(key)
-                toml += self.__tomlify(value)
-            else:
-                toml += "{} = {}\n".format(key, value)
-        return toml
 
-    def __build_genome_metadata(self, token_id: int = 0):
+    def __checked(self, candidates: Iterator[list]) -> Iterator[list]:
         """
-        Builds the generation / NFT metadata for a single NFT.
+        Applies the incompatibilities to each candidate genome, yielding None
+        in place of the ones that hit an incompatibility.
+        """
+        for genome in candidates:
+            yield genome if self.compiled.apply_incompatibilities(genome) else None
+
+    def __unique_candidates(self, sampler: UniqueSampler) -> Iterator[list]:
+        """
+        Yields distinct candidate genomes, drawn and checked a batch at a time,
+        None in place of the ones that hit an incompatibility.
         """
+        batch_size = min(self.BATCH_SIZE, self.amount)
+        while len(genomes := sampler.sample_batch(batch_size)):
+            valid = self.compiled.check_batch(genomes)
+            for genome, compatible in zip(genomes.tolist(), valid.tolist()):
+                yield genome if compatible else None
 
-        genome_traits = {}
+    def __legacy_candidates(self) -> Iterator[list]:
+        """
+        Yields candidate genomes, reseeding the random module for every draw.
+        """
+        while True:
+            yield [
+                value_indices[
+                    seeded_weighted_selection(
+                        trait_values_and_weights, seed=self.seed, nonce=self.nonce + i
+                    )
+                ]
+                for i, (value_indices, trait_values_and_weights) in enumerate(
+                    zip(
+                        self.compiled.value_indices,
+                        self.compiled.trait_values_and_weights,
+                    )
+                )
+            ]
+            self.nonce += len(self.compiled.values)
 
-        # select traits for each layer
-        for layer in self.config["layers"]:
-            trait_values_and_weights = list(zip(layer["values"], layer["weights"]))
-            genome_traits[layer["name"]] = seeded_weighted_selection(
-                trait_values_and_weights, seed=self.seed, nonce=self.nonce
+    def __batch_candidates(
+        self, sampler: BatchSampler, token_id: int, genome: list, attempt: int
+    ) -> Iterator[list]:
+        """
+        Yields the token's pre-sampled attempts: None for each incompatible
+        one, then the first compatible one. Further attempts, if that one
+        is a duplicate, are drawn one at a time from the batch sampler.
+        """
+        for _ in range(attempt):
+            yield None
+        yield genome
+        for attempt in itertools.count(attempt + 1):
+            genome = self.__canonicalize(sampler.sample([token_id], attempt))
+            genome = genome[0].tolist()
+            yield genome if self.compiled.apply_incompatibilities(genome) else None
+
+    def __resample_batch(
+        self, sampler: BatchSampler, token_ids: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples a batch of tokens, redrawing every incompatible genome of the
+        batch at once with the next attempt until all of them are compatible
+        or the retry budget runs out.
+
+        :param sampler: The batch sampler to draw from.
+        :param token_ids: The tokens to sample.
+        :return: The genomes of the tokens, whether each one is compatible,
+            and the attempt each one was drawn at.
+        """
+        genomes = self.__canonicalize(sampler.sample(token_ids))
+        valid = self.compiled.check_batch(genomes)
+        attempts = np.zeros(len(token_ids), dtype=np.int64)
+        for attempt in range(1, self.max_retries + 1):
+            rejected = np.flatnonzero(~valid)
+            if not len(rejected):
+                break
+            redrawn = self.__canonicalize(sampler.sample(token_ids[rejected], attempt))
+            # defaults are applied in place, before the rows are copied back
+            valid[rejected] = self.compiled.check_batch(redrawn)
+            genomes[rejected] = redrawn
+            attempts[rejected] = attempt
+        return genomes, valid, attempts
+
+    def __canonicalize(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Maps a matrix of sampled value positions onto canonical value indices.
+        """
+        for layer, canonical in enumerate(self.compiled.canonical):
+            indices[:, layer] = canonical[indices[:, layer]]
+        return indices
+
+    def __sample_genome(self, token_id: int, candidates: Iterator[list]) -> list:
+        """
+        Picks and stores the genome of a single NFT.
+
+        :param token_id: The token to sample the genome for.
+        :param candidates: The checked candidate genomes to pick the first valid
+            one from, None for candidates that hit an incompatibility.
+        :return: The genome's value indices.
+        """
+        attempts = 0
+        for _, genome in zip(range(self.max_retries + 1), candidates):
+            attempts += 1
+            if genome is None:
+                self.stats.reject("incompatible")
+                continue
+
+            if not self.allow_duplicates and not self.genomes.add(genome):
+                self.stats.reject("duplicate")
+                continue
+            self.stats.retried(token_id, attempts - 1)
+            return genome
+
+        self.stats.retried(token_id, attempts - 1)
+        if attempts <= self.max_retries:
+            raise GenerationError(
+                "Ran out of unique combinations to sample for token {} after {:,} of {:,}. {}".format(
+                    token_id,
+                    len(self.genomes),
+                    self.max_combinations,
+                    self.stats.summary(),
+                )
             )
-            self.nonce += 1
-
-        # check for incompatibilities
-        for incompatibility in self.config["incompatibilities"]:
-            for trait in genome_traits:
-                if (
-                    genome_traits[incompatibility["layer"]] == incompatibility["value"]
-                    and genome_traits[trait] in incompatibility["incompatible_with"]
-                ):
-                    # if a default incompatibility value is set, use it instead
-                    if "default" in incompatibility:
-                        genome_traits[trait] = incompatibility["default"]["value"]
-                    else:
-                        return self.__build_genome_metadata(token_id)
-
-        if genome_traits in self.all_combinations and not self.allow_duplicates:
-            return self.__build_genome_metadata(token_id)
-        else:
-            self.all_combinations.append(genome_traits)
-            self.all_genomes.append(
+        raise GenerationError(
+            "Could not sample a valid genome for token {} within {:,} retries. {}".format(
+                token_id, self.max_retries, self.stats.summary()
+            )
+        )
+
+    def __build_genome_metadata(self, token_id: int, genome: list) -> dict:
+        """
+        Builds the generation / NFT metadata for a single NFT.
+
+        :param token_id: The token to build the metadata for.
+        :param genome: The token's genome value indices.
+        """
+        return {
+            "token_id": token_id,
+            "image": "{}/images/{}.{}".format(
+                self.output, token_id, self.encoder.extension
+            ),
+            "name": self.config["name"] + str(token_id).zfill(self.pad_amount),
+            "description": self.config["description"],
+            "attributes": [
                 {
-                    "token_id": token_id,
-                    "image": "{}/images/{}.png".format(self.output, token_id),
-                    "name": self.config["name"] + str(token_id).zfill(self.pad_amount),
-                    "description": self.config["description"],
-                    "attributes": [
-                        {
-                            "trait_type": layer["name"],
-                            "value": genome_traits[layer["name"]],
-                        }
-                        for layer in self.config["layers"]
-                    ],
+                    "trait_type": name,
+                    "value": value,
                 }
+                for name, value in zip(
+                    self.compiled.layer_names,
+                    self.compiled.genome_traits(genome),
+                )
+            ],
+        }
+
+    def __token_candidates(self) -> Iterator[Iterator[list]]:
+        """
+        Yields the candidate genome source for each token, in token order.
+        """
+        if self.sampler == "batch":
+            sampler = BatchSampler(self.compiled.cum_weights, seed=self.seed)
+            end = self.start_at + self.amount
+            for start in range(self.start_at, end, self.BATCH_SIZE):
+                token_ids = np.arange(start, min(start + self.BATCH_SIZE, end))
+                genomes, valid, attempts = self.__resample_batch(sampler, token_ids)
+                for token_id, genome, compatible, attempt in zip(
+                    token_ids.tolist(),
+                    genomes.tolist(),
+                    valid.tolist(),
+                    attempts.tolist(),
+                ):
+                    yield self.__batch_candidates(
+                        sampler, token_id, genome if compatible else None, attempt
+                    )
+        elif self.sampler == "unique":
+            sampler = UniqueSampler(self.compiled.value_weights, seed=self.seed)
+            candidates = self.__unique_candidates(sampler)
+            for _ in range(self.amount):
+                yield candidates
+        else:
+            candidates = self.__checked(self.__legacy_candidates())
+            for _ in range(self.amount):
+                yield candidates
+
+    def sample(self) -> Iterator[tuple[int, list]]:
+        """
+        Samples the genome of every token of the collection, or of the shard
+        being generated, in token order.
+
+        :return: The token id and genome value indices of every token.
+        """
+        tokens = shard_range(self.start_at, self.amount, self.shard, self.shards)
+        self.genomes = GenomeStore(
+            [len(values) for values in self.compiled.values], capacity=self.amount
+        )
+        for i, candidates in enumerate(self.__token_candidates()):
+            token_id = self.start_at + i
+            if token_id == tokens.stop:
+                # later tokens never change the genomes of earlier ones
+                break
+            with self.profiler.stage("sample"):
+                genome = self.__sample_genome(token_id, candidates)
+            # tokens of earlier shards are sampled all the same, so every
+            # shard assigns the same genomes
+            if token_id >= tokens.start:
+                yield token_id, genome
+
+    def __render_tasks(
+        self, previous: Manifest, rendered: tuple[np.ndarray, np.ndarray]
+    ) -> Iterator[list]:
+        """
+        Samples every token, writing its metadata, and yields chunks of
+        render tasks as it goes. Tasks are sorted by genome within a window of
+        chunks, so tokens sharing their first layers are rendered back to back
+        by the same worker and reuse its prefix composites.
+
+        :param previous: The manifest of the last generation in the output
+            folder, whose unchanged metadata files are not rewritten.
+        :param rendered: The render input hash of every token, and a mask of
+            the tokens with a written image, indexed by token offset. Tokens
+            whose render inputs are unchanged are not rendered again.
+        """
+        rendered_keys, written = rendered
+        metadata_written = list_token_files(
+            "{}/metadata".format(self.output), "json", self.tokens
+        )
+        window = []
+        window_size = self.chunk_size * self.workers * 4
+        with JsonStreamWriter(
+            "{}/metadata/all-objects{}.{}".format(
+                self.output, self.suffix, self.objects_format
+            ),
+            lines=self.objects_format == "jsonl",
+        ) as all_objects, MetadataWriter(
+            "{}/metadata".format(self.output),
+            static={"description": self.config["description"]},
+            compact=self.compact_metadata,
+            workers=self.write_workers,
+        ) as metadata_files:
+            for token_id, genome in self.sample():
+                with self.profiler.stage("metadata"):
+                    metadata = self.__build_genome_metadata(token_id, genome)
+                    index = token_id - self.tokens.start
+                    hashes = previous.get(token_id)
+                    digest = metadata_files.write(
+                        token_id,
+                        metadata,
+                        hashes[1] if hashes and metadata_written[index] else None,
+                    )
+                    all_objects.write(metadata)
+
+                key = self.__render_key(genome)
+                self.manifest.set(token_id, key, digest)
+                if written[index] and rendered_keys[index].tobytes() == key:
+                    self.skipped += 1
+                else:
+                    window.append((token_id, tuple(genome), None))
+                    if self.profiler.enabled:
+                        self.queued[token_id] = time.perf_counter()
+                if len(window) == window_size:
+                    yield from self.__chunks(window)
+                    window = []
+            yield from self.__chunks(window)
+
+        self.logger.debug(self.stats.summary())
+
+    def __chunks(self, window: list) -> Iterator[list]:
+        """
+        Sorts a window of render tasks by genome and splits it into chunks,
+        planning which prefix composites each task caches for the rest of its
+        chunk.
+        """
+        window.sort(key=lambda task: task[1])
+        for start in range(0, len(window), self.chunk_size):
+            chunk = window[start : start + self.chunk_size]
+            keep = plan_prefixes([genome for _, genome, _ in chunk])
+            yield [
+                (token_id, (genome, depths), error)
+                for (token_id, genome, error), depths in zip(chunk, keep)
+            ]
+
+    def __rendered(
+        self, journal: Journal, previous: Manifest
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The render input hash of every image in the output folder, according
+        to the last generation's manifest and, when resuming, the journal of
+        the interrupted generation.
+
+        :return: The render input hash of every token, and a mask of the
+            tokens with a written image, indexed by token offset.
+        """
+        keys, written = previous.render_keys.copy(), previous.present.copy()
+        if self.resume:
+            done_keys, done, failed = journal.read(self.tokens)
+            keys[done] = done_keys[done]
+            written |= done
+            written &= ~failed
+            self.logger.info(
+                "Resuming generation, %d of %d NFTs were written and %d failed",
+                np.count_nonzero(done),
+                len(self.tokens),
+                np.count_nonzero(failed),
             )
 
-    def __build_genome_image(self, metadata: dict):
+        written &= list_token_files(
+            "{}/images".format(self.output), self.encoder.extension, self.tokens
+        )
+        return keys, written
+
+    def __hash_traits(self, previous: Manifest) -> dict:
         """
-        Builds the NFT image for a single NFT.
+        Hashes the contents of every trait file, and derives the per-value
+        keys that render input hashes are built from.
         """
-        layers = []
-        try:
-            for index, attr in enumerate(metadata["attributes"]):
-                # get the image for the trait
-                for i, trait in enumerate(self.config["layers"][index]["values"]):
-                    if trait == attr["value"]:
-                        layers.append(
-                            Image.open(
-                                f'{self.config["layers"][index]["trait_path"]}/{self.config["layers"][index]["filename"][i]}.png'
-                            ).convert("RGBA")
-                        )
-                        break
-
-            if len(layers) == 1:
-                rgb_im = layers[0].convert("RGBA")
-            elif len(layers) == 2:
-                main_composite = Image.alpha_composite(layers[0], layers[1])
-                rgb_im = main_composite.convert("RGBA")
-            elif len(layers) >= 3:
-                main_composite = Image.alpha_composite(layers[0], layers[1])
-                for index, remaining in enumerate(layers):
-                    main_composite = Image.alpha_composite(main_composite, remaining)
-                rgb_im = main_composite.convert("RGBA")
-
-            # create folder structure if it doesn't exist
-            rgb_im.save("{}/images/{}.png".format(self.output, metadata["token_id"]))
-
-        except Exception as e:
-            self.logger.error(
-                "Error generating image for token %d: %s", metadata["token_id"], e
+        traits = {
+            path: hash_file(path)
+            for path in sorted(set(itertools.chain(*self.compiled.trait_paths)))
+        }
+        if previous.traits:
+            self.logger.info(
+                "%d of %d trait files changed since the last generation",
+                sum(
+                    previous.traits.get(path) != digest
+                    for path, digest in traits.items()
+                ),
+                len(traits),
             )
 
+        self.settings_key = json.dumps(
+            {option: getattr(self.encoder, option) for option in ImageEncoder.OPTIONS},
+            sort_keys=True,
+        ).encode()
+        self.trait_keys = [
+            [traits[path] for path in paths] for paths in self.compiled.trait_paths
+        ]
+        return traits
+
+    def __render_key(self, genome: list) -> bytes:
+        """
+        The hash of everything a token's image depends on: the encoder
+        settings and the contents of its trait files, in layer order.
+        """
+        return hash_bytes(
+            self.settings_key
+            + b"".join(keys[value] for keys, value in zip(self.trait_keys, genome))
+        )
+
+    def __write_images(self, chunk: list) -> list:
+        """
+        Writes a chunk of encoded images to the output folder.
+        """
+        results = []
+        for token_id, image, error in chunk:
+            if error is None:
+                try:
+                    write_bytes(
+                        "{}/images/{}.{}".format(
+                            self.output, token_id, self.encoder.extension
+                        ),
+                        image,
+                    )
+                except OSError as e:
+                    error = str(e)
+            results.append((token_id, None, error))
+        return results
+
+    def __render_stages(self, stack: ExitStack) -> list:
+        """
+        Builds the pipeline stages that turn chunks of render tasks into
+        written images. Worker processes composite and encode each chunk,
+        falling back to separate compositing and encoding threads where worker
+        processes are unavailable.
+
+        :param stack: Where to register the process pool for shutdown.
+        :return: The name, function and number of workers of every stage.
+        """
+        write = (
+            "write",
+            self.profiler.wrap("write", self.__write_images),
+            self.write_workers,
+        )
+        if self.render_backend == "process":
+            try:
+                pool = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=init_worker,
+                        initargs=(
+                            self.compiled.trait_paths,
+                            self.encoder,
+                            self.image_cache.max_bytes,
+                            self.prefix_cache.max_bytes,
+                            self.profiler.enabled,
+                            self.profile_folder if self.profiler.cprofile else None,
+                        ),
+                    )
+                )
+
+                def render(chunk: list) -> list:
+                    # the main process only waits, the worker reports the
+                    # time it spent in each stage
+                    tasks, timings = pool.submit(render_in_worker, chunk).result()
+                    self.profiler.merge(timings)
+                    return tasks
+
+                return [("render", render, self.workers), write]
+            except (ImportError, NotImplementedError, OSError) as e:
+                self.logger.warning(
+                    "Worker processes are unavailable, rendering with threads: %s", e
+                )
+                self.render_backend = "thread"
+
+        renderer = Renderer(
+            self.compiled.trait_paths,
+            self.encoder,
+            self.image_cache,
+            self.prefix_cache,
+        )
+
+        def composite(chunk: list) -> list:
+            # copy the pixels out of the thread's reused buffer
+            return map_tasks(lambda payload: renderer.composite(*payload).copy(), chunk)
+
+        def encode(chunk: list) -> list:
+            return map_tasks(self.encoder.encode, chunk)
+
+        return [
+            ("composite", self.profiler.wrap("composite", composite), self.workers),
+            ("encode", self.profiler.wrap("encode", encode), self.encode_workers),
+            write,
+        ]
+
+    def __write_profile(self):
+        """
+        Writes the profiling report next to `.generatorrc`, and the cProfile
+        stats of every stage if enabled.
+        """
+        if self.render_backend == "thread":
+            for name, cache in [
+                ("image_cache", self.image_cache),
+                ("prefix_cache", self.prefix_cache),
+            ]:
+                self.profiler.count("{}_hits".format(name), cache.hits)
+                self.profiler.count("{}_misses".format(name), cache.misses)
+
+        report = self.profiler.report()
+        counters = report.pop("counters")
+        report["caches"] = {
+            name: {
+                "hits": counters.get("{}_hits".format(name), 0),
+                "misses": counters.get("{}_misses".format(name), 0),
+                "hit_rate": counters.get("{}_hits".format(name), 0)
+                / max(
+                    1,
+                    counters.get("{}_hits".format(name), 0)
+                    + counters.get("{}_misses".format(name), 0),
+                ),
+            }
+            for name in ["image_cache", "prefix_cache"]
+        }
+        report["sampling"] = {
+            "rejections": dict(self.stats.rejections),
+            "total_rejections": self.stats.total_rejections,
+            "tokens_with_retries": len(self.stats.token_retries),
+            "max_token_retries": self.stats.max_retries,
+        }
+        report["tokens"] = {
+            "rendered": len(self.profiler.latencies),
+            "kept": self.skipped,
+        }
+        report["render_backend"] = self.render_backend
+
+        path = "{}/.generator-profile{}.json".format(self.output, self.suffix)
+        write_file(path, json.dumps(report, indent=4))
+        self.logger.info("Wrote the profiling report to '%s'", path)
+        if self.profiler.cprofile:
+            self.profiler.dump(self.profile_folder)
+            self.logger.info("Wrote cProfile stats to '%s'", self.profile_folder)
+
     def generate(self):
         """
         Generates the NFTs with the given configuration.
         """
         self.logger.info("Starting generation")
 
-        max_combinations = calculate_possible_combinations(self.config)
-        self.logger.debug(
-            "There are {:,} possible unique combinations of this configuration".format(
-                max_combinations
-            )
+        self.max_combinations, exact = count_possible_combinations(
+            self.config, self.compiled
         )
-        if self.amount > max_combinations and not self.allow_duplicates:
-            raise ValueError(
-                "Amount of NFTs to generate ({:,}) is greater than the number of possible unique combinations ({:,})".format(
-                    self.amount, max_combinations
+        if exact:
+            self.logger.debug(
+                "There are {:,} possible unique combinations of this configuration".format(
+                    self.max_combinations
                 )
             )
-
-        self.logger.info("Generating %d NFTs", self.amount)
-        with get_progress_bar(self.amount) as bar:
-            for i in range(self.amount):
-                token_id = self.start_at + i
-                self.__build_genome_metadata(token_id)
-                write_json(
-                    "{}/metadata/{}.json".format(self.output, token_id),
-                    self.all_genomes[-1],
+        else:
+            self.logger.debug(
+                "There are at most {:,} possible unique combinations of this configuration, the count is approximate".format(
+                    self.max_combinations
                 )
-                bar()
-            write_json(
-                "{}/metadata/all-objects.json".format(
-                    self.output,
-                ),
-                self.all_genomes,
             )
-            write_file(
-                "{}/.generatorrc".format(
-                    self.output,
-                ),
-                self.__tomlify(),
+        if self.amount > self.max_combinations and not self.allow_duplicates:
+            raise ValueError(
+                "Amount of NFTs to generate ({:,}) is greater than the number of possible unique combinations ({:,})".format(
+                    self.amount, self.max_combinations
+                )
+            )
+        if (
+            self.amount * 2 > self.max_combinations
+            and not self.allow_duplicates
+            and self.sampler != "unique"
+        ):
+            self.logger.warning(
+                "Generating %d of %d possible combinations will need many retries, consider --sampler unique",
+                self.amount,
+                self.max_combinations,
             )
 
-        self.logger.info("Generating layered images for %d NFTs", self.amount)
+        self.tokens = shard_range(self.start_at, self.amount, self.shard, self.shards)
+        self.suffix = shard_suffix(self.shard, self.shards)
+        if self.shards > 1:
+            self.logger.info(
+                "Generating NFTs %d to %d of %d, shard %d of %d",
+                self.tokens.start,
+                self.tokens.stop - 1,
+                self.amount,
+                self.shard,
+                self.shards,
+            )
+        else:
+            self.logger.info("Generating %d NFTs", self.amount)
+        self.chunk_size = max(1, min(16, len(self.tokens) // (self.workers * 4)))
 
         # make folder structure
         os.makedirs("{}/images/".format(self.output), exist_ok=True)
 
-        with get_progress_bar(len(self.all_genomes)) as bar:
-            with ThreadPoolExecutor(max_workers=25) as pool:
-                try:
-                    futures = [
-                        pool.submit(self.__build_genome_image, genome)
-                        for genome in self.all_genomes
-                    ]
-                    for _ in as_completed(futures):
+        # only images whose render inputs changed since they were written
+        # are rendered again
+        journal = Journal("{}/.generator-journal{}".format(self.output, self.suffix))
+        previous = Manifest.load(
+            "{}/.generator-manifest{}".format(self.output, self.suffix), self.tokens
+        )
+        rendered = self.__rendered(journal, previous)
+        self.manifest = Manifest(previous.path, self.tokens)
+        with self.profiler.stage("hash"):
+            self.manifest.traits = self.__hash_traits(previous)
+        self.skipped = 0
+        self.queued = {}
+        self.profile_folder = "{}/.generator-profile{}".format(self.output, self.suffix)
+
+        # record the settings first, so an interrupted generation can resume
+        write_file("{}/.generatorrc".format(self.output), tomlify(self.__settings()))
+
+        failed = skipped = 0
+        with get_progress_bar(
+            len(self.tokens)
+        ) as bar, ExitStack() as stack, journal.open(append=self.resume):
+            pipeline = Pipeline(self.__render_stages(stack), self.queue_size)
+            try:
+                for chunk in pipeline.run(self.__render_tasks(previous, rendered)):
+                    with self.profiler.stage("journal"):
+                        journal.record(
+                            [
+                                (token_id, self.manifest.get(token_id)[0], error)
+                                for token_id, _, error in chunk
+                            ]
+                        )
+                    for token_id, _, error in chunk:
+                        if self.profiler.enabled:
+                            self.profiler.latency(
+                                time.perf_counter() - self.queued.pop(token_id)
+                            )
+                        if error is not None:
+                            self.logger.error(
+                                "Error generating image for token %d: %s",
+                                token_id,
+                                error,
+                            )
+                            self.manifest.discard(token_id)
+                            failed += 1
                         bar()
-                except KeyboardInterrupt:
-                    self.logger.error("Generation interrupted by user")
-                    return
+                    if self.skipped > skipped:
+                        bar(self.skipped - skipped, skipped=True)
+                        skipped = self.skipped
+            except KeyboardInterrupt:
+                self.logger.error(
+                    "Generation interrupted by user, continue it with --resume"
+                )
+                return
+            if self.skipped > skipped:
+                bar(self.skipped - skipped, skipped=True)
+        self.manifest.save()
+        if self.render_backend == "thread":
+            self.logger.debug(self.image_cache.summary())
+            self.logger.debug(self.prefix_cache.summary())
+
+        if self.profiler.enabled:
+            self.__write_profile()
 
+        if self.skipped:
+            self.logger.info(
+                "Kept %d NFTs whose traits and settings are unchanged", self.skipped
+            )
+        if failed:
+            self.logger.warning(
+                "%d NFTs failed to generate, re-render them with --resume", failed
+            )
         self.logger.info("Generation complete!")
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# the size of every content hash, in bytes
+DIGEST_SIZE = 16
+
+
+def hash_bytes(contents: bytes) -> bytes:
+    """
+    The content hash used throughout the manifest.
+    """
+    return hashlib.blake2b(contents, digest_size=DIGEST_SIZE).digest()
+
+
+def hash_file(path: str) -> bytes:
+    """
+    The content hash of a file.
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(
+            f, lambda: hashlib.blake2b(digest_size=DIGEST_SIZE)
+        ).digest()
+
+
+class Manifest:
+    """
+    The content hashes of a generation's inputs and outputs, kept in the
+    output folder so a later generation with the same seed only re-renders
+    the tokens whose render inputs changed, and only rewrites the metadata
+    files whose contents changed.
+
+    Every token has the hash of its render inputs (the contents of its trait
+    files and the encoder settings) and the hash of its metadata file. They
+    are kept in fixed-width arrays indexed by the token's offset in a range
+    of tokens, which costs 33 bytes per token.
+
+    The file is a JSON header line, followed by the arrays as raw bytes.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: str, tokens: range = range(0)):
+        """
+        :param path: Path to the manifest file.
+        :param tokens: The token ids the manifest can hold.
+        """
+        self.path = path
+        self.tokens = tokens
+        self.traits: dict[str, bytes] = {}
+        self.present = np.zeros(len(tokens), dtype=bool)
+        self.render_keys = np.zeros((len(tokens), DIGEST_SIZE), dtype=np.uint8)
+        self.metadata_digests = np.zeros((len(tokens), DIGEST_SIZE), dtype=np.uint8)
+
+    @classmethod
+    def load(cls, path: str, tokens: range = None) -> "Manifest":
+        """
+        Reads a manifest, which is empty if the file is missing or unreadable.
+
+        :param path: Path to the manifest file.
+        :param tokens: The token ids to read, defaults to every token in the
+            file. Tokens outside the range are skipped without being read.
+        """
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                if header["version"] != cls.VERSION:
+                    raise ValueError("Unsupported manifest version")
+                stored = range(header["start"], header["start"] + header["count"])
+                manifest = cls(path, stored if tokens is None else tokens)
+                manifest.traits = {
+                    trait: bytes.fromhex(digest)
+                    for trait, digest in header["traits"].items()
+                }
+
+                # the stored tokens that are also in the requested range
+                overlap = range(
+                    max(stored.start, manifest.tokens.start),
+                    min(stored.stop, manifest.tokens.stop),
+                )
+                if not len(overlap):
+                    return manifest
+                source = overlap.start - stored.start
+                target = slice(
+                    overlap.start - manifest.tokens.start,
+                    overlap.stop - manifest.tokens.start,
+                )
+                # read straight into the arrays, one column after the other
+                start = f.tell()
+                for array, width in [
+                    (manifest.present, 1),
+                    (manifest.render_keys, DIGEST_SIZE),
+                    (manifest.metadata_digests, DIGEST_SIZE),
+                ]:
+                    f.seek(start + source * width)
+                    if f.readinto(array[target].data) != len(overlap) * width:
+                        raise ValueError("Truncated manifest")
+                    start += len(stored) * width
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(path, range(0) if tokens is None else tokens)
+        return manifest
+
+    def __index(self, token_id: int) -> int:
+        if token_id not in self.tokens:
+            raise IndexError("Token {} is not in the manifest".format(token_id))
+        return token_id - self.tokens.start
+
+    def __contains__(self, token_id: int) -> bool:
+        return token_id in self.tokens and bool(self.present[self.__index(token_id)])
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.present))
+
+    def get(self, token_id: int) -> tuple[bytes, bytes]:
+        """
+        The render input hash and metadata hash of a token, or None.
+        """
+        if token_id not in self:
+            return None
+        index = self.__index(token_id)
+        return (
+            self.render_keys[index].tobytes(),
+            self.metadata_digests[index].tobytes(),
+        )
+
+    def set(self, token_id: int, render_key: bytes, metadata_digest: bytes):
+        """
+        Records the render input hash and metadata hash of a token.
+        """
+        index = self.__index(token_id)
+        self.present[index] = True
+        self.render_keys[index] = np.frombuffer(render_key, dtype=np.uint8)
+        self.metadata_digests[index] = np.frombuffer(metadata_digest, dtype=np.uint8)
+
+    def discard(self, token_id: int):
+        """
+        Forgets a token, if the manifest holds it.
+        """
+        if token_id in self.tokens:
+            self.present[self.__index(token_id)] = False
+
+    def update(self, other: "Manifest"):
+        """
+        Copies the trait hashes, and the tokens in range, of another manifest.
+        """
+        self.traits.update(other.traits)
+        overlap = range(
+            max(self.tokens.start, other.tokens.start),
+            min(self.tokens.stop, other.tokens.stop),
+        )
+        if not len(overlap):
+            return
+        source = slice(
+            overlap.start - other.tokens.start, overlap.stop - other.tokens.start
+        )
+        target = slice(
+            overlap.start - self.tokens.start, overlap.stop - self.tokens.start
+        )
+        present = other.present[source]
+        self.present[target] |= present
+        self.render_keys[target][present] = other.render_keys[source][present]
+        self.metadata_digests[target][present] = other.metadata_digests[source][present]
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.present.nbytes + self.render_keys.nbytes + self.metadata_digests.nbytes
+        )
+
+    def save(self):
+        """
+        Writes the manifest atomically, streaming the arrays to the file.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        header = {
+            "version": self.VERSION,
+            "start": self.tokens.start,
+            "count": len(self.tokens),
+            "traits": {trait: digest.hex() for trait, digest in self.traits.items()},
+        }
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+            for array in [self.present, self.render_keys, self.metadata_digests]:
+                array.tofile(f)
+        os.replace(tmp, self.path)
@@ -1,12 +1,229 @@
 import glob
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from src.utils.io import read_json, write_json
+from src.core.manifest import Manifest, hash_bytes
+from src.utils.io import JsonStreamWriter, read_json_stream, write_atomic
 from src.utils.logger import get_logger, get_progress_bar
 
 
-def update_metadata(image_path: str, output: str, verbose: int):
+class MetadataWriter:
     """
-    Updates the image paths in the metadata files.
+    Writes the metadata file of every token from a pool of I/O threads, in
+    batches of files, so the generation loop never waits on the filesystem.
+
+    Files are formatted exactly like `write_json` formats them, or without
+    any whitespace when compact. Fields whose value is the same for every
+    token, like the description, are serialized once and reused.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        static: dict = None,
+        compact: bool = False,
+        workers: int = 4,
+        batch_size: int = 64,
+    ):
+        """
+        :param folder: The metadata folder, created once when the writer is
+            entered.
+        :param static: Fields that have the same value in every token's
+            metadata.
+        :param compact: Whether to write files without indentation or spaces.
+        :param workers: The number of writing threads.
+        :param batch_size: The number of files written by each thread task.
+        """
+        self.folder = folder
+        self.compact = compact
+        self.workers = workers
+        self.batch_size = batch_size
+        self.static = dict(static or {})
+        self.templates = {
+            key: self.__encode(value) for key, value in self.static.items()
+        }
+        self.batch = []
+        self.pending = deque()
+        self.executor = None
+
+    def __encode(self, value) -> str:
+        """
+        Serializes a value as it appears in a field of the metadata.
+        """
+        if self.compact:
+            return json.dumps(value, separators=(",", ":"))
+        return json.dumps(value, indent=4).replace("\n", "\n    ")
+
+    def dumps(self, obj: dict) -> str:
+        """
+        Serializes a token's metadata, reusing the pre-serialized static
+        fields.
+
+        :param obj: The token's metadata.
+        :return: The file contents.
+        """
+        if not obj:
+            return "{}"
+        fields = []
+        for key, value in obj.items():
+            if key in self.templates and value == self.static[key]:
+                encoded = self.templates[key]
+            else:
+                encoded = self.__encode(value)
+            fields.append((json.dumps(key), encoded))
+        if self.compact:
+            return "{" + ",".join(key + ":" + value for key, value in fields) + "}"
+        return (
+            "{\n"
+            + ",\n".join("    " + key + ": " + value for key, value in fields)
+            + "\n}"
+        )
+
+    def __enter__(self) -> "MetadataWriter":
+        # create folder structure if it doesn't exist
+        os.makedirs(self.folder, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def write(self, token_id: int, obj: dict, previous: bytes = None) -> bytes:
+        """
+        Queues a token's metadata file for writing, unless the file exists
+        with the same contents. Errors from earlier batches are raised here.
+
+        :param token_id: The token id, which names the file.
+        :param obj: The token's metadata.
+        :param previous: The content hash of the existing file, if there is
+            one.
+        :return: The content hash of the file.
+        """
+        contents = self.dumps(obj)
+        digest = hash_bytes(contents.encode())
+        if digest == previous:
+            return digest
+
+        self.batch.append(
+            (os.path.join(self.folder, "{}.json".format(token_id)), contents)
+        )
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return digest
+
+    def flush(self):
+        """
+        Hands the queued files to the writing threads, waiting for older
+        batches once too many are in flight.
+        """
+        if self.batch:
+            self.pending.append(self.executor.submit(self.__write_batch, self.batch))
+            self.batch = []
+        while len(self.pending) > self.workers * 2:
+            self.pending.popleft().result()
+
+    @staticmethod
+    def __write_batch(batch: list):
+        for path, contents in batch:
+            write_atomic(path, contents)
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self.flush()
+            while self.pending:
+                future = self.pending.popleft()
+                if exc_type is None:
+                    future.result()
+                else:
+                    future.cancel()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+# the leading fields of the metadata files written by the generator, which
+# the image path is patched into without parsing the rest of the file
+_LEADING_FIELDS = re.compile(r'\{\s*"token_id":\s*(\d+),\s*"image":\s*"')
+
+
+def _patch_image(contents: str, image_path: str) -> tuple[int, str]:
+    """
+    Points the image of a token's metadata at the new image path, keeping
+    the image's extension and the file's formatting.
+
+    :param contents: The metadata file contents.
+    :param image_path: The new image folder or URI, ending with a '/'.
+    :return: The token id and the new file contents.
+    """
+    match = _LEADING_FIELDS.match(contents)
+    if match is not None:
+        try:
+            image, end = json.decoder.scanstring(contents, match.end())
+        except ValueError:
+            match = None
+    if match is None:
+        # not laid out by the generator, so parse and format the whole file
+        obj = json.loads(contents)
+        extension = os.path.splitext(obj["image"])[1] or ".png"
+        obj["image"] = f"{image_path}{obj['token_id']}{extension}"
+        return obj["token_id"], json.dumps(obj, indent=4)
+
+    token_id = int(match.group(1))
+    extension = os.path.splitext(image)[1] or ".png"
+    return token_id, "".join(
+        [
+            contents[: match.end() - 1],
+            json.dumps(f"{image_path}{token_id}{extension}"),
+            contents[end:],
+        ]
+    )
+
+
+def _update_files(paths: list, image_path: str) -> dict:
+    """
+    Updates the image paths of a batch of token metadata files, only
+    rewriting the files that change.
+
+    :return: The content hash of every token's new metadata file.
+    """
+    digests = {}
+    for path in paths:
+        with open(path) as f:
+            contents = f.read()
+        token_id, patched = _patch_image(contents, image_path)
+        if patched != contents:
+            write_atomic(path, patched)
+        digests[token_id] = hash_bytes(patched.encode())
+    return digests
+
+
+def _update_combined(path: str, image_path: str):
+    """
+    Updates the image paths of a combined metadata file, one token at a time.
+    """
+    with JsonStreamWriter(path, lines=path.endswith(".jsonl")) as writer:
+        for obj in read_json_stream(path):
+            extension = os.path.splitext(obj["image"])[1] or ".png"
+            obj["image"] = f"{image_path}{obj['token_id']}{extension}"
+            writer.write(obj)
+
+
+def update_metadata(
+    image_path: str,
+    output: str,
+    verbose: int,
+    workers: int = 4,
+    batch_size: int = 256,
+):
+    """
+    Updates the image paths in the metadata files, including the combined
+    metadata files, from a pool of threads.
+
+    :param image_path: The new image folder or URI, ending with a '/'.
+    :param output: The generation's output folder.
+    :param verbose: The verbosity level.
+    :param workers: The number of threads.
+    :param batch_size: The number of files updated by each thread task.
     """
     logger = get_logger(verbose)
 
@@ -17,20 +234,47 @@ def update_metadata(image_path: str, output: str, verbose: int):
             "Invalid image path '{}'. It should end with a '/'.".format(image_path)
         )
 
-    all_metadata_files = glob.glob(f"{output}/metadata/*.json")
-
-    with get_progress_bar(len(all_metadata_files)) as bar:
-        for file in all_metadata_files:
-            if file.endswith("all-objects.json"):
-                continue
+    # the combined metadata files, including those of shards
+    combined = [
+        file
+        for file in glob.glob(f"{output}/metadata/all-objects*")
+        if file.endswith((".json", ".jsonl"))
+    ]
+    all_metadata_files = [
+        file
+        for file in glob.glob(f"{output}/metadata/*.json")
+        if not os.path.basename(file).startswith("all-objects")
+    ]
+    batches = [
+        all_metadata_files[start : start + batch_size]
+        for start in range(0, len(all_metadata_files), batch_size)
+    ]
 
-            # read the file
-            json_contents = read_json(file)
-            token_id = json_contents["token_id"]
-            json_contents["image"] = f"{image_path}{token_id}.png"
+    manifests = [
+        Manifest.load(file)
+        for file in glob.glob(f"{output}/.generator-manifest*")
+        if not file.endswith(".tmp")
+    ]
+    with get_progress_bar(len(all_metadata_files)) as bar, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        updates = [
+            executor.submit(_update_combined, file, image_path) for file in combined
+        ]
+        for batch, batch_digests in zip(
+            batches, executor.map(_update_files, batches, [image_path] * len(batches))
+        ):
+            for token_id, digest in batch_digests.items():
+                for manifest in manifests:
+                    hashes = manifest.get(token_id)
+                    if hashes is not None:
+                        manifest.set(token_id, hashes[0], digest)
+            bar(len(batch))
+        for update in updates:
+            update.result()
 
-            # write the file
-            write_json(file, json_contents)
-            bar()
+    # keep the manifests in step, so generating again rewrites these files
+    for manifest in manifests:
+        manifest.save()
 
     logger.info("Updated image paths in metadata files.")
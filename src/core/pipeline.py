@@ -0,0 +1,139 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Streams items through stages of worker threads connected by bounded
+    queues. A stage that falls behind fills its input queue, which blocks the
+    stage before it, so no more than a few queues' worth of items are ever in
+    flight, however many the source yields.
+    """
+
+    def __init__(
+        self,
+        stages: list[tuple[str, Callable, int]],
+        queue_size: int,
+    ):
+        """
+        :param stages: The name, function and number of worker threads of
+            every stage, in order. Each function maps an item to the item
+            passed on to the next stage.
+        :param queue_size: The number of items each queue holds.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.remaining = []
+        self.errors = []
+
+    def __put(self, items: queue.Queue, item) -> bool:
+        """
+        Waits for room in a queue, unless the pipeline is stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __get(self, items: queue.Queue):
+        """
+        Waits for an item from a queue, or returns `_DONE` once the pipeline
+        is stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def __feed(self, source: Iterable, items: queue.Queue, workers: int):
+        try:
+            for item in source:
+                if not self.__put(items, item):
+                    return
+        except BaseException as e:
+            self.errors.append(e)
+        for _ in range(workers):
+            self.__put(items, _DONE)
+
+    def __finish(self, stage: int, outputs: queue.Queue):
+        """
+        Ends the next stage's input once the last worker of a stage is done.
+        """
+        with self.lock:
+            self.remaining[stage] -= 1
+            if self.remaining[stage]:
+                return
+        workers = self.stages[stage + 1][2] if stage + 1 < len(self.stages) else 1
+        for _ in range(workers):
+            self.__put(outputs, _DONE)
+
+    def __work(self, stage: int, inputs: queue.Queue, outputs: queue.Queue):
+        _, function, _ = self.stages[stage]
+        try:
+            while True:
+                item = self.__get(inputs)
+                if item is _DONE:
+                    break
+                result = function(item)
+                if not self.__put(outputs, result):
+                    break
+        except BaseException as e:
+            # the first error, or interrupt, stops every stage and is raised
+            # from `run`
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            self.__finish(stage, outputs)
+
+    def run(self, source: Iterable) -> Iterator:
+        """
+        Streams the source's items through every stage.
+
+        :param source: The items to process, consumed on a separate thread.
+        :return: The results of the last stage, in completion order.
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [
+            threading.Thread(
+                target=self.__feed,
+                args=(source, queues[0], self.stages[0][2]),
+                daemon=True,
+            )
+        ]
+        self.remaining = [workers for _, _, workers in self.stages]
+        for stage, (_, _, workers) in enumerate(self.stages):
+            threads += [
+                threading.Thread(
+                    target=self.__work,
+                    args=(stage, queues[stage], queues[stage + 1]),
+                    daemon=True,
+                )
+                for _ in range(workers)
+            ]
+
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self.__get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,208 @@
+import contextlib
+import cProfile
+import os
+import pstats
+import resource
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+
+class Profiler:
+    """
+    Records the wall and CPU time spent in every stage of a generation, and
+    optionally a cProfile of every stage. Stages run on several threads at
+    once add up, so a stage's time can exceed the generation's wall time.
+
+    A disabled profiler records nothing, at the cost of a no-op context
+    manager per stage.
+    """
+
+    def __init__(self, enabled: bool = True, cprofile: bool = False):
+        """
+        :param enabled: Whether to record anything.
+        :param cprofile: Whether to also profile every stage with cProfile.
+        """
+        self.enabled = enabled
+        self.cprofile = enabled and cprofile
+        self.lock = threading.Lock()
+        self.stages: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        self.latencies = []
+        self.local = threading.local()
+        self.profiles: dict[str, list[cProfile.Profile]] = {}
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def __measure(self, name: str):
+        profile = self.__profile(name)
+        if profile is not None:
+            profile.enable()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            if profile is not None:
+                profile.disable()
+            self.add(name, 1, wall, cpu)
+
+    def stage(self, name: str):
+        """
+        Times the enclosed code as part of a stage.
+
+        :param name: The stage name.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.__measure(name)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        """
+        Times every call of a function as part of a stage.
+
+        :param name: The stage name.
+        :param function: The function to time.
+        """
+        if not self.enabled:
+            return function
+
+        def timed(*args, **kwargs):
+            with self.__measure(name):
+                return function(*args, **kwargs)
+
+        return timed
+
+    def __profile(self, name: str) -> cProfile.Profile:
+        """
+        The calling thread's profile of a stage. A thread can only run one
+        profile at a time, so stages nested in a profiled stage are not
+        profiled on their own.
+        """
+        if not self.cprofile or getattr(self.local, "active", False):
+            return None
+        profiles = getattr(self.local, "profiles", None)
+        if profiles is None:
+            profiles = self.local.profiles = {}
+        if name not in profiles:
+            profiles[name] = _ThreadProfile(self.local)
+            with self.lock:
+                self.profiles.setdefault(name, []).append(profiles[name])
+        return profiles[name]
+
+    def add(self, name: str, calls: int, wall: float, cpu: float):
+        """
+        Adds time spent in a stage, including time measured elsewhere, like
+        in a worker process.
+        """
+        with self.lock:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+
+    def count(self, name: str, amount: int = 1):
+        """
+        Adds to a counter, like the hits of a cache.
+        """
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, timings: dict):
+        """
+        Adds the stage times and counters drained from another profiler.
+        """
+        for name, (calls, wall, cpu) in timings.get("stages", {}).items():
+            self.add(name, calls, wall, cpu)
+        for name, amount in timings.get("counters", {}).items():
+            self.count(name, amount)
+
+    def drain(self) -> dict:
+        """
+        Returns and resets the stage times and counters recorded so far, for
+        a worker process to send them to the main one.
+        """
+        with self.lock:
+            timings = {"stages": self.stages, "counters": self.counters}
+            self.stages, self.counters = {}, {}
+        return timings
+
+    def latency(self, seconds: float):
+        """
+        Records the time a token took from being sampled to being written.
+        """
+        if self.enabled:
+            self.latencies.append(seconds)
+
+    def report(self) -> dict:
+        """
+        Builds the report of every stage, counter and token latency, and the
+        peak memory of this process and its finished worker processes.
+        """
+        latencies = np.array(self.latencies or [0.0])
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "stages": {
+                name: {"calls": calls, "wall_seconds": wall, "cpu_seconds": cpu}
+                for name, (calls, wall, cpu) in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "token_latency_seconds": {
+                "count": len(self.latencies),
+                **{
+                    "p{}".format(q): float(np.percentile(latencies, q))
+                    for q in [50, 90, 99]
+                },
+                "max": float(latencies.max()),
+            },
+            # kilobytes on Linux
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss << 10,
+            "peak_worker_rss_bytes": resource.getrusage(
+                resource.RUSAGE_CHILDREN
+            ).ru_maxrss
+            << 10,
+        }
+
+    def dump(self, folder: str, suffix: str = "") -> list[str]:
+        """
+        Writes the cProfile stats of every stage, merged across threads.
+
+        :param folder: The folder to write a `<stage><suffix>.prof` file per
+            stage to.
+        :param suffix: Tells apart the dumps of several processes.
+        :return: The paths written.
+        """
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        with self.lock:
+            profiles = {name: list(items) for name, items in self.profiles.items()}
+        for name, items in profiles.items():
+            stats = pstats.Stats(items[0])
+            for profile in items[1:]:
+                stats.add(profile)
+            path = os.path.join(folder, "{}{}.prof".format(name, suffix))
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+class _ThreadProfile(cProfile.Profile):
+    """
+    A cProfile of one stage on one thread, which marks the thread as busy
+    while enabled so nested stages don't replace it.
+    """
+
+    def __init__(self, local: threading.local):
+        super().__init__()
+        self.local = local
+
+    def enable(self):
+        self.local.active = True
+        super().enable()
+
+    def disable(self):
+        super().disable()
+        self.local.active = False
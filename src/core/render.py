@@ -0,0 +1,199 @@
+import os
+import signal
+import threading
+from typing import Callable
+
+import numpy as np
+
+from src.core.profiler import Profiler
+from src.utils.cache import ImageCache, PrefixCache
+from src.utils.composite import Compositor, TraitLayer, blend
+from src.utils.encoding import ImageEncoder
+
+# the renderer and profiler of a worker process, built once by `init_worker`
+_renderer = None
+_profiler = Profiler(enabled=False)
+_profile_folder = None
+# the cache counters already sent to the main process
+_counted = {}
+
+
+class Renderer:
+    """
+    Composites and encodes the images of genomes given as value indices.
+
+    Layers are blended in one pass into a per-thread buffer, and the prefix
+    composites planned by `plan_prefixes` are memoized, so tokens rendered
+    after one sharing their first layers only composite the rest.
+    """
+
+    def __init__(
+        self,
+        trait_paths: list[list[str]],
+        encoder: ImageEncoder,
+        cache: ImageCache,
+        prefixes: PrefixCache,
+    ):
+        """
+        :param trait_paths: The trait image file of every value of every layer.
+        :param encoder: The encoder to save images with.
+        :param cache: The cache to fetch decoded trait layers from.
+        :param prefixes: The cache of intermediate composites.
+        """
+        self.trait_paths = trait_paths
+        self.encoder = encoder
+        self.cache = cache
+        self.prefixes = prefixes
+        self.compositor = Compositor()
+        # the prefixes every thread kept for the genomes after its last one
+        self.kept = threading.local()
+
+    def composite(self, genome: tuple, keep: tuple = ()) -> np.ndarray:
+        """
+        Composites a genome's trait layers in order, starting from the deepest
+        cached prefix composite.
+
+        :param genome: The genome's value indices.
+        :param keep: The prefix lengths whose composites to cache for the
+            genomes rendered after this one.
+        :return: The composite RGBA pixels, in a buffer reused by the calling
+            thread's next composite.
+        """
+        genome = tuple(genome)
+        # genomes are rendered in order, so no later genome starts from the
+        # kept prefixes this one doesn't extend
+        kept = []
+        for prefix in getattr(self.kept, "prefixes", []):
+            if genome[: len(prefix)] == prefix:
+                kept.append(prefix)
+            else:
+                self.prefixes.release(prefix)
+        self.kept.prefixes = kept
+
+        depth, buffer = self.prefixes.longest_prefix(
+            genome[:-1], min_depth=2, start=self.compositor.start
+        )
+        if buffer is None:
+            depth = 1
+            buffer = self.compositor.start(
+                self.cache.get(self.trait_paths[0][genome[0]]).pixels
+            )
+
+        for layer in range(depth, len(genome)):
+            blend(buffer, self.cache.get(self.trait_paths[layer][genome[layer]]))
+            if layer + 1 in keep:
+                self.prefixes.keep(genome[: layer + 1], buffer)
+                kept.append(genome[: layer + 1])
+        return buffer
+
+
+def plan_prefixes(genomes: list) -> list[tuple]:
+    """
+    Plans which prefix composites to cache while rendering genomes in order.
+    A prefix is only cached by the first genome compositing it, and only if
+    a later genome starts from it, so no canvas is copied that isn't reused.
+
+    :param genomes: The genomes to render, sorted so that genomes sharing
+        their first layers are next to each other.
+    :return: The prefix lengths to cache, for every genome.
+    """
+    keep = [[] for _ in genomes]
+    # the genome that composited each prefix of the previous genome
+    composited = []
+    previous = ()
+    for index, genome in enumerate(genomes):
+        shared = 0
+        while (
+            shared < len(genome) - 1
+            and shared < len(previous)
+            and genome[shared] == previous[shared]
+        ):
+            shared += 1
+        # a single layer is a decoded trait image, which is cached already
+        if shared >= 2 and shared not in keep[composited[shared - 1]]:
+            keep[composited[shared - 1]].append(shared)
+        composited[shared:] = [index] * (len(genome) - shared)
+        previous = genome
+    return [tuple(sorted(depths)) for depths in keep]
+
+
+def map_tasks(function: Callable, chunk: list) -> list:
+    """
+    Applies a function to the payload of every render task of a chunk.
+    Errors are recorded on the task rather than raised, and tasks that
+    already failed are passed on untouched.
+
+    :param function: The function to apply to each payload.
+    :param chunk: A list of tasks, each a tuple of the token id, its payload
+        and its error message, if any.
+    :return: The tasks with their new payloads.
+    """
+    results = []
+    for token_id, payload, error in chunk:
+        if error is None:
+            try:
+                payload = function(payload)
+            except Exception as e:
+                payload, error = None, str(e)
+        results.append((token_id, payload, error))
+    return results
+
+
+def init_worker(
+    trait_paths: list[list[str]],
+    encoder: ImageEncoder,
+    cache_bytes: int,
+    prefix_bytes: int,
+    profile: bool = False,
+    profile_folder: str = None,
+):
+    """
+    Sets up the renderer of a worker process, so the trait tables are sent
+    once per worker rather than with every task.
+
+    :param profile: Whether to time the worker's stages.
+    :param profile_folder: Where to dump the worker's cProfile stats, if any.
+    """
+    global _renderer, _profiler, _profile_folder
+    # the main process handles Ctrl-C and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _profiler = Profiler(profile, cprofile=profile_folder is not None)
+    _profile_folder = profile_folder
+    _renderer = Renderer(
+        trait_paths,
+        encoder,
+        ImageCache(cache_bytes, load=_profiler.wrap("decode", TraitLayer.open)),
+        PrefixCache(prefix_bytes),
+    )
+
+
+def _render(payload: tuple) -> bytes:
+    with _profiler.stage("composite"):
+        pixels = _renderer.composite(*payload)
+    with _profiler.stage("encode"):
+        return _renderer.encoder.encode(pixels)
+
+
+def render_in_worker(chunk: list) -> tuple[list, dict]:
+    """
+    Renders a chunk of genomes to encoded images with the worker process'
+    renderer.
+
+    :return: The rendered tasks, and the stage times and cache counters
+        recorded since the last chunk, if the worker is profiled.
+    """
+    tasks = map_tasks(_render, chunk)
+    if not _profiler.enabled:
+        return tasks, {}
+
+    for name, cache in [
+        ("image_cache", _renderer.cache),
+        ("prefix_cache", _renderer.prefixes),
+    ]:
+        for counter in ["hits", "misses"]:
+            key = "{}_{}".format(name, counter)
+            _profiler.count(key, getattr(cache, counter) - _counted.get(key, 0))
+            _counted[key] = getattr(cache, counter)
+    if _profile_folder is not None:
+        _profiler.dump(_profile_folder, suffix="-worker-{}".format(os.getpid()))
+    return tasks, _profiler.drain()
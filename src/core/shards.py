@@ -0,0 +1,138 @@
+import os
+
+from src.common.exceptions import GenerationError
+from src.core.manifest import Manifest
+from src.utils.encoding import ImageEncoder
+from src.utils.io import JsonStreamWriter, read_json_stream, read_toml
+from src.utils.logger import get_logger, get_progress_bar
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """
+    Parses a shard given as `i/N`, the i-th of N shards counting from 0.
+
+    :return: The shard index and the number of shards.
+    """
+    index, _, count = (shard or "0/1").partition("/")
+    if not (index.isnumeric() and count.isnumeric()) or not int(index) < int(count):
+        raise ValueError(
+            "Invalid shard '{}'. Expected i/N, with i from 0 to N - 1".format(shard)
+        )
+    return int(index), int(count)
+
+
+def shard_range(start_at: int, amount: int, shard: int, shards: int) -> range:
+    """
+    The token ids of a shard: one of `shards` contiguous slices of the
+    collection, which differ in length by one token at most.
+    """
+    return range(
+        start_at + amount * shard // shards,
+        start_at + amount * (shard + 1) // shards,
+    )
+
+
+def shard_suffix(shard: int, shards: int) -> str:
+    """
+    The suffix of the files a shard keeps for itself, so shards can share an
+    output folder. Unsharded generations use the plain file names.
+    """
+    return ".shard-{}-of-{}".format(shard, shards) if shards > 1 else ""
+
+
+def merge_shards(output: str, verbose: int):
+    """
+    Assembles the combined metadata file and the manifest of a sharded
+    generation, once the output folders of every shard are copied into one.
+    Verifies that every token was generated exactly once, with its metadata
+    file and image, and that no two tokens share a genome unless duplicates
+    were allowed.
+    """
+    logger = get_logger(verbose)
+
+    path = "{}/.generatorrc".format(output)
+    if not os.path.exists(path):
+        raise ValueError("No generation to merge in '{}'".format(output))
+    settings = read_toml(path)
+    shards = settings.get("shards", 1)
+    extension = ImageEncoder.FORMATS[settings["format"]][1]
+    objects = "{}/metadata/all-objects{{}}.{}".format(
+        output, settings["objects_format"]
+    )
+
+    missing = [
+        shard
+        for shard in range(shards)
+        if not os.path.exists(objects.format(shard_suffix(shard, shards)))
+    ]
+    if missing:
+        raise GenerationError(
+            "Missing the combined metadata of shards {} of {}".format(missing, shards)
+        )
+
+    metadata_files = set(os.listdir("{}/metadata".format(output)))
+    images = {
+        entry.name
+        for entry in os.scandir("{}/images".format(output))
+        if entry.stat().st_size
+    }
+    token_ids = range(settings["start_at"], settings["start_at"] + settings["amount"])
+    seen, genomes = set(), set()
+    unexpected, duplicates, incomplete, duplicate_genomes = [], [], [], []
+
+    logger.info("Merging %d shards of %d NFTs", shards, len(token_ids))
+    with get_progress_bar(len(token_ids)) as bar, JsonStreamWriter(
+        objects.format(""), lines=settings["objects_format"] == "jsonl"
+    ) as all_objects:
+        for shard in range(shards):
+            for token in read_json_stream(objects.format(shard_suffix(shard, shards))):
+                token_id = token["token_id"]
+                if token_id not in token_ids:
+                    unexpected.append(token_id)
+                    continue
+                if token_id in seen:
+                    duplicates.append(token_id)
+                    continue
+                seen.add(token_id)
+                if (
+                    "{}.json".format(token_id) not in metadata_files
+                    or "{}.{}".format(token_id, extension) not in images
+                ):
+                    incomplete.append(token_id)
+
+                genome = tuple(attribute["value"] for attribute in token["attributes"])
+                if genome in genomes and not settings["allow_duplicates"]:
+                    duplicate_genomes.append(token_id)
+                genomes.add(genome)
+                all_objects.write(token)
+                bar()
+
+        gaps = [token_id for token_id in token_ids if token_id not in seen]
+        errors = [
+            "{} {}: {}".format(len(ids), description, ids[:10])
+            for description, ids in [
+                ("missing tokens", gaps),
+                ("tokens generated more than once", duplicates),
+                ("tokens outside the collection", unexpected),
+                ("tokens without a metadata file or image", incomplete),
+                ("tokens with a duplicate genome", duplicate_genomes),
+            ]
+            if ids
+        ]
+        if errors:
+            raise GenerationError(
+                "Shards do not add up to the collection: {}".format("; ".join(errors))
+            )
+
+    # a later generation into the merged folder can reuse every shard's work
+    manifest = Manifest("{}/.generator-manifest".format(output), token_ids)
+    for shard in range(shards):
+        manifest.update(
+            Manifest.load(
+                "{}/.generator-manifest{}".format(output, shard_suffix(shard, shards)),
+                shard_range(settings["start_at"], settings["amount"], shard, shards),
+            )
+        )
+    manifest.save()
+
+    logger.info("Merged %d shards into '%s'", shards, objects.format(""))
@@ -0,0 +1,49 @@
+class SamplingStats:
+    """
+    Counts the candidate genomes rejected while sampling a collection, and
+    the retries of every token that needed them. A token whose every attempt
+    was rejected has one rejection more than retries.
+    """
+
+    CAUSES = ("duplicate", "incompatible")
+
+    def __init__(self):
+        self.rejections = {cause: 0 for cause in self.CAUSES}
+        self.token_retries = {}
+
+    def reject(self, cause: str):
+        """
+        Records a rejected candidate genome.
+
+        :param cause: Why the candidate was rejected, one of `CAUSES`.
+        """
+        self.rejections[cause] += 1
+
+    def retried(self, token_id: int, retries: int):
+        """
+        Records how many retries a token needed, every attempt after its first.
+
+        :param token_id: The token that was sampled.
+        :param retries: The number of attempts after the first one.
+        """
+        if retries:
+            self.token_retries[token_id] = retries
+
+    @property
+    def total_rejections(self) -> int:
+        return sum(self.rejections.values())
+
+    @property
+    def max_retries(self) -> int:
+        return max(self.token_retries.values(), default=0)
+
+    def summary(self) -> str:
+        return "Rejected {:,} candidate genomes ({}), {:,} tokens needed retries (max {:,})".format(
+            self.total_rejections,
+            ", ".join(
+                "{}: {:,}".format(cause, count)
+                for cause, count in self.rejections.items()
+            ),
+            len(self.token_retries),
+            self.max_retries,
+        )
@@ -0,0 +1,90 @@
+import math
+import operator
+
+import numpy as np
+
+
+class GenomeStore:
+    """
+    Compact duplicate checks for the genomes of a collection: an
+    open-addressing hash set of 64-bit genome keys. Costs about twenty bytes
+    per token, where a set of tuples costs a few hundred bytes per token.
+
+    Keys are the genome's position in the mixed-radix space of every layer's
+    value count, which is exact when the space fits in 64 bits. Larger spaces
+    fall back to 64-bit hashes, where a collision can only make a new genome
+    look like a duplicate and be resampled.
+    """
+
+    # the hash table is grown once it is more than three quarters full
+    MAX_LOAD = 0.75
+
+    def __init__(self, radices: list[int], capacity: int = 1024):
+        """
+        :param radices: The number of values of every layer.
+        :param capacity: The number of genomes to preallocate room for.
+        """
+        self.exact = math.prod(radices) < 1 << 64
+        self.strides = [
+            math.prod(radices[layer + 1 :]) for layer in range(len(radices))
+        ]
+        self.keys = np.zeros(
+            1 << max(4, math.ceil(capacity / self.MAX_LOAD).bit_length()),
+            dtype=np.uint64,
+        )
+        self.size = 0
+
+    def key(self, genome) -> int:
+        """
+        The non-zero 64-bit key of a genome.
+        """
+        if self.exact:
+            return sum(map(operator.mul, genome, self.strides)) + 1
+        return hash(tuple(genome)) % ((1 << 64) - 1) + 1
+
+    def __slot(self, key: int) -> int:
+        """
+        Finds the slot holding a key, or the empty slot it would go in.
+        """
+        mask = len(self.keys) - 1
+        # Fibonacci hashing: the top bits of the key times 2**64 / phi
+        slot = (key * 0x9E3779B97F4A7C15 & (1 << 64) - 1) >> (64 - mask.bit_length())
+        while True:
+            found = int(self.keys[slot])
+            if found == key or found == 0:
+                return slot
+            slot = (slot + 1) & mask
+
+    def __contains__(self, genome) -> bool:
+        key = self.key(genome)
+        return int(self.keys[self.__slot(key)]) == key
+
+    def add(self, genome) -> bool:
+        """
+        Records a genome's key unless it is already recorded.
+
+        :param genome: The genome's value indices.
+        :return: False if the genome was a duplicate, True otherwise.
+        """
+        key = self.key(genome)
+        slot = self.__slot(key)
+        if int(self.keys[slot]) == key:
+            return False
+        self.keys[slot] = key
+        self.size += 1
+        if self.size > len(self.keys) * self.MAX_LOAD:
+            self.__grow_keys()
+        return True
+
+    def __grow_keys(self):
+        keys = self.keys[self.keys != 0]
+        self.keys = np.zeros(len(self.keys) * 2, dtype=np.uint64)
+        for key in keys.tolist():
+            self.keys[self.__slot(key)] = key
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes
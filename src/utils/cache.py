@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from src.utils.composite import TraitLayer
+
+
+class ImageCache:
+    """
+    A thread-safe, least-recently-used cache of decoded RGBA trait layers,
+    keyed by their resolved path and bounded by the decoded size in bytes.
+    Cached images are shared, so callers must not modify them in place.
+    """
+
+    NAME = "Trait image cache"
+
+    def __init__(self, max_bytes: int, load: Callable = TraitLayer.open):
+        """
+        :param max_bytes: The total decoded size the cache may hold.
+        :param load: Decodes the image at a path on a miss.
+        """
+        self.max_bytes = max_bytes
+        self.load = load
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> TraitLayer:
+        """
+        Returns the decoded trait layer at the given path, decoding it on a miss.
+
+        :param path: The resolved path of the image.
+        :return: The decoded image.
+        """
+        with self.lock:
+            image = self.images.get(path)
+            if image is not None:
+                self.images.move_to_end(path)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        # decode outside of the lock, so workers missing different images
+        # don't wait on each other
+        return self.store(path, self.load(path))
+
+    def store(self, key, image):
+        """
+        Caches an image, evicting the least recently used ones to stay within
+        the budget. Images larger than the whole budget are not cached.
+
+        :return: The cached image for the key.
+        """
+        size = image.nbytes
+        if size > self.max_bytes:
+            return image
+
+        with self.lock:
+            if key not in self.images:
+                self.images[key] = image
+                self.size += size
+                while self.size > self.max_bytes:
+                    self.evict()
+            return self.images[key]
+
+    def evict(self):
+        """
+        Evicts the least recently used image, while holding the lock.
+        """
+        _, evicted = self.images.popitem(last=False)
+        self.size -= evicted.nbytes
+        self.evictions += 1
+
+    def summary(self) -> str:
+        return "{}: {:,} hits, {:,} misses, {:,} evictions, {:,} images ({:,} bytes) cached".format(
+            self.NAME,
+            self.hits,
+            self.misses,
+            self.evictions,
+            len(self.images),
+            self.size,
+        )
+
+
+class PrefixCache(ImageCache):
+    """
+    A cache of intermediate composite pixels, keyed by the value indices of the
+    layers composited so far. Every key extends the keys of its shorter
+    prefixes, forming a trie of partial genomes whose nodes are evicted
+    least recently used first. Using a prefix also uses its cached ancestors,
+    so shallow prefixes shared by many tokens outlive their deeper ones.
+    """
+
+    NAME = "Prefix composite cache"
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: The total size the cached composites may hold.
+        """
+        super().__init__(max_bytes)
+        # released composites, whose memory the next kept ones reuse, as
+        # allocating it takes longer than copying for large images; they
+        # count towards the budget and are evicted first
+        self.spares = []
+
+    def evict(self):
+        if self.spares:
+            self.size -= self.spares.pop().nbytes
+        else:
+            super().evict()
+
+    def longest_prefix(
+        self, key: tuple, min_depth: int = 1, start: Callable = None
+    ) -> tuple:
+        """
+        Finds the deepest cached composite for a prefix of the given key.
+
+        :param key: The value indices of every layer to composite, in order.
+        :param min_depth: The shortest prefix worth looking up.
+        :param start: Copies the composite out while holding the lock, as the
+            memory of released composites is reused by `keep`.
+        :return: A tuple of the prefix length and its composite, or what
+            `start` returned for it, or of 0 and None if no prefix is cached.
+        """
+        with self.lock:
+            for depth in range(len(key), min_depth - 1, -1):
+                image = self.images.get(key[:depth])
+                if image is not None:
+                    # shallowest last, to be evicted last
+                    for ancestor in range(depth, min_depth - 1, -1):
+                        if key[:ancestor] in self.images:
+                            self.images.move_to_end(key[:ancestor])
+                    self.hits += 1
+                    return depth, image if start is None else start(image)
+            self.misses += 1
+        return 0, None
+
+    def keep(self, key: tuple, pixels: np.ndarray):
+        """
+        Caches a copy of a composite, in the memory of a released one where
+        there is one.
+
+        :param key: The value indices of the layers composited so far.
+        :param pixels: The composite, which may be changed afterwards.
+        """
+        with self.lock:
+            if key in self.images or pixels.nbytes > self.max_bytes:
+                return
+            copy = None
+            for index, spare in enumerate(self.spares):
+                if spare.shape == pixels.shape:
+                    copy = self.spares.pop(index)
+                    self.size -= copy.nbytes
+                    break
+        if copy is None:
+            copy = pixels.copy()
+        else:
+            np.copyto(copy, pixels)
+        self.store(key, copy)
+
+    def release(self, key: tuple):
+        """
+        Drops a composite that no later genome starts from, keeping its memory
+        for the next one kept.
+
+        :param key: The value indices of the layers composited so far.
+        """
+        with self.lock:
+            image = self.images.pop(key, None)
+            if image is not None:
+                self.spares.append(image)
@@ -1,35 +1,558 @@
-def calculate_possible_combinations(config: dict) -> int:
+import itertools
+import math
+
+import numpy as np
+
+from src.common.compiled import CompiledConfig
+
+# largest number of genomes enumerated for a component whose rules cannot be
+# expressed as factors
+ENUMERATION_LIMIT = 1 << 20
+
+# largest table built for a layer that receives defaults from several layers
+JOINT_FACTOR_LIMIT = 1 << 22
+
+# largest table variable elimination may build, beyond which the count is
+# bounded from above instead
+ELIMINATION_LIMIT = 1 << 22
+
+# largest table built while bounding the count, which trades how tight the
+# bound is for speed
+BUCKET_LIMIT = 1 << 18
+
+
+def calculate_possible_combinations(
+    config: dict, compiled: CompiledConfig = None
+) -> int:
     """
     Calculate the number of possible combinations for a given configuration.
+    See `count_possible_combinations`.
 
     :param config: The configuration to calculate the combinations for.
-    :return: The number of possible combinations.
+    :param compiled: The compiled configuration, if one was already built.
+    :return: The number of possible combinations, or an upper bound of it.
+    """
+    return count_possible_combinations(config, compiled)[0]
+
+
+def count_possible_combinations(
+    config: dict, compiled: CompiledConfig = None
+) -> tuple[int, bool]:
     """
+    Count the number of possible combinations for a given configuration.
+
+    Only values with a positive weight can be sampled, and combinations are
+    counted after incompatibilities have rejected candidates or swapped in
+    their defaults, so the result is the number of distinct genomes the
+    generator can produce.
 
-    # Extract the layers from the config dictionary
-    layers = config.get("layers", [])
+    Layers are grouped into the connected components of the incompatibility
+    graph. Unconstrained layers contribute their value count, and each
+    component is counted by variable elimination over factors between trigger
+    layers and the layers their rules forbid values in. A component whose
+    defaults feed back into its own triggers is enumerated instead.
 
-    # Build a set of incompatibilities
-    incompatibilities = set()
-    for incompatibility in config.get("incompatibilities", []):
-        layer = incompatibility.get("layer")
-        value = incompatibility.get("value")
-        incompatibilities.add((layer, value))
+    The result is an upper bound rather than an exact count when a component
+    is too large to enumerate, when elimination would need a table larger
+    than `ELIMINATION_LIMIT`, or when a layer receives defaults from more
+    trigger layers than `JOINT_FACTOR_LIMIT` allows tabulating jointly.
+
+    :param config: The configuration to calculate the combinations for.
+    :param compiled: The compiled configuration, if one was already built.
+    :return: The number of possible combinations, and whether it is exact.
+    """
+    if compiled is None:
+        compiled = CompiledConfig(config)
+
+    layer_count = len(compiled.values)
+    supports = [
+        [int(value) for value in np.flatnonzero(weights > 0)]
+        for weights in compiled.value_weights
+    ]
+
+    # rules that can trigger and forbid something, in config order
+    rules = [
+        (order, rule)
+        for order, rule in enumerate(compiled.rules)
+        if rule[1] is not None and any(rule[2])
+    ]
+
+    # group the layers into the connected components of the rules
+    components = list(range(layer_count))
+
+    def find(layer: int) -> int:
+        while components[layer] != layer:
+            components[layer] = components[components[layer]]
+            layer = components[layer]
+        return layer
+
+    for _, (layer, _, forbidden, _) in rules:
+        for trait, trait_forbidden in enumerate(forbidden):
+            if trait_forbidden:
+                components[find(trait)] = find(layer)
+
+    grouped_layers = {}
+    for layer in range(layer_count):
+        grouped_layers.setdefault(find(layer), []).append(layer)
+    grouped_rules = {}
+    for order, rule in rules:
+        grouped_rules.setdefault(find(rule[0]), []).append((order, rule))
 
-    # Calculate combinations
     total_combinations = 1
-    for layer in layers:
-        layer_name = layer.get("name")
-        values = layer.get("values", [])
-        num_values = len(values)
-
-        # If layer has incompatible values, reduce num_values by 1
-        # since the incompatible value will be replaced by the default one.
-        for value in values:
-            if (layer_name, value) in incompatibilities:
-                num_values -= 1
+    exact = True
+    for root, layers in grouped_layers.items():
+        component_rules = grouped_rules.get(root, [])
+        component_size = math.prod(len(supports[layer]) for layer in layers)
+        if not component_rules:
+            total_combinations *= component_size
+        elif _is_factorable(compiled, component_rules):
+            count, component_exact = _count_factored(supports, layers, component_rules)
+            # every sampled combination makes at most one genome
+            total_combinations *= min(count, component_size)
+            exact = exact and component_exact
+        elif component_size <= ENUMERATION_LIMIT:
+            total_combinations *= _count_enumerated(
+                compiled, supports, layers, component_rules
+            )
+        else:
+            # every sampled combination makes at most one genome, however
+            # many defaults can be swapped into it
+            total_combinations *= component_size
+            exact = False
+
+    return total_combinations, exact
+
+
+def _is_factorable(compiled: CompiledConfig, rules: list) -> bool:
+    """
+    Checks that swapping in defaults can never change which rules trigger or
+    hit, so that the outcome of each layer only depends on the trigger layers
+    of the rules forbidding values in it.
+    """
+    real_counts = [len(weights) for weights in compiled.value_weights]
+    trigger_values = {(layer, value) for _, (layer, value, _, _) in rules}
+
+    for _, (layer, value, forbidden, default) in rules:
+        # triggers and hits must be on sampled values, not swapped-in defaults
+        if value >= real_counts[layer]:
+            return False
+        for trait, trait_forbidden in enumerate(forbidden):
+            if not trait_forbidden:
+                continue
+            if max(trait_forbidden) >= real_counts[trait]:
+                return False
+            if default is None:
+                continue
+
+            # a default must not become a sampled value, and a value that may
+            # be swapped out must not trigger other rules
+            if default[trait] < real_counts[trait]:
+                return False
+            if any((trait, hit) in trigger_values for hit in trait_forbidden):
+                return False
+
+    return True
+
+
+def _count_factored(supports: list, layers: list, rules: list) -> tuple[int, bool]:
+    """
+    Counts a component's genomes by variable elimination. Every layer a rule
+    forbids values in gets a factor over it and the trigger layers of the
+    rules hitting it, marking the values that layer can end up with.
+
+    :return: The count, and whether it is exact rather than an upper bound.
+    """
+    # every layer can take its sampled values, and hit layers can also take
+    # the defaults of the rules hitting them
+    domains = {layer: list(supports[layer]) for layer in layers}
+    hits = {}
+    defaulted = set()
+    for _, (layer, _, forbidden, default) in rules:
+        for trait, trait_forbidden in enumerate(forbidden):
+            if not trait_forbidden:
+                continue
+            hits.setdefault(trait, set()).add(layer)
+
+            # a rule can only swap values out of layers other than its
+            # trigger layer, as the trigger value itself is never forbidden
+            # by a rule with a default
+            if default is not None and trait != layer:
+                defaulted.add(trait)
+                if default[trait] not in domains[trait]:
+                    domains[trait].append(default[trait])
+    positions = {
+        layer: {value: position for position, value in enumerate(domain)}
+        for layer, domain in domains.items()
+    }
+
+    # group the rules by trigger, keeping their config order
+    triggers = {}
+    for order, rule in rules:
+        triggers.setdefault((rule[0], rule[1]), []).append((order, rule))
+
+    def triggered_by(layer: int, value: int, trait: int) -> list:
+        return [
+            (order, rule)
+            for order, rule in triggers.get((layer, value), [])
+            if rule[2][trait]
+        ]
+
+    def outcomes(trait: int, triggered: list) -> np.ndarray:
+        # the first triggered rule to hit a value decides whether it is
+        # rejected or swapped for a default
+        first_hits = {}
+        for _, (_, _, forbidden, default) in sorted(triggered, key=lambda r: r[0]):
+            for hit in forbidden[trait]:
+                first_hits.setdefault(hit, None if default is None else default[trait])
+
+        allowed = np.zeros(len(domains[trait]), dtype=np.int64)
+        for candidate in supports[trait]:
+            if candidate not in first_hits:
+                allowed[positions[trait][candidate]] = 1
+            elif first_hits[candidate] is not None:
+                allowed[positions[trait][first_hits[candidate]]] = 1
+        return allowed
+
+    factors = []
+    exact = True
+    for trait, trigger_layers in hits.items():
+        if trait in trigger_layers:
+            # a trigger that forbids its own value always rejects, since
+            # values that trigger rules are never swapped out
+            allowed = np.ones(len(domains[trait]), dtype=np.int64)
+            for value in supports[trait]:
+                for _, (_, _, forbidden, _) in triggers.get((trait, value), []):
+                    if value in forbidden[trait]:
+                        allowed[positions[trait][value]] = 0
+            factors.append(((trait,), allowed))
+
+        trigger_layers = sorted(trigger_layers - {trait})
+        if not trigger_layers:
+            continue
+
+        joint_size = len(domains[trait]) * math.prod(
+            len(domains[layer]) for layer in trigger_layers
+        )
+        if len(trigger_layers) == 1 or (
+            trait in defaulted and joint_size <= JOINT_FACTOR_LIMIT
+        ):
+            factors.append(
+                _joint_factor(trait, trigger_layers, domains, triggered_by, outcomes)
+            )
+            continue
+
+        # without defaults a value survives if no trigger layer forbids it,
+        # so pairwise factors are exact. With defaults from several layers
+        # this only bounds the count from above, as any default that another
+        # layer could produce is let through, whether or not the other layer
+        # does produce it.
+        exact = exact and trait not in defaulted
+        for layer in trigger_layers:
+            others = set()
+            for other in trigger_layers:
+                if other == layer:
+                    continue
+                for value in domains[other]:
+                    for _, rule in triggered_by(other, value, trait):
+                        if rule[3] is not None:
+                            others.add(positions[trait][rule[3][trait]])
+
+            allowed = np.zeros(
+                (len(domains[layer]), len(domains[trait])), dtype=np.int64
+            )
+            for row, value in enumerate(domains[layer]):
+                allowed[row] = outcomes(trait, triggered_by(layer, value, trait))
+                allowed[row, sorted(others)] = 1
+            factors.append(((layer, trait), allowed))
+
+    sizes = {layer: len(domains[layer]) for layer in layers}
+    order = _elimination_order([axes for axes, _ in factors], sizes)
+    if order is not None:
+        return _eliminate(factors, sizes, order), exact
+
+    count = _eliminate_bounded(factors, sizes)
+    if count is None:
+        count = math.prod(sizes.values())
+    return count, False
+
+
+def _joint_factor(
+    trait: int, trigger_layers: list, domains: dict, triggered_by, outcomes
+) -> tuple:
+    """
+    Builds the factor between a layer and the trigger layers of every rule
+    hitting it. Trigger values that trigger the same rules share a row, so
+    outcomes are only evaluated once per distinct combination of rules.
+    """
+    classes = []
+    class_rules = []
+    for layer in trigger_layers:
+        layer_classes = np.zeros(len(domains[layer]), dtype=np.intp)
+        layer_rules = [[]]
+        for position, value in enumerate(domains[layer]):
+            triggered = triggered_by(layer, value, trait)
+            if triggered:
+                layer_classes[position] = len(layer_rules)
+                layer_rules.append(triggered)
+        classes.append(layer_classes)
+        class_rules.append(layer_rules)
+
+    table = np.zeros(
+        [len(layer_rules) for layer_rules in class_rules] + [len(domains[trait])],
+        dtype=np.int64,
+    )
+    for combination in itertools.product(
+        *[range(len(layer_rules)) for layer_rules in class_rules]
+    ):
+        table[combination] = outcomes(
+            trait,
+            [
+                rule
+                for layer_rules, index in zip(class_rules, combination)
+                for rule in layer_rules[index]
+            ],
+        )
+
+    return tuple(trigger_layers) + (trait,), table[np.ix_(*classes)]
+
+
+def _elimination_order(scopes: list, sizes: dict) -> list:
+    """
+    Plans the order to eliminate variables in, always picking the variable
+    whose factors span the smallest table.
+
+    :param scopes: The variables of every factor.
+    :param sizes: The number of values of every variable.
+    :return: The variables in elimination order, or None if one of the
+        tables would hold more than `ELIMINATION_LIMIT` entries.
+    """
+    scopes = [set(scope) for scope in scopes]
+    order = []
+    remaining = set(sizes)
+    while remaining:
+        neighbours = {}
+        for variable in remaining:
+            neighbours[variable] = set().union(
+                *[scope for scope in scopes if variable in scope]
+            ) | {variable}
+        variable = min(
+            remaining,
+            key=lambda variable: math.prod(
+                sizes[axis] for axis in neighbours[variable]
+            ),
+        )
+        if math.prod(sizes[axis] for axis in neighbours[variable]) > ELIMINATION_LIMIT:
+            return None
+        remaining.remove(variable)
+        order.append(variable)
+        scopes = [scope for scope in scopes if variable not in scope]
+        scopes.append(neighbours[variable] - {variable})
+    return order
+
+
+def _eliminate(factors: list, sizes: dict, order: list) -> int:
+    """
+    Sums the product of the 0/1 factors over every variable, eliminating the
+    variables in the given order.
+
+    Counts are kept as floats, which are exact below 2**53 and let einsum use
+    BLAS. Once a count could exceed that, the rest of the elimination is
+    repeated modulo enough primes to recover the exact result.
+    """
+    factors = [(axes, table.astype(np.float64), 1) for axes, table in factors]
+
+    for step, variable in enumerate(order):
+        involved = [factor for factor in factors if variable in factor[0]]
+        bound = sizes[variable] * math.prod(bound for _, _, bound in involved)
+        if bound >= 1 << 53:
+            break
+
+        factors = [factor for factor in factors if variable not in factor[0]]
+        factors.append(_contract(involved, variable, sizes) + (bound,))
+    else:
+        return math.prod(int(table) for _, table, _ in factors)
+
+    # every count is at most the number of combinations left to sum over
+    order = order[step:]
+
+    # multiply factors over the same variables together while that is exact,
+    # so that fewer of them have to be reduced for every prime
+    merged = {}
+    for axes, table, bound in factors:
+        key = tuple(sorted(axes))
+        table = np.transpose(table, sorted(range(len(axes)), key=lambda i: axes[i]))
+        for index, (other, other_bound) in enumerate(merged.get(key, [])):
+            if bound * other_bound < 1 << 53:
+                merged[key][index] = (table * other, bound * other_bound)
                 break
+        else:
+            merged.setdefault(key, []).append((table, bound))
+    factors = [
+        (axes, table, bound)
+        for axes, tables in merged.items()
+        for table, bound in tables
+    ]
+    total_bound = math.prod(bound for _, _, bound in factors) * math.prod(
+        sizes[variable] for variable in order
+    )
+
+    # products of two residues summed over a variable must stay exact
+    limit = math.isqrt((1 << 53) // max(sizes.values()))
+    residues = []
+    modulus = 1
+    for prime in _primes_below(limit):
+        reduced = [(axes, np.fmod(table, prime)) for axes, table, _ in factors]
+        for variable in order:
+            involved = [factor for factor in reduced if variable in factor[0]]
+            reduced = [factor for factor in reduced if variable not in factor[0]]
+            reduced.append(_contract(involved, variable, sizes, prime))
+
+        residues.append((math.prod(int(table) for _, table in reduced) % prime, prime))
+        modulus *= prime
+        if modulus > total_bound:
+            break
+
+    # combine the residues with the chinese remainder theorem
+    total = 0
+    for residue, prime in residues:
+        rest = modulus // prime
+        total += residue * rest * pow(rest, -1, prime)
+    return total % modulus
+
+
+def _eliminate_bounded(factors: list, sizes: dict) -> int:
+    """
+    Bounds the sum of the product of the 0/1 factors from above with
+    mini-bucket elimination: when the factors of a variable would span too
+    large a table, they are split into buckets that don't. The first bucket
+    is summed over the variable and the others are maximized over it, which
+    can only overestimate the sum.
+
+    :return: The upper bound, or None if it overflows a float.
+    """
+    factors = [(axes, table.astype(np.float64)) for axes, table in factors]
+
+    def span(axes: set) -> int:
+        return math.prod(sizes[axis] for axis in axes)
+
+    def cost(variable: int) -> int:
+        return span({axis for axes, _ in factors if variable in axes for axis in axes})
+
+    remaining = set(sizes)
+    while remaining:
+        variable = min(remaining, key=cost)
+        remaining.remove(variable)
+
+        involved = [factor for factor in factors if variable in factor[0]]
+        factors = [factor for factor in factors if variable not in factor[0]]
+        buckets = []
+        for factor in sorted(involved, key=lambda factor: -factor[1].size):
+            for axes, bucket in buckets:
+                if span(axes | set(factor[0])) <= BUCKET_LIMIT:
+                    axes.update(factor[0])
+                    bucket.append(factor)
+                    break
+            else:
+                buckets.append((set(factor[0]), [factor]))
+
+        factors.append(_contract(buckets[0][1], variable, sizes))
+        for _, bucket in buckets[1:]:
+            factors.append(_maximize(bucket, variable, sizes))
+
+    total = math.prod(float(table) for _, table in factors)
+    if not math.isfinite(total):
+        return None
+    # leave room for the rounding of float products
+    return math.ceil(total * (1 + 1e-9))
+
+
+def _maximize(involved: list, variable: int, sizes: dict) -> tuple:
+    """
+    Multiplies factors together and takes the maximum of the product over a
+    variable.
+    """
+    axes = sorted({axis for factor in involved for axis in factor[0]})
+    product = np.ones([1] * len(axes))
+    for factor_axes, table in involved:
+        order = sorted(range(len(factor_axes)), key=lambda i: factor_axes[i])
+        shape = [sizes[axis] if axis in factor_axes else 1 for axis in axes]
+        product = product * np.transpose(table, order).reshape(shape)
+    product = np.broadcast_to(product, [sizes[axis] for axis in axes])
+    return (
+        tuple(axis for axis in axes if axis != variable),
+        product.max(axis=axes.index(variable)),
+    )
+
+
+def _contract(involved: list, variable: int, sizes: dict, modulus: int = None) -> tuple:
+    """
+    Multiplies factors together and sums the product over a variable,
+    reducing modulo `modulus` after every product if one is given.
+    """
+    axes = sorted({axis for factor in involved for axis in factor[0]})
+
+    # multiply all but one factor together, then let einsum sum the product
+    # with the remaining one without materializing the full table. Leaving
+    # out the factor with the most variables of its own keeps the product
+    # small.
+    def own_size(factor: tuple) -> int:
+        others = {
+            axis for other in involved if other is not factor for axis in other[0]
+        }
+        return math.prod(sizes[axis] for axis in factor[0] if axis not in others)
+
+    last = max(involved, key=own_size)
+    involved = [factor for factor in involved if factor is not last] + [last]
+    product_axes = sorted({axis for factor in involved[:-1] for axis in factor[0]})
+    product = np.ones([1] * len(product_axes))
+    for factor_axes, table, *_ in involved[:-1]:
+        order = sorted(range(len(factor_axes)), key=lambda i: factor_axes[i])
+        shape = [sizes[axis] if axis in factor_axes else 1 for axis in product_axes]
+        product = product * np.transpose(table, order).reshape(shape)
+        if modulus:
+            product = np.fmod(product, modulus)
+
+    last_axes, last_table = involved[-1][0], involved[-1][1]
+    subscripts = {axis: index for index, axis in enumerate(axes)}
+    output_axes = [axis for axis in axes if axis != variable]
+    summed = np.einsum(
+        np.broadcast_to(product, [sizes[axis] for axis in product_axes]),
+        [subscripts[axis] for axis in product_axes],
+        last_table,
+        [subscripts[axis] for axis in last_axes],
+        [subscripts[axis] for axis in output_axes],
+        optimize=True,
+    )
+    if modulus:
+        summed = np.fmod(summed, modulus)
+    return tuple(output_axes), summed
 
-        total_combinations *= max(num_values, 1)
 
-    return total_combinations
+def _primes_below(limit: int):
+    """
+    Yields primes in descending order, starting below `limit`.
+    """
+    candidate = limit - 1
+    while candidate > 1:
+        if all(candidate % divisor for divisor in range(2, math.isqrt(candidate) + 1)):
+            yield candidate
+        candidate -= 1
+
+
+def _count_enumerated(
+    compiled: CompiledConfig, supports: list, layers: list, rules: list
+) -> int:
+    """
+    Counts a component's distinct genomes by applying its rules to every
+    combination of its layers' sampled values.
+    """
+    rules = sum(1 << order for order, _ in rules)
+    genome = [0] * len(compiled.values)
+    outcomes = set()
+    for values in itertools.product(*[supports[layer] for layer in layers]):
+        for layer, value in zip(layers, values):
+            genome[layer] = value
+        candidate = list(genome)
+        if compiled.apply_incompatibilities(candidate, rules):
+            outcomes.add(tuple(candidate[layer] for layer in layers))
+    return len(outcomes)
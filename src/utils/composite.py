@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+# fixed point precision of Pillow's alpha compositing
+PRECISION_BITS = 7
+
+
+class TraitLayer:
+    """
+    A decoded RGBA trait image, split up for compositing: only the bounding
+    box of its visible pixels is ever touched, fully opaque pixels are copied
+    and only partially transparent ones are blended.
+    """
+
+    def __init__(self, pixels: np.ndarray):
+        """
+        :param pixels: The (height × width × 4) uint8 RGBA pixels.
+        """
+        self.pixels = pixels
+        self.region = None
+        self.opaque = None
+        self.rows = self.cols = self.partial = np.empty(0, dtype=np.intp)
+
+        alpha = pixels[..., 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        if not len(rows):
+            return
+        cols = np.flatnonzero(alpha.any(axis=0))
+        self.region = (
+            slice(rows[0], rows[-1] + 1),
+            slice(cols[0], cols[-1] + 1),
+        )
+
+        alpha = alpha[self.region]
+        opaque = alpha == 255
+        if not opaque.all():
+            self.opaque = opaque
+            self.rows, self.cols = np.nonzero((alpha > 0) & ~opaque)
+            self.partial = pixels[self.region][self.rows, self.cols].astype(np.uint32)
+
+    @classmethod
+    def open(cls, path: str) -> "TraitLayer":
+        """
+        Decodes the image at the given path as RGBA.
+        """
+        return cls(np.asarray(Image.open(path).convert("RGBA")))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes
+            for array in [self.pixels, self.opaque, self.rows, self.cols, self.partial]
+            if array is not None
+        )
+
+
+def blend(buffer: np.ndarray, layer: TraitLayer):
+    """
+    Composites a trait layer over the buffer in place, with the same integer
+    arithmetic as Pillow's `Image.alpha_composite`, so results are identical.
+
+    :param buffer: The (height × width × 4) uint8 RGBA composite so far.
+    :param layer: The layer to composite over it.
+    """
+    if buffer.shape != layer.pixels.shape:
+        raise ValueError("images do not match")
+    if layer.region is None:
+        return
+
+    region = buffer[layer.region]
+    if layer.opaque is None:
+        region[...] = layer.pixels[layer.region]
+        return
+    np.copyto(region, layer.pixels[layer.region], where=layer.opaque[..., None])
+    if not len(layer.partial):
+        return
+
+    src = layer.partial
+    dst = region[layer.rows, layer.cols].astype(np.uint32)
+    src_alpha = src[:, 3]
+    out_alpha = src_alpha * 255 + dst[:, 3] * (255 - src_alpha)
+    coef1 = src_alpha * (255 * 255 << PRECISION_BITS) // out_alpha
+    coef2 = (255 << PRECISION_BITS) - coef1
+
+    color = (
+        src[:, :3] * coef1[:, None]
+        + dst[:, :3] * coef2[:, None]
+        + (0x80 << PRECISION_BITS)
+    )
+    dst[:, :3] = _div255(color) >> PRECISION_BITS
+    dst[:, 3] = _div255(out_alpha + 0x80)
+    region[layer.rows, layer.cols] = dst
+
+
+def _div255(value: np.ndarray) -> np.ndarray:
+    """
+    Divides by 255 with a pair of shifts, like Pillow's `SHIFTFORDIV255`.
+    """
+    return ((value >> 8) + value) >> 8
+
+
+class Compositor:
+    """
+    Composites trait layers into a preallocated buffer per thread, rather
+    than allocating a new image per layer.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Resets the calling thread's buffer to the given pixels.
+
+        :param pixels: The base layer or cached composite to start from.
+        :return: The buffer, which is reused by the thread's next composite.
+        """
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None or buffer.shape != pixels.shape:
+            buffer = self.local.buffer = np.empty(pixels.shape, dtype=np.uint8)
+        buffer[...] = pixels
+        return buffer
@@ -0,0 +1,90 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+
+class ImageEncoder:
+    """
+    Encodes composites with the configured output format and encoder settings.
+    """
+
+    # the Pillow format and file extension of every output format
+    FORMATS = {
+        "png": ("PNG", "png"),
+        "webp": ("WEBP", "webp"),
+        "jpeg": ("JPEG", "jpg"),
+    }
+    OPTIONS = [
+        "format",
+        "compress_level",
+        "optimize",
+        "quality",
+        "lossless",
+        "drop_alpha",
+    ]
+
+    def __init__(
+        self,
+        format: str = "png",
+        compress_level: int = None,
+        optimize: bool = False,
+        quality: int = None,
+        lossless: bool = False,
+        drop_alpha: bool = False,
+    ):
+        """
+        :param format: The output format, one of `FORMATS`.
+        :param compress_level: The PNG zlib compression level, from 0 to 9.
+        :param optimize: Whether PNG and JPEG encoders should spend extra time
+            minimizing the file size.
+        :param quality: The WebP and JPEG quality, from 0 to 100.
+        :param lossless: Whether WebP output is lossless.
+        :param drop_alpha: Whether to save fully opaque images without their
+            alpha channel. JPEG output never has one.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(
+                "Invalid output format '{}'. Expected one of: {}".format(
+                    format, list(self.FORMATS)
+                )
+            )
+        if compress_level is not None and not 0 <= int(compress_level) <= 9:
+            raise ValueError(
+                "Invalid compression level '{}'. Expected 0 to 9".format(compress_level)
+            )
+        if quality is not None and not 0 <= int(quality) <= 100:
+            raise ValueError("Invalid quality '{}'. Expected 0 to 100".format(quality))
+
+        self.format = format
+        self.compress_level = None if compress_level is None else int(compress_level)
+        self.optimize = bool(optimize)
+        self.quality = None if quality is None else int(quality)
+        self.lossless = bool(lossless)
+        self.drop_alpha = bool(drop_alpha)
+        self.pillow_format, self.extension = self.FORMATS[format]
+
+        if format == "png":
+            self.params = {"optimize": self.optimize}
+            if self.compress_level is not None:
+                self.params["compress_level"] = self.compress_level
+        elif format == "webp":
+            self.params = {"lossless": self.lossless}
+        else:
+            self.params = {"optimize": self.optimize}
+        if format != "png" and self.quality is not None:
+            self.params["quality"] = self.quality
+
+    def encode(self, pixels: np.ndarray) -> bytes:
+        """
+        Encodes RGBA pixels.
+
+        :param pixels: The (height × width × 4) uint8 RGBA pixels.
+        :return: The encoded image file.
+        """
+        image = Image.fromarray(pixels)
+        if self.format == "jpeg" or (self.drop_alpha and pixels[..., 3].min() == 255):
+            image = image.convert("RGB")
+        encoded = io.BytesIO()
+        image.save(encoded, self.pillow_format, **self.params)
+        return encoded.getvalue()
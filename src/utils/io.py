@@ -1,6 +1,14 @@
 import glob
 import json
 import os
+import re
+import tomllib
+from typing import Iterator
+
+import numpy as np
+
+# whitespace and the commas between the values of a JSON array
+_SEPARATORS = re.compile(r"[ \t\r\n,]*")
 
 
 def read_json(path: str) -> dict:
@@ -25,8 +33,7 @@ def write_json(path: str, obj: dict):
 
     # create folder structure if it doesn't exist
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        json.dump(obj, f, indent=4)
+    write_atomic(path, json.dumps(obj, indent=4))
 
 
 def write_file(path: str, contents: str):
@@ -39,8 +46,212 @@ def write_file(path: str, contents: str):
 
     # create folder structure if it doesn't exist
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
+    write_atomic(path, contents)
+
+
+def write_bytes(path: str, contents: bytes):
+    """
+    Writes bytes to a file
+
+    :param path: Path to the output file
+    :param contents: The bytes to write
+    """
+
+    # create folder structure if it doesn't exist
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, contents)
+
+
+def write_atomic(path: str, contents: str | bytes):
+    """
+    Writes a file through a temporary file that replaces it once complete,
+    so an interrupted write never leaves a partial file behind
+
+    :param path: Path to the output file, whose folder must exist
+    :param contents: The string or bytes to write
+    """
+    temp = path + ".tmp"
+    with open(temp, "wb" if isinstance(contents, bytes) else "w") as f:
         f.write(contents)
+    os.replace(temp, path)
+
+
+def read_toml(path: str) -> dict:
+    """
+    Reads the toml file and returns its contents as a dictionary
+
+    :param path: Path to the toml file
+    :return: Dictionary contents of the toml file
+    """
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def tomlify(obj: dict, table: str = "") -> str:
+    """
+    Converts a dictionary to TOML. None values are left out, since TOML has
+    no null, and integers beyond 64 bits are written as strings
+
+    :param obj: The dictionary to convert
+    :param table: The dotted name of the table the dictionary is nested in
+    :return: The TOML document
+    """
+    toml = ""
+    for key, value in obj.items():
+        if value is not None and not isinstance(value, dict):
+            toml += "{} = {}\n".format(_toml_key(key), _toml_value(value))
+    for key, value in obj.items():
+        if isinstance(value, dict):
+            name = "{}.{}".format(table, _toml_key(key)) if table else _toml_key(key)
+            toml += "\n[{}]\n".format(name) + tomlify(value, name)
+    return toml
+
+
+def _toml_key(key: str) -> str:
+    if key and all(c.isascii() and (c.isalnum() or c in "_-") for c in key):
+        return key
+    return _toml_value(str(key))
+
+
+def _toml_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value) if -(1 << 63) <= value < 1 << 63 else '"{}"'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[{}]".format(", ".join(_toml_value(item) for item in value))
+    # JSON string escapes are valid TOML, apart from the delete character
+    return json.dumps(str(value), ensure_ascii=False).replace("\x7f", "\\u007f")
+
+
+class JsonStreamWriter:
+    """
+    Writes a list of dicts to a file one dict at a time, either as a JSON
+    array formatted exactly like `write_json` would format the whole list, or
+    as JSON Lines.
+    """
+
+    def __init__(self, path: str, lines: bool = False):
+        """
+        :param path: Path to the output file
+        :param lines: Whether to write JSON Lines instead of a JSON array
+        """
+        self.path = path
+        self.lines = lines
+        self.count = 0
+        self.file = None
+
+    def __enter__(self) -> "JsonStreamWriter":
+        # create folder structure if it doesn't exist
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # written to a temporary file, which only replaces the path once complete
+        self.file = open(self.path + ".tmp", "w")
+        return self
+
+    def write(self, obj: dict):
+        """
+        Appends a dict to the file
+
+        :param obj: The json to write
+        """
+        if self.lines:
+            self.file.write(json.dumps(obj) + "\n")
+        else:
+            self.file.write(",\n" if self.count else "[\n")
+            self.file.write(
+                "\n".join(
+                    "    " + line for line in json.dumps(obj, indent=4).split("\n")
+                )
+            )
+        self.count += 1
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.file.close()
+            os.remove(self.path + ".tmp")
+            return
+        if not self.lines:
+            self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def read_json_stream(path: str, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Reads the dicts of a JSON array or JSON Lines file one at a time, without
+    loading the whole file
+
+    :param path: Path to the json or jsonl file
+    :param chunk_size: How many characters to read at a time
+    :return: The dicts in the file
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        idx = 0
+        started = False
+        while True:
+            chunk = f.read(chunk_size)
+            # drop the decoded values only when more of the file comes in
+            buffer = buffer[idx:] + chunk
+            idx = 0
+            while True:
+                # skip the separators between the array's values
+                idx = _SEPARATORS.match(buffer, idx).end()
+                if not started and idx < len(buffer):
+                    if buffer[idx] != "[":
+                        raise ValueError("Expected a JSON array in '{}'".format(path))
+                    idx += 1
+                    started = True
+                    continue
+                if idx == len(buffer) or buffer[idx] == "]":
+                    break
+                try:
+                    obj, idx = decoder.raw_decode(buffer, idx)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break
+                yield obj
+            if idx < len(buffer) and buffer[idx] == "]":
+                return
+            if not chunk:
+                raise json.JSONDecodeError("Expecting ']'", buffer, idx)
+
+
+def list_token_files(folder: str, extension: str, tokens: range) -> np.ndarray:
+    """
+    Marks the tokens with a non-empty `<token_id>.<extension>` file in a
+    folder, without keeping a list of the folder's file names.
+
+    :param folder: The folder to scan.
+    :param extension: The file extension, without the dot.
+    :param tokens: The token ids to look for.
+    :return: A boolean mask indexed by the token's offset in the range.
+    """
+    found = np.zeros(len(tokens), dtype=bool)
+    suffix = "." + extension
+    if not os.path.isdir(folder):
+        return found
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            stem = entry.name[: -len(suffix)]
+            if (
+                entry.name.endswith(suffix)
+                and stem.isdecimal()
+                and int(stem) in tokens
+                and entry.stat().st_size
+            ):
+                found[int(stem) - tokens.start] = True
+    return found
 
 
 def list_full_dir(path: str) -> list:
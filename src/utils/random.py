@@ -1,5 +1,9 @@
+import hashlib
+import math
 import random
 
+import numpy as np
+
 
 def seeded_weighted_selection(
     traits: list[list], seed: int = None, nonce: int = 0
@@ -20,3 +24,380 @@ def seeded_weighted_selection(
         random.seed()
 
     return random.choices(values, weights)[0]
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """
+    The SplitMix64 finalizer, scrambling every uint64 of an array.
+    """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class BatchSampler:
+    """
+    Draws weighted trait indices for many tokens at once. Every draw is a hash
+    of the seed, token id, layer and attempt rather than the next number of a
+    shared stream, so a token's traits depend only on its own coordinates and
+    tokens can be sampled in any order, on any worker, or resumed midway.
+    Each layer's draws are resolved against its cumulative weights with a
+    single `searchsorted` call.
+    """
+
+    def __init__(self, cum_weights: list[np.ndarray], seed: int = None):
+        """
+        :param cum_weights: The cumulative trait weights of each layer.
+        :param seed: The seed to use for the random selection.
+        """
+        self.cum_weights = cum_weights
+        if seed is None:
+            seed = random.getrandbits(128)
+        self.key = np.uint64(
+            int.from_bytes(
+                hashlib.blake2b(str(seed).encode(), digest_size=8).digest(),
+                byteorder="little",
+            )
+        )
+        self.layers = np.arange(len(cum_weights), dtype=np.uint64)
+
+    def uniforms(self, token_ids, attempt=0) -> np.ndarray:
+        """
+        Derives the uniform draws in [0, 1) for every layer of the given tokens.
+
+        :param token_ids: The tokens to draw for.
+        :param attempt: The attempt to draw for, per token or for all of them.
+        :return: A (tokens × layers) matrix of uniform draws.
+        """
+        token_ids = np.asarray(token_ids).astype(np.uint64).reshape(-1, 1)
+        attempt = np.asarray(attempt).astype(np.uint64).reshape(-1, 1)
+        with np.errstate(over="ignore"):
+            state = _mix(self.key ^ _mix(token_ids))
+            state = _mix(state ^ attempt)
+            state = _mix(state + self.layers)
+        return (state >> np.uint64(11)) * 2.0**-53
+
+    def sample(self, token_ids, attempt=0) -> np.ndarray:
+        """
+        Selects a trait index for every layer of the given tokens.
+
+        :param token_ids: The tokens to sample.
+        :param attempt: The attempt to sample, per token or for all of them.
+        :return: A (tokens × layers) matrix of trait indices.
+        """
+        uniforms = self.uniforms(token_ids, attempt)
+        indices = np.empty(uniforms.shape, dtype=np.intp)
+        for layer, cum_weights in enumerate(self.cum_weights):
+            # matches random.choices, which bisects right on the scaled draw
+            indices[:, layer] = np.searchsorted(
+                cum_weights, uniforms[:, layer] * cum_weights[-1], side="right"
+            )
+        return indices
+
+
+class UniqueSampler:
+    """
+    Draws distinct genomes without replacement. Every genome is a number in
+    the mixed-radix space whose digits are the sampleable values of each
+    layer, so a collection that uses the whole space costs the same per
+    token as one that uses a fraction of it.
+
+    When every layer's weights are uniform, indices are drawn with a sparse
+    Fisher–Yates shuffle. Otherwise genomes are drawn with replacement in
+    vectorized batches, rejecting the ones drawn before, which is equivalent
+    to successive weighted sampling without replacement. Once most of the
+    probability mass is drawn, rejections would dominate, and genomes are
+    drawn digit by digit from a lazily built tree of the remaining mass
+    instead. Each node keeps a Fenwick tree of its values' remaining mass
+    over plain floats, so drawing a digit and removing a drawn genome cost
+    O(log radix) each.
+    """
+
+    # subtree sizes are capped so remaining counts fit in an int64
+    MAX_COUNT = 1 << 62
+    # the share of the probability mass that must remain undrawn to keep
+    # drawing with replacement, at which each genome takes 10 draws at most
+    REJECTION_MASS = 0.1
+
+    def __init__(self, value_weights: list[np.ndarray], seed: int = None):
+        """
+        :param value_weights: The weight of each value of each layer.
+        :param seed: The seed to use for the random selection.
+        """
+        self.support = [np.flatnonzero(weights > 0) for weights in value_weights]
+        self.radices = [len(support) for support in self.support]
+        self.size = math.prod(self.radices)
+        self.uniform = all(
+            np.all(weights[support] == weights[support][0])
+            for weights, support in zip(value_weights, self.support)
+            if len(support)
+        )
+        self.rng = random.Random(seed)
+
+        # sparse Fisher–Yates state
+        self.drawn = 0
+        self.swaps = {}
+
+        # mass tree state: the probability of each layer's values, and the
+        # number of genomes below a value of each layer
+        self.probabilities = [
+            weights[support] / weights[support].sum()
+            for weights, support in zip(value_weights, self.support)
+        ]
+        self.subtree_sizes = [
+            min(math.prod(self.radices[layer + 1 :]), self.MAX_COUNT)
+            for layer in range(len(self.radices))
+        ]
+        # rejection state: the genomes drawn so far, and their total mass
+        self.numpy_rng = np.random.default_rng(self.rng.getrandbits(64))
+        self.cum_probabilities = [np.cumsum(p) for p in self.probabilities]
+        self.place_values = None
+        if self.size < 1 << 63:
+            self.place_values = np.array(
+                [
+                    math.prod(self.radices[layer + 1 :])
+                    for layer in range(len(self.radices))
+                ],
+                dtype=np.int64,
+            )
+        self.seen = set()
+        self.seen_mass = 0.0
+
+        # every layer's untouched node, copied when a node is first used
+        self.templates = [
+            (
+                _fenwick(probabilities.tolist()),
+                probabilities.tolist(),
+                [size] * len(probabilities),
+            )
+            for probabilities, size in zip(self.probabilities, self.subtree_sizes)
+        ]
+        self.nodes = {}
+
+    def encode(self, digits: list) -> int:
+        """
+        Packs per-layer digits into their index in the mixed-radix space.
+        """
+        index = 0
+        for digit, radix in zip(digits, self.radices):
+            index = index * radix + digit
+        return index
+
+    def decode(self, index: int) -> list:
+        """
+        Unpacks an index in the mixed-radix space into per-layer digits.
+        """
+        digits = []
+        for radix in reversed(self.radices):
+            index, digit = divmod(index, radix)
+            digits.append(digit)
+        return digits[::-1]
+
+    def sample(self) -> list:
+        """
+        Draws a genome that has not been drawn before.
+
+        :return: The genome's value indices, or None once the space is
+            exhausted.
+        """
+        genomes = self.sample_batch(1)
+        return genomes[0].tolist() if len(genomes) else None
+
+    def sample_batch(self, count: int) -> np.ndarray:
+        """
+        Draws genomes that have not been drawn before.
+
+        :param count: The number of genomes to draw.
+        :return: A (genomes × layers) matrix of value indices, with fewer than
+            `count` rows only once the space is exhausted.
+        """
+        if self.uniform:
+            rows = []
+            while len(rows) < count and (digits := self.__sample_uniform()) is not None:
+                rows.append(digits)
+        else:
+            rows = []
+            if self.size and self.seen is not None:
+                rows = self.__sample_rejection(count)
+            if len(rows) < count:
+                self.__build_tree()
+                while (
+                    len(rows) < count
+                    and (digits := self.__sample_weighted()) is not None
+                ):
+                    rows.append(digits)
+
+        digits = np.array(rows, dtype=np.intp).reshape(-1, len(self.radices))
+        genomes = np.empty_like(digits)
+        for layer, support in enumerate(self.support):
+            genomes[:, layer] = support[digits[:, layer]]
+        return genomes
+
+    def __sample_rejection(self, count: int) -> list:
+        """
+        Draws genomes with replacement in batches, keeping the ones not drawn
+        before in draw order, while enough of the mass remains undrawn.
+        """
+        rows = []
+        while len(rows) < count and 1 - self.seen_mass >= self.REJECTION_MASS:
+            # enough draws to expect the rest of the batch
+            draws = int((count - len(rows)) / (1 - self.seen_mass)) + 16
+            uniforms = self.numpy_rng.random((draws, len(self.radices)))
+            digits = np.empty(uniforms.shape, dtype=np.int64)
+            masses = np.ones(draws)
+            for layer, cum in enumerate(self.cum_probabilities):
+                digits[:, layer] = np.minimum(
+                    np.searchsorted(cum, uniforms[:, layer] * cum[-1], side="right"),
+                    len(cum) - 1,
+                )
+                masses *= self.probabilities[layer][digits[:, layer]]
+
+            digits = digits.tolist()
+            if self.place_values is not None:
+                keys = (np.array(digits, dtype=np.int64) @ self.place_values).tolist()
+            else:
+                keys = [self.encode(row) for row in digits]
+            for row, key, mass in zip(digits, keys, masses.tolist()):
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+                self.seen_mass += mass
+                rows.append(row)
+                if len(rows) == count or 1 - self.seen_mass < self.REJECTION_MASS:
+                    break
+        return rows
+
+    def __build_tree(self):
+        """
+        Removes the genomes drawn with replacement from the mass tree, the
+        first time it is needed.
+        """
+        if self.seen is None:
+            return
+        for key in self.seen:
+            self.__remove(self.decode(key))
+        self.seen = None
+
+    def __sample_uniform(self) -> list:
+        if self.drawn >= self.size:
+            return None
+
+        # swap a random remaining index into the next position of a virtual
+        # shuffle of the whole space, remembering only the displaced indices
+        position = self.rng.randrange(self.drawn, self.size)
+        index = self.swaps.get(position, position)
+        self.swaps[position] = self.swaps.pop(self.drawn, self.drawn)
+        self.drawn += 1
+        return self.decode(index)
+
+    def __node(self, layer: int, prefix: int) -> tuple:
+        """
+        The remaining probability mass below every value of a layer, given
+        the values drawn for the layers above it, built on first use.
+
+        :return: A tuple of the Fenwick tree of each value's live mass, the
+            mass and the number of remaining genomes below each value.
+        """
+        node = self.nodes.get((layer, prefix))
+        if node is None:
+            tree, masses, counts = self.templates[layer]
+            node = self.nodes[(layer, prefix)] = (tree[:], masses[:], counts[:])
+        return node
+
+    def __sample_weighted(self) -> list:
+        path = []
+        prefix = 0
+        for layer, radix in enumerate(self.radices):
+            tree, _, counts = self.__node(layer, prefix)
+            total = _fenwick_sum(tree)
+            digit = (
+                _fenwick_find(tree, self.rng.random() * total) if total > 0 else radix
+            )
+            if digit >= radix or not counts[digit]:
+                # rounding can exhaust the mass before the counts
+                remaining = [value for value in range(radix) if counts[value]]
+                if not remaining:
+                    return None
+                digit = remaining[self.rng.randrange(len(remaining))]
+
+            path.append(digit)
+            prefix = prefix * radix + digit
+
+        self.__remove(path)
+        return path
+
+    def __remove(self, digits: list):
+        """
+        Removes a genome's mass from every subtree on its path.
+        """
+        path = []
+        prefix = 0
+        for layer, (radix, digit) in enumerate(zip(self.radices, digits)):
+            path.append((self.__node(layer, prefix), digit))
+            prefix = prefix * radix + digit
+
+        mass = 1.0
+        for layer in reversed(range(len(path))):
+            (tree, masses, counts), digit = path[layer]
+            mass *= self.probabilities[layer][digit]
+            live = max(masses[digit], 0.0)
+            masses[digit] -= mass
+            counts[digit] -= 1
+            _fenwick_add(
+                tree,
+                digit,
+                (max(masses[digit], 0.0) if counts[digit] else 0.0) - live,
+            )
+
+
+def _fenwick(values: list) -> list:
+    """
+    Builds a Fenwick tree of prefix sums over a list of values, in O(n).
+    """
+    tree = [0.0] + list(values)
+    for index in range(1, len(tree)):
+        parent = index + (index & -index)
+        if parent < len(tree):
+            tree[parent] += tree[index]
+    return tree
+
+
+def _fenwick_add(tree: list, index: int, delta: float):
+    """
+    Adds to the value at an index of a Fenwick tree.
+    """
+    index += 1
+    while index < len(tree):
+        tree[index] += delta
+        index += index & -index
+
+
+def _fenwick_sum(tree: list) -> float:
+    """
+    The sum of every value of a Fenwick tree.
+    """
+    total = 0.0
+    index = len(tree) - 1
+    while index:
+        total += tree[index]
+        index -= index & -index
+    return total
+
+
+def _fenwick_find(tree: list, target: float) -> int:
+    """
+    Finds the first index whose prefix sum exceeds the target, like
+    `bisect_right` on the cumulative values, or the number of values if
+    none does.
+    """
+    index = 0
+    step = 1 << (len(tree) - 1).bit_length()
+    while step:
+        child = index + step
+        if child < len(tree) and tree[child] <= target:
+            index = child
+            target -= tree[child]
+        step >>= 1
+    return index
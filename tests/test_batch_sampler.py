@@ -0,0 +1,61 @@
+import random
+from unittest.mock import Mock
+
+import numpy as np
+
+from src.utils.random import BatchSampler
+
+
+def build_sampler(weights, seed=None):
+    return BatchSampler([np.cumsum(layer) for layer in weights], seed=seed)
+
+
+def test_batch_sampler_shape_and_range():
+    sampler = build_sampler([[20, 30, 50], [100], [50, 50]], seed=123456)
+    indices = sampler.sample(range(1000))
+
+    assert indices.shape == (1000, 3)
+    assert indices[:, 0].max() <= 2
+    assert (indices[:, 1] == 0).all()
+    assert set(indices[:, 2]) == {0, 1}
+
+
+def test_batch_sampler_is_reproducible_with_seed():
+    weights = [[1, 2, 3], [5, 5]]
+    first = build_sampler(weights, seed=123456).sample(range(100))
+    second = build_sampler(weights, seed=123456).sample(range(100))
+
+    assert (first == second).all()
+
+
+def test_batch_sampler_skips_zero_weights():
+    indices = build_sampler([[0, 0, 3, 0]], seed=123456).sample(range(1000))
+
+    assert (indices == 2).all()
+
+
+def test_batch_sampler_matches_random_choices():
+    weights = [0.5, 10, 0, 39.5, 50]
+    uniforms = np.array([random.Random(seed).random() for seed in range(500)])
+    sampler = build_sampler([weights])
+    sampler.uniforms = Mock(return_value=uniforms.reshape(-1, 1))
+
+    expected = []
+    for seed in range(500):
+        random.seed(seed)
+        expected.append(random.choices(range(len(weights)), weights)[0])
+
+    assert sampler.sample(range(500))[:, 0].tolist() == expected
+
+
+def test_batch_sampler_draws_depend_only_on_coordinates():
+    sampler = build_sampler([[1, 2, 3], [5, 5], [1] * 10], seed=123456)
+    indices = sampler.sample(range(100))
+
+    assert (sampler.sample([42, 7]) == indices[[42, 7]]).all()
+    assert (sampler.sample(range(100), attempt=1) != indices).any()
+    assert (sampler.sample([42], attempt=1) == sampler.sample(range(100), 1)[42]).all()
+    assert (
+        build_sampler([[1, 2, 3], [5, 5], [1] * 10], seed=1).sample(range(100))
+        != indices
+    ).any()
@@ -0,0 +1,56 @@
+import json
+
+from benchmarks.run import main
+
+STAGES = [
+    "sampling",
+    "decode",
+    "composite",
+    "composite_uncached",
+    "encode",
+    "generate",
+]
+
+
+def test_benchmark_writes_comparable_results(tmp_path):
+    args = [
+        "--layers",
+        "3",
+        "--values",
+        "3",
+        "--size",
+        "16",
+        "--incompatibilities",
+        "2",
+        "-n",
+        "10",
+        "--workers",
+        "1",
+        "--render-backend",
+        "thread",
+        "--encode-sample",
+        "5",
+        "--repeat",
+        "1",
+        "--workdir",
+        str(tmp_path / "work"),
+    ]
+    main(args + ["-o", str(tmp_path / "before.json")])
+    results = main(
+        args
+        + [
+            "-o",
+            str(tmp_path / "after.json"),
+            "--compare",
+            str(tmp_path / "before.json"),
+        ]
+    )
+
+    with open(tmp_path / "after.json") as f:
+        assert json.load(f) == json.loads(json.dumps(results))
+    assert list(results["results"]) == STAGES
+    for stage in STAGES:
+        assert results["results"][stage]["items"] > 0
+        assert results["results"][stage]["items_per_second"] > 0
+    assert results["results"]["sampling"]["items"] == 10
+    assert results["params"]["layers"] == 3
@@ -0,0 +1,156 @@
+import itertools
+import math
+import random
+
+import numpy as np
+import pytest
+
+from src.common.compiled import CompiledConfig
+from src.utils import calc
+from src.utils.calc import calculate_possible_combinations, count_possible_combinations
+from src.utils.io import read_json
+
+
+def count_by_enumeration(config: dict) -> int:
+    compiled = CompiledConfig(config)
+    supports = [np.flatnonzero(weights > 0) for weights in compiled.value_weights]
+    genomes = set()
+    for genome in itertools.product(*supports):
+        genome = [int(index) for index in genome]
+        if compiled.apply_incompatibilities(genome):
+            genomes.add(tuple(genome))
+    return len(genomes)
+
+
+def random_config(rng: random.Random) -> dict:
+    layers = []
+    for layer in range(rng.randint(1, 4)):
+        values = [
+            rng.choice(["Shared", "Other"]) if rng.random() < 0.3 else f"{layer}-{i}"
+            for i in range(rng.randint(1, 4))
+        ]
+        weights = [rng.choice([0, 1, 5]) for _ in values]
+        weights[0] = max(weights[0], 1)
+        layers.append(
+            {
+                "name": f"Layer {layer}",
+                "values": values,
+                "trait_path": ".",
+                "filename": values,
+                "weights": weights,
+            }
+        )
+
+    all_values = [value for layer in layers for value in layer["values"]]
+    incompatibilities = []
+    for rule in range(rng.randint(0, 5)):
+        layer = rng.choice(layers)
+        incompatibility = {
+            "layer": layer["name"],
+            "value": rng.choice(layer["values"]),
+            "incompatible_with": rng.sample(all_values, min(len(all_values), 2)),
+        }
+        if rng.random() < 0.5:
+            incompatibility["default"] = {
+                "value": rng.choice([f"Default {rule}", rng.choice(all_values)]),
+                "filename": "default",
+            }
+        incompatibilities.append(incompatibility)
+    return {"layers": layers, "incompatibilities": incompatibilities}
+
+
+def large_config(layers: int, values: int, rules: int, defaults: bool) -> dict:
+    rng = random.Random(0)
+    incompatibilities = []
+    for rule in range(rules):
+        layer, other = rng.sample(range(layers), 2)
+        incompatibility = {
+            "layer": f"Layer {layer}",
+            "value": f"{layer}-{rng.randrange(values)}",
+            "incompatible_with": [f"{other}-{rng.randrange(values)}"],
+        }
+        if defaults and rule % 2:
+            incompatibility["default"] = {"value": f"Default {rule}", "filename": "d"}
+        incompatibilities.append(incompatibility)
+    return {
+        "layers": [
+            {
+                "name": f"Layer {layer}",
+                "values": [f"{layer}-{i}" for i in range(values)],
+                "trait_path": ".",
+                "filename": [f"{layer}-{i}" for i in range(values)],
+                "weights": [1] * values,
+            }
+            for layer in range(layers)
+        ],
+        "incompatibilities": incompatibilities,
+    }
+
+
+def test_counts_example_config():
+    assert calculate_possible_combinations(read_json("config.json")) == 50
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_enumeration(seed):
+    config = random_config(random.Random(seed))
+    assert calculate_possible_combinations(config) == count_by_enumeration(config)
+
+
+def test_counts_large_config_exactly():
+    # every value of the first layer forbids one value in each other layer
+    layers = [
+        {
+            "name": f"Layer {layer}",
+            "values": [f"{layer}-{i}" for i in range(10)],
+            "trait_path": ".",
+            "filename": [f"{layer}-{i}" for i in range(10)],
+            "weights": [1] * 10,
+        }
+        for layer in range(30)
+    ]
+    incompatibilities = [
+        {
+            "layer": "Layer 0",
+            "value": f"0-{i}",
+            "incompatible_with": [f"{layer}-{i}" for layer in range(1, 30)],
+        }
+        for i in range(10)
+    ]
+    config = {"layers": layers, "incompatibilities": incompatibilities}
+    assert calculate_possible_combinations(config) == 10 * 9**29
+
+
+@pytest.mark.parametrize(
+    "layers, values, rules, defaults",
+    [
+        (12, 10, 200, False),
+        (16, 10, 500, False),
+        (24, 20, 300, False),
+        (30, 10, 1000, False),
+        (10, 100, 1000, False),
+        (24, 20, 300, True),
+    ],
+)
+def test_bounds_large_configs(layers, values, rules, defaults):
+    count, exact = count_possible_combinations(
+        large_config(layers, values, rules, defaults)
+    )
+    assert not exact
+    # never above the unconstrained count, as the guard against generating
+    # more than there are relies on it
+    assert 0 < count <= values**layers
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_bounds_are_sound(monkeypatch, seed):
+    monkeypatch.setattr(calc, "ELIMINATION_LIMIT", 4)
+    monkeypatch.setattr(calc, "JOINT_FACTOR_LIMIT", 4)
+    config = random_config(random.Random(seed))
+    count, exact = count_possible_combinations(config)
+    expected = count_by_enumeration(config)
+    assert count >= expected
+    assert count == expected or not exact
+    assert count <= math.prod(
+        sum(weight > 0 for weight in layer["weights"]) for layer in config["layers"]
+    )
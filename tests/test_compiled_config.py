@@ -0,0 +1,163 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from src.common.compiled import CompiledConfig
+
+config = {
+    "layers": [
+        {
+            "name": "Background",
+            "values": ["Blue", "Red", "Blue"],
+            "trait_path": "./trait-layers/backgrounds",
+            "filename": ["blue", "red", "blue-2"],
+            "weights": [40, 30, 30],
+        },
+        {
+            "name": "Foreground",
+            "values": ["Logo", "Logo 2", "Logo 3"],
+            "trait_path": "./trait-layers/foreground",
+            "filename": ["logo", "logo", "logo"],
+            "weights": [20, 40, 40],
+        },
+        {
+            "name": "Branding",
+            "values": ["A Name", "Another Name"],
+            "trait_path": "./trait-layers/text",
+            "filename": ["text", "text"],
+            "weights": [50, 50],
+        },
+    ],
+    "incompatibilities": [
+        {
+            "layer": "Background",
+            "value": "Blue",
+            "incompatible_with": ["Logo 2", "Another Name"],
+            "default": {"value": "Default", "filename": "./trait-layers/default"},
+        },
+        {
+            "layer": "Foreground",
+            "value": "Logo 3",
+            "incompatible_with": ["Red"],
+        },
+    ],
+    "baseURI": ".",
+    "name": "NFT #",
+    "description": "This is a description for this NFT series.",
+}
+
+
+def apply_incompatibilities_by_name(genome_traits):
+    for incompatibility in config["incompatibilities"]:
+        for trait in genome_traits:
+            if (
+                genome_traits[incompatibility["layer"]] == incompatibility["value"]
+                and genome_traits[trait] in incompatibility["incompatible_with"]
+            ):
+                if "default" in incompatibility:
+                    genome_traits[trait] = incompatibility["default"]["value"]
+                else:
+                    return None
+    return genome_traits
+
+
+def test_compiled_config_value_tables():
+    compiled = CompiledConfig(config)
+
+    assert compiled.values[0] == ["Blue", "Red", "Default"]
+    assert compiled.canonical[0].tolist() == [0, 1, 0]
+    assert compiled.value_indices[1]["Default"] == 3
+    assert compiled.layer_positions == {"Background": 0, "Foreground": 1, "Branding": 2}
+    assert compiled.cum_weights[1].tolist() == [20, 60, 100]
+    assert compiled.trait_paths[0] == [
+        os.path.abspath("./trait-layers/backgrounds/blue.png"),
+        os.path.abspath("./trait-layers/backgrounds/red.png"),
+        os.path.abspath("./trait-layers/default.png"),
+    ]
+
+
+def test_compiled_config_matches_name_based_incompatibilities():
+    compiled = CompiledConfig(config)
+    layers = config["layers"]
+
+    for values in itertools.product(*[layer["values"] for layer in layers]):
+        genome = [compiled.value_indices[i][value] for i, value in enumerate(values)]
+        expected = apply_incompatibilities_by_name(
+            {layer["name"]: value for layer, value in zip(layers, values)}
+        )
+
+        if expected is None:
+            assert not compiled.apply_incompatibilities(genome)
+        else:
+            assert compiled.apply_incompatibilities(genome)
+            assert compiled.genome_traits(genome) == list(expected.values())
+
+
+def apply_rules_in_order(compiled, genome):
+    for layer, value, forbidden, default in compiled.rules:
+        for trait, trait_forbidden in enumerate(forbidden):
+            if genome[layer] == value and genome[trait] in trait_forbidden:
+                if default is None:
+                    return False
+                genome[trait] = default[trait]
+    return True
+
+
+def test_compiled_config_defaults_trigger_later_rules():
+    chained = dict(
+        config,
+        incompatibilities=[
+            {
+                "layer": "Foreground",
+                "value": "Logo",
+                "incompatible_with": ["Red"],
+                "default": {"value": "Blue", "filename": "./trait-layers/default"},
+            },
+            {
+                "layer": "Background",
+                "value": "Blue",
+                "incompatible_with": ["Another Name"],
+            },
+        ],
+    )
+    compiled = CompiledConfig(chained)
+
+    # the default background of the first rule triggers the second one
+    assert not compiled.apply_incompatibilities([1, 0, 1])
+    assert compiled.apply_incompatibilities([1, 0, 1], rules=0b01)
+
+
+@pytest.mark.parametrize("chained", [False, True])
+def test_compiled_config_check_batch_matches_scalar(chained):
+    incompatibilities = config["incompatibilities"]
+    if chained:
+        incompatibilities = incompatibilities + [
+            {
+                "layer": "Branding",
+                "value": "Another Name",
+                "incompatible_with": ["Logo 3"],
+                "default": {"value": "Logo", "filename": "./trait-layers/default"},
+            },
+            {
+                "layer": "Foreground",
+                "value": "Logo",
+                "incompatible_with": ["Default", "Blue"],
+            },
+        ]
+    compiled = CompiledConfig(dict(config, incompatibilities=incompatibilities))
+
+    genomes = np.array(
+        list(itertools.product(*[range(len(values)) for values in compiled.values])),
+        dtype=np.intp,
+    )
+    checked = genomes.copy()
+    valid = compiled.check_batch(checked)
+
+    for genome, row, compatible in zip(genomes.tolist(), checked.tolist(), valid):
+        expected = list(genome)
+        assert compiled.apply_incompatibilities(genome) == compatible
+        assert apply_rules_in_order(compiled, expected) == compatible
+        if compatible:
+            assert row == genome == expected
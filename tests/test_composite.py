@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.utils.composite import Compositor, TraitLayer, blend
+
+
+def random_pixels(rng, shape, alphas=None):
+    pixels = rng.integers(0, 256, size=shape + (4,), dtype=np.uint8)
+    if alphas is not None:
+        pixels[..., 3] = rng.choice(alphas, size=shape)
+    return pixels
+
+
+@pytest.mark.parametrize("alphas", [None, [0, 255], [0, 1, 128, 254, 255], [0], [255]])
+def test_blend_matches_pillow_alpha_composite(alphas):
+    rng = np.random.default_rng(1234)
+    base = random_pixels(rng, (64, 64))
+    layers = [random_pixels(rng, (64, 64), alphas) for _ in range(4)]
+
+    # only composite over part of the image, like most trait layers
+    layers[0][:16, :, 3] = 0
+    layers[1][:, 40:, 3] = 0
+
+    expected = Image.fromarray(base)
+    buffer = Compositor().start(base)
+    for pixels in layers:
+        expected = Image.alpha_composite(expected, Image.fromarray(pixels))
+        blend(buffer, TraitLayer(pixels))
+
+    assert np.array_equal(buffer, np.asarray(expected))
+
+
+def test_blend_matches_pillow_for_every_alpha_pair():
+    alpha = np.arange(256, dtype=np.uint8)
+    src_alpha, dst_alpha = [grid.ravel() for grid in np.meshgrid(alpha, alpha)]
+    rng = np.random.default_rng(1234)
+    dst = random_pixels(rng, (256, 256))
+    src = random_pixels(rng, (256, 256))
+    dst[..., 3] = dst_alpha.reshape(256, 256)
+    src[..., 3] = src_alpha.reshape(256, 256)
+
+    expected = Image.alpha_composite(Image.fromarray(dst), Image.fromarray(src))
+    buffer = Compositor().start(dst)
+    blend(buffer, TraitLayer(src))
+
+    assert np.array_equal(buffer, np.asarray(expected))
+
+
+def test_blend_rejects_mismatched_sizes():
+    rng = np.random.default_rng(1234)
+    buffer = Compositor().start(random_pixels(rng, (4, 4)))
+
+    with pytest.raises(ValueError):
+        blend(buffer, TraitLayer(random_pixels(rng, (4, 8))))
+
+
+def test_trait_layer_bounds_visible_pixels():
+    pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+    pixels[2:4, 3:6, 3] = 255
+    pixels[5, 1, 3] = 100
+    layer = TraitLayer(pixels)
+
+    assert layer.region == (slice(2, 6), slice(1, 6))
+    assert layer.rows.tolist() == [3] and layer.cols.tolist() == [0]
+    assert TraitLayer(np.zeros((8, 8, 4), dtype=np.uint8)).region is None
@@ -4,7 +4,8 @@ from src.common.validate import validate_config
 
 
 @patch("os.path.isfile", return_value=True)
-def test_floating_point_errors(mock_isfile):
+@patch("src.common.validate.read_png_header", return_value=(1000, 1000, 8, 6))
+def test_floating_point_errors(mock_read_png_header, mock_isfile):
     valid_config = {
         "layers": [
             {
@@ -0,0 +1,479 @@
+import json
+import os
+import tomllib
+
+import pytest
+from PIL import Image
+
+from src.common.exceptions import GenerationError
+from src.core.main import Generator
+from src.core.shards import merge_shards
+from src.utils.io import read_json_stream
+from src.utils.random import BatchSampler
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    layers = []
+    for name, values in [("Background", 3), ("Foreground", 2), ("Text", 2)]:
+        trait_path = tmp_path / "traits" / name
+        trait_path.mkdir(parents=True)
+        for i in range(values):
+            Image.new("RGBA", (4, 4), (i * 60, 40, 80, 128 + i)).save(
+                trait_path / f"{i}.png"
+            )
+        layers.append(
+            {
+                "name": name,
+                "values": [f"{name} {i}" for i in range(values)],
+                "trait_path": str(trait_path),
+                "filename": [str(i) for i in range(values)],
+                "weights": [100 / values] * values,
+            }
+        )
+
+    config = {
+        "layers": layers,
+        "incompatibilities": [],
+        "baseURI": ".",
+        "name": "NFT #",
+        "description": "This is a description for this NFT series.",
+    }
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def build_args(config_path, output, **overrides):
+    args = {
+        "command": "generate",
+        "amount": "12",
+        "config": config_path,
+        "output": str(output),
+        "seed": "1234",
+        "verbose": 0,
+        "start_at": 0,
+        "image_path": None,
+        "trait_dir": None,
+        "no_pad": False,
+        "allow_duplicates": False,
+        "max_retries": 10000,
+        "sampler": "legacy",
+        "image_cache_size": 16,
+        "prefix_cache_size": 16,
+        "workers": 2,
+        "render_backend": "thread",
+        "encode_workers": None,
+        "write_workers": 2,
+        "queue_size": 2,
+        "objects_format": "json",
+        "compact_metadata": False,
+        "resume": False,
+        "shard": None,
+        "profile": False,
+        "cprofile": False,
+        "no_validation_cache": True,
+        "format": None,
+        "compress_level": None,
+        "optimize": None,
+        "quality": None,
+        "lossless": None,
+        "drop_alpha": None,
+    }
+    args.update(overrides)
+    return args
+
+
+def read_attributes(output):
+    all_objects = json.loads((output / "metadata" / "all-objects.json").read_text())
+    return [
+        tuple(attribute["value"] for attribute in genome["attributes"])
+        for genome in all_objects
+    ]
+
+
+@pytest.mark.parametrize("sampler", ["legacy", "batch", "unique"])
+def test_generate_exhausts_unique_combinations(config_path, tmp_path, sampler):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, sampler=sampler)).generate()
+
+    attributes = read_attributes(output)
+    assert len(attributes) == 12
+    assert len(set(attributes)) == 12
+    assert len(list((output / "images").iterdir())) == 12
+
+
+def test_generate_records_rejections(config_path, tmp_path):
+    generator = Generator(**build_args(config_path, tmp_path / "output"))
+    generator.generate()
+
+    assert generator.stats.rejections["duplicate"] > 0
+    assert generator.stats.rejections["incompatible"] == 0
+    assert generator.stats.total_rejections == sum(
+        generator.stats.token_retries.values()
+    )
+
+
+def test_generate_raises_when_retry_budget_is_exhausted(config_path, tmp_path):
+    generator = Generator(
+        **build_args(config_path, tmp_path / "output", max_retries="0")
+    )
+
+    with pytest.raises(GenerationError):
+        generator.generate()
+
+
+@pytest.mark.parametrize("max_retries", [0, 5])
+def test_failing_token_uses_every_retry(
+    config_path, tmp_path, monkeypatch, max_retries
+):
+    generator = Generator(
+        **build_args(config_path, tmp_path / "output", max_retries=str(max_retries))
+    )
+    attempts = []
+
+    def reject(genome):
+        attempts.append(genome)
+        return False
+
+    monkeypatch.setattr(generator.compiled, "apply_incompatibilities", reject)
+    with pytest.raises(GenerationError) as error:
+        list(generator.sample())
+
+    assert len(attempts) == max_retries + 1
+    assert generator.stats.rejections["incompatible"] == max_retries + 1
+    assert generator.stats.max_retries == max_retries
+    assert "within {} retries".format(max_retries) in str(error.value)
+    assert "(max {})".format(max_retries) in str(error.value)
+
+
+def test_batch_sampler_redraws_rejected_tokens_together(
+    config_path, tmp_path, monkeypatch
+):
+    generator = Generator(
+        **build_args(
+            config_path,
+            tmp_path / "output",
+            sampler="batch",
+            allow_duplicates=True,
+        )
+    )
+    check_batch = generator.compiled.check_batch
+    sample = BatchSampler.sample
+    checked, sampled = [], []
+
+    def reject_first_attempts(genomes):
+        checked.append(len(genomes))
+        return check_batch(genomes) & (len(checked) > 3)
+
+    def record(sampler, token_ids, attempt=0):
+        sampled.append((len(token_ids), attempt))
+        return sample(sampler, token_ids, attempt)
+
+    monkeypatch.setattr(generator.compiled, "check_batch", reject_first_attempts)
+    monkeypatch.setattr(BatchSampler, "sample", record)
+    assert len(list(generator.sample())) == 12
+
+    assert checked == [12] * 4
+    assert sampled == [(12, 0), (12, 1), (12, 2), (12, 3)]
+    assert generator.stats.rejections["incompatible"] == 12 * 3
+    assert generator.stats.token_retries == dict.fromkeys(range(12), 3)
+
+
+@pytest.mark.parametrize("sampler", ["legacy", "batch", "unique"])
+def test_generate_is_reproducible_with_seed(config_path, tmp_path, sampler):
+    for output in ["a", "b"]:
+        Generator(
+            **build_args(config_path, tmp_path / output, amount="8", sampler=sampler)
+        ).generate()
+
+    assert read_attributes(tmp_path / "a") == read_attributes(tmp_path / "b")
+
+
+def test_batch_tokens_depend_only_on_their_token_id(config_path, tmp_path):
+    Generator(
+        **build_args(
+            config_path,
+            tmp_path / "a",
+            amount="8",
+            sampler="batch",
+            allow_duplicates=True,
+        )
+    ).generate()
+    Generator(
+        **build_args(
+            config_path,
+            tmp_path / "b",
+            amount="3",
+            start_at=5,
+            sampler="batch",
+            allow_duplicates=True,
+        )
+    ).generate()
+
+    assert read_attributes(tmp_path / "a")[5:] == read_attributes(tmp_path / "b")
+
+
+def test_render_backends_produce_the_same_images(config_path, tmp_path):
+    for backend in ["process", "thread"]:
+        Generator(
+            **build_args(
+                config_path, tmp_path / backend, amount="6", render_backend=backend
+            )
+        ).generate()
+
+    for token_id in range(6):
+        image = "images/{}.png".format(token_id)
+        assert (tmp_path / "process" / image).read_bytes() == (
+            tmp_path / "thread" / image
+        ).read_bytes()
+
+
+def test_generate_uses_output_format(config_path, tmp_path):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, amount="3", format="webp")).generate()
+
+    all_objects = json.loads((output / "metadata" / "all-objects.json").read_text())
+    assert [genome["image"] for genome in all_objects] == [
+        "{}/images/{}.webp".format(output, token_id) for token_id in range(3)
+    ]
+    assert sorted(path.name for path in (output / "images").iterdir()) == [
+        "0.webp",
+        "1.webp",
+        "2.webp",
+    ]
+
+
+@pytest.mark.parametrize("objects_format", ["json", "jsonl"])
+def test_generate_streams_all_objects(config_path, tmp_path, objects_format):
+    output = tmp_path / "output"
+    Generator(
+        **build_args(config_path, output, amount="5", objects_format=objects_format)
+    ).generate()
+
+    all_objects = list(
+        read_json_stream(
+            str(output / "metadata" / "all-objects.{}".format(objects_format))
+        )
+    )
+    assert all_objects == [
+        json.loads((output / "metadata" / "{}.json".format(token_id)).read_text())
+        for token_id in range(5)
+    ]
+
+
+def test_generate_compact_metadata(config_path, tmp_path):
+    indented, compact = tmp_path / "indented", tmp_path / "compact"
+    Generator(**build_args(config_path, indented, amount="5")).generate()
+    Generator(
+        **build_args(config_path, compact, amount="5", compact_metadata=True)
+    ).generate()
+
+    for token_id in range(5):
+        name = "{}.json".format(token_id)
+        metadata = json.loads((indented / "metadata" / name).read_text())
+        assert (indented / "metadata" / name).read_text() == json.dumps(
+            metadata, indent=4
+        )
+        metadata["image"] = metadata["image"].replace(str(indented), str(compact))
+        assert (compact / "metadata" / name).read_text() == json.dumps(
+            metadata, separators=(",", ":")
+        )
+
+
+@pytest.mark.parametrize("render_backend", ["thread", "process"])
+def test_generate_writes_profile(config_path, tmp_path, render_backend):
+    output = tmp_path / "output"
+    Generator(
+        **build_args(
+            config_path,
+            output,
+            amount="6",
+            workers=1,
+            render_backend=render_backend,
+            profile=True,
+            cprofile=True,
+        )
+    ).generate()
+
+    with open(output / ".generator-profile.json") as f:
+        report = json.load(f)
+    assert {"validate", "sample", "metadata", "write", "decode"} <= set(
+        report["stages"]
+    )
+    assert report["stages"]["sample"]["calls"] == 6
+    assert report["token_latency_seconds"]["count"] == 6
+    assert report["sampling"]["tokens_with_retries"] >= 0
+    cache = report["caches"]["image_cache"]
+    assert cache["misses"] > 0
+    assert cache["hit_rate"] == cache["hits"] / (cache["hits"] + cache["misses"])
+    assert report["peak_rss_bytes"] > 0
+    assert (output / ".generator-profile" / "sample.prof").is_file()
+
+
+def test_generate_records_settings(config_path, tmp_path):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, amount="3", quality="80")).generate()
+
+    with open(output / ".generatorrc", "rb") as f:
+        settings = tomllib.load(f)
+    assert settings["amount"] == 3
+    assert settings["seed"] == 1234
+    assert settings["output"] == str(output)
+    assert settings["allow_duplicates"] is False
+    assert settings["quality"] == 80
+    assert "compress_level" not in settings
+
+
+def test_generate_resume_matches_uninterrupted_run(config_path, tmp_path):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, amount="12")).generate()
+    expected = {
+        path.relative_to(output): path.read_bytes()
+        for path in output.rglob("*")
+        if path.is_file() and path.name != ".generator-journal"
+    }
+
+    # lose some images, and the journal records of others
+    journal = (output / ".generator-journal").read_text().splitlines(True)
+    (output / ".generator-journal").write_text("".join(journal[:8]) + "done 9")
+    for record in journal[:2]:
+        (output / "images" / "{}.png".format(record.split()[1])).unlink()
+    (output / "metadata" / "all-objects.json").write_text("[")
+    os.remove(output / "metadata" / "3.json")
+
+    Generator(
+        **build_args(
+            None,
+            output,
+            amount=None,
+            seed=None,
+            sampler="batch",
+            no_pad=True,
+            resume=True,
+        )
+    ).generate()
+    assert {
+        path.relative_to(output): path.read_bytes()
+        for path in output.rglob("*")
+        if path.is_file() and path.name != ".generator-journal"
+    } == expected
+
+
+def test_generate_resume_shard(config_path, tmp_path):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, amount="12", shard="1/3")).generate()
+    journal = output / ".generator-journal.shard-1-of-3"
+    journal.write_text("".join(journal.read_text().splitlines(True)[:2]))
+    for image in (output / "images").iterdir():
+        image.unlink()
+
+    resume_args = dict(amount=None, seed=None, sampler="batch", resume=True)
+    Generator(**build_args(None, output, **resume_args)).generate()
+    assert sorted(path.name for path in (output / "images").iterdir()) == [
+        "{}.png".format(token_id) for token_id in range(4, 8)
+    ]
+    with open(output / ".generatorrc", "rb") as f:
+        settings = tomllib.load(f)
+    assert (settings["shard"], settings["shards"]) == (1, 3)
+
+    # with several shards in the folder, the one to resume has to be chosen
+    Generator(**build_args(config_path, output, amount="12", shard="2/3")).generate()
+    with pytest.raises(ValueError, match="choose the one to resume"):
+        Generator(**build_args(None, output, **resume_args))
+    with pytest.raises(ValueError, match="generated in 3 shards"):
+        Generator(**build_args(None, output, shard="0/2", **resume_args))
+    generator = Generator(**build_args(None, output, shard="1/3", **resume_args))
+    assert (generator.shard, generator.shards) == (1, 3)
+
+
+def test_generate_resume_rejects_changed_config(config_path, tmp_path):
+    output = tmp_path / "output"
+    Generator(**build_args(config_path, output, amount="3")).generate()
+
+    with open(config_path) as f:
+        config = json.load(f)
+    config["description"] = "Changed"
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    with pytest.raises(ValueError, match="changed"):
+        Generator(**build_args(config_path, output, resume=True))
+
+    with pytest.raises(ValueError, match="No generation to resume"):
+        Generator(**build_args(config_path, tmp_path / "missing", resume=True))
+
+
+def test_generate_only_rerenders_changed_tokens(config_path, tmp_path):
+    output, fresh = tmp_path / "output", tmp_path / "fresh"
+    Generator(**build_args(config_path, output)).generate()
+    # files are replaced on write, so a rewritten file is a new inode
+    written = {
+        path.name: (path.stat().st_ino, path.stat().st_mtime_ns)
+        for path in output.glob("*/*.*")
+    }
+
+    Image.new("RGBA", (4, 4), (255, 0, 0, 255)).save(
+        tmp_path / "traits" / "Text" / "1.png"
+    )
+    Generator(**build_args(config_path, output)).generate()
+    Generator(**build_args(config_path, fresh)).generate()
+
+    rewritten = {
+        path.name
+        for path in output.glob("*/*.*")
+        if (path.stat().st_ino, path.stat().st_mtime_ns) != written[path.name]
+    }
+    all_objects = list(read_json_stream(str(output / "metadata" / "all-objects.json")))
+    assert rewritten == {"all-objects.json"} | {
+        "{}.png".format(token["token_id"])
+        for token in all_objects
+        if token["attributes"][2]["value"] == "Text 1"
+    }
+    for path in fresh.glob("*/*.*"):
+        assert (
+            path.read_bytes().replace(str(fresh).encode(), str(output).encode())
+            == (output / path.parent.name / path.name).read_bytes()
+        )
+
+
+@pytest.mark.parametrize("sampler", ["legacy", "batch", "unique"])
+def test_merged_shards_match_unsharded_generation(config_path, tmp_path, sampler):
+    sharded, full = tmp_path / "sharded", tmp_path / "full"
+    for shard in range(3):
+        Generator(
+            **build_args(
+                config_path, sharded, sampler=sampler, shard="{}/3".format(shard)
+            )
+        ).generate()
+    merge_shards(str(sharded), 0)
+    Generator(**build_args(config_path, full, sampler=sampler)).generate()
+
+    for path in full.glob("*/*.*"):
+        assert (
+            path.read_bytes().replace(str(full).encode(), str(sharded).encode())
+            == (sharded / path.parent.name / path.name).read_bytes()
+        )
+    assert (
+        len(list(read_json_stream(str(sharded / "metadata" / "all-objects.json"))))
+        == 12
+    )
+
+
+def test_merge_reports_incomplete_shards(config_path, tmp_path):
+    output = tmp_path / "output"
+    for shard in range(2):
+        Generator(
+            **build_args(config_path, output, shard="{}/2".format(shard))
+        ).generate()
+    os.remove(output / "images" / "3.png")
+
+    with pytest.raises(
+        GenerationError, match=r"without a metadata file or image: \[3\]"
+    ):
+        merge_shards(str(output), 0)
+    assert not (output / "metadata" / "all-objects.json").exists()
+
+    os.remove(output / "metadata" / "all-objects.shard-1-of-2.json")
+    with pytest.raises(GenerationError, match=r"shards \[1\] of 2"):
+        merge_shards(str(output), 0)
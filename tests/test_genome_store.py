@@ -0,0 +1,43 @@
+import itertools
+import random
+
+import pytest
+
+from src.core.store import GenomeStore
+
+
+@pytest.mark.parametrize("radices", [[3, 2, 4], [1 << 20] * 4])
+def test_genome_store_rejects_duplicates(radices):
+    store = GenomeStore(radices, capacity=2)
+    rng = random.Random(1234)
+    seen = set()
+
+    for _ in range(2000):
+        genome = [rng.randrange(min(radix, 5)) for radix in radices]
+        assert store.add(genome) == (tuple(genome) not in seen)
+        seen.add(tuple(genome))
+
+    assert len(store) == len(seen)
+    assert all(genome in store for genome in seen)
+    assert store.exact == (radices == [3, 2, 4])
+
+
+def test_genome_store_grows_past_its_capacity():
+    store = GenomeStore([3, 2, 4], capacity=1)
+    genomes = list(itertools.product(range(3), range(2), range(4)))
+    for genome in genomes:
+        assert store.add(list(genome))
+
+    assert len(store) == len(genomes)
+    assert all(genome in store for genome in genomes)
+    assert not any(store.add(list(genome)) for genome in genomes)
+
+
+def test_genome_store_is_compact():
+    store = GenomeStore([300] * 8, capacity=100_000)
+    for token in range(100_000):
+        store.add([(token * 7 + layer) % 300 for layer in range(8)])
+
+    assert not hasattr(store, "genomes")
+    # a set of tuples would take a few hundred bytes per genome
+    assert store.nbytes < 100_000 * 32
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from src.utils.cache import ImageCache, PrefixCache
+
+
+def make_images(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = str(tmp_path / "{}.png".format(i))
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_image_cache_returns_shared_rgba_images(tmp_path):
+    path = make_images(tmp_path, 1)[0]
+    cache = ImageCache(1 << 20)
+
+    first = cache.get(path)
+    assert first.pixels.shape == (4, 4, 4)
+    assert cache.get(path) is first
+    assert (cache.hits, cache.misses, cache.size) == (1, 1, 64)
+
+
+def test_image_cache_evicts_least_recently_used(tmp_path):
+    paths = make_images(tmp_path, 3)
+    cache = ImageCache(128)
+
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+
+    assert list(cache.images) == [paths[0], paths[2]]
+    assert cache.evictions == 1
+    assert cache.size == 128
+
+
+def test_image_cache_skips_images_over_budget(tmp_path):
+    path = make_images(tmp_path, 1)[0]
+    cache = ImageCache(32)
+
+    assert cache.get(path).pixels.shape == (4, 4, 4)
+    assert cache.size == 0
+    assert not cache.images
+
+
+def test_image_cache_is_thread_safe(tmp_path):
+    paths = make_images(tmp_path, 8)
+    cache = ImageCache(4 * 64)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(cache.get, paths * 50))
+
+    assert cache.hits + cache.misses == 400
+    assert cache.size == sum(image.nbytes for image in cache.images.values())
+    assert cache.size <= cache.max_bytes
+
+
+def test_prefix_cache_finds_longest_cached_prefix():
+    cache = PrefixCache(1 << 20)
+    shallow = np.zeros((4, 4, 4), dtype=np.uint8)
+    deep = np.zeros((4, 4, 4), dtype=np.uint8)
+    cache.store((0, 1), shallow)
+    cache.store((0, 1, 2), deep)
+
+    assert cache.longest_prefix((0, 1, 2, 3))[0] == 3
+    assert cache.longest_prefix((0, 1, 2, 3))[1] is deep
+    assert cache.longest_prefix((0, 1, 3, 3))[1] is shallow
+    assert cache.longest_prefix((1, 1, 2, 3)) == (0, None)
+    assert cache.longest_prefix((0, 1, 2), min_depth=4) == (0, None)
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_prefix_cache_refreshes_ancestors_on_hit():
+    pixels = np.zeros((4, 4, 4), dtype=np.uint8)
+    cache = PrefixCache(3 * pixels.nbytes)
+    cache.store((0, 1), pixels)
+    cache.store((0, 1, 2), pixels)
+    cache.store((5, 5), pixels)
+
+    # using the deep prefix keeps its shallow ancestor over the unused one
+    cache.longest_prefix((0, 1, 2, 3))
+    cache.store((0, 1, 3), pixels)
+    assert (5, 5) not in cache.images
+    assert (0, 1) in cache.images
+
+
+def test_prefix_cache_keeps_copies_in_released_memory():
+    pixels = np.zeros((4, 4, 4), dtype=np.uint8)
+    cache = PrefixCache(2 * pixels.nbytes)
+    cache.keep((0, 1), pixels)
+    first = cache.images[(0, 1)]
+    assert first is not pixels
+
+    cache.release((0, 1))
+    assert cache.longest_prefix((0, 1, 0)) == (0, None)
+    assert cache.size == pixels.nbytes
+
+    pixels[...] = 7
+    cache.keep((0, 2), pixels)
+    assert cache.images[(0, 2)] is first
+    assert (first == 7).all()
+    assert cache.size == pixels.nbytes
+    assert cache.longest_prefix((0, 2, 0), start=np.copy)[1] is not first
+
+    # released composites are evicted before any cached one
+    cache.release((0, 2))
+    cache.keep((0, 3), np.zeros((2, 2, 4), dtype=np.uint8))
+    cache.store((0, 4), pixels)
+    assert cache.spares == []
+    assert list(cache.images) == [(0, 3), (0, 4)]
@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.utils.encoding import ImageEncoder
+
+
+@pytest.fixture
+def pixels():
+    pixels = np.random.default_rng(1234).integers(0, 256, (8, 8, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+def test_image_encoder_defaults_match_pillow_png(pixels):
+    expected = io.BytesIO()
+    Image.fromarray(pixels).save(expected, format="PNG")
+
+    assert ImageEncoder().encode(pixels) == expected.getvalue()
+
+
+@pytest.mark.parametrize(
+    "options, extension, mode",
+    [
+        ({"compress_level": 1}, "png", "RGBA"),
+        ({"drop_alpha": True}, "png", "RGB"),
+        ({"format": "webp", "lossless": True}, "webp", None),
+        ({"format": "jpeg", "quality": 80}, "jpg", "RGB"),
+    ],
+)
+def test_image_encoder_formats(pixels, options, extension, mode):
+    encoder = ImageEncoder(**options)
+
+    assert encoder.extension == extension
+    with Image.open(io.BytesIO(encoder.encode(pixels))) as image:
+        # WebP decides for itself whether opaque images keep their alpha
+        if mode is not None:
+            assert image.mode == mode
+        if extension != "jpg":
+            assert np.array_equal(np.asarray(image.convert("RGBA")), pixels)
+
+
+def test_image_encoder_keeps_alpha_of_translucent_images(pixels):
+    pixels[0, 0, 3] = 128
+    encoded = ImageEncoder(drop_alpha=True).encode(pixels)
+
+    with Image.open(io.BytesIO(encoded)) as image:
+        assert image.mode == "RGBA"
+
+
+@pytest.mark.parametrize(
+    "options", [{"format": "gif"}, {"compress_level": 10}, {"quality": -1}]
+)
+def test_image_encoder_rejects_invalid_options(options):
+    with pytest.raises(ValueError):
+        ImageEncoder(**options)
@@ -0,0 +1,48 @@
+from src.core.journal import Journal
+
+
+def outcomes(journal, tokens=range(5)):
+    keys, done, failed = journal.read(tokens)
+    return (
+        {
+            token_id: keys[index].tobytes()
+            for index, token_id in enumerate(tokens)
+            if done[index]
+        },
+        {token_id for index, token_id in enumerate(tokens) if failed[index]},
+    )
+
+
+def key(letter):
+    return letter.encode() * 16
+
+
+def test_journal_round_trip(tmp_path):
+    journal = Journal(str(tmp_path / ".generator-journal"))
+    assert outcomes(journal) == ({}, set())
+
+    with journal.open():
+        journal.record(
+            [(0, key("a"), None), (1, key("b"), 'bad "image"\n'), (2, key("c"), None)]
+        )
+    with journal.open(append=True):
+        journal.record([(1, key("d"), None), (2, key("e"), "error")])
+
+    assert outcomes(journal) == ({0: key("a"), 1: key("d")}, {2})
+    # tokens outside the range are skipped
+    assert outcomes(journal, range(1, 2)) == ({1: key("d")}, set())
+
+    with journal.open():
+        journal.record([(3, key("f"), None)])
+    assert outcomes(journal) == ({3: key("f")}, set())
+
+
+def test_journal_ignores_partial_records(tmp_path):
+    path = tmp_path / ".generator-journal"
+    path.write_text(
+        'done 0 {}\nfailed 1 "error"\ngarbage\ndone 2 xyz\ndone 1 {}'.format(
+            key("a").hex(), key("b").hex()
+        )
+    )
+
+    assert outcomes(Journal(str(path))) == ({0: key("a")}, {1})
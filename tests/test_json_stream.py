@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from src.utils.io import JsonStreamWriter, read_json_stream
+
+OBJECTS = [
+    {
+        "token_id": i,
+        "name": 'NFT "#{}"\n'.format(i),
+        "attributes": [{"trait_type": "Background", "value": "Blue ✓"}],
+        "empty": {},
+        "none": [],
+    }
+    for i in range(5)
+]
+
+
+@pytest.mark.parametrize("count", [0, 1, 5])
+def test_json_stream_writer_matches_indented_dump(tmp_path, count):
+    path = str(tmp_path / "all-objects.json")
+    with JsonStreamWriter(path) as writer:
+        for obj in OBJECTS[:count]:
+            writer.write(obj)
+
+    with open(path) as f:
+        assert f.read() == json.dumps(OBJECTS[:count], indent=4)
+
+
+@pytest.mark.parametrize("name", ["all-objects.json", "all-objects.jsonl"])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_read_json_stream_round_trip(tmp_path, name, chunk_size):
+    path = str(tmp_path / name)
+    with JsonStreamWriter(path, lines=name.endswith(".jsonl")) as writer:
+        for obj in OBJECTS:
+            writer.write(obj)
+
+    assert list(read_json_stream(path, chunk_size=chunk_size)) == OBJECTS
+
+
+@pytest.mark.parametrize("cut", [2, 20])
+def test_read_json_stream_rejects_truncated_files(tmp_path, cut):
+    path = tmp_path / "all-objects.json"
+    path.write_text(json.dumps(OBJECTS, indent=4)[:-cut])
+
+    with pytest.raises(json.JSONDecodeError):
+        list(read_json_stream(str(path)))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+def test_read_json_stream_skips_separators(tmp_path, chunk_size):
+    path = tmp_path / "all-objects.json"
+    path.write_text('\n [ {"a": [1, 2]} ,\n\t{"b": "]"},{}\r\n ]\n')
+    empty = tmp_path / "empty.json"
+    empty.write_text(" [ ] ")
+    scalar = tmp_path / "scalar.json"
+    scalar.write_text(' {"a": 1} ')
+
+    assert list(read_json_stream(str(path), chunk_size)) == [
+        {"a": [1, 2]},
+        {"b": "]"},
+        {},
+    ]
+    assert list(read_json_stream(str(empty), chunk_size)) == []
+    with pytest.raises(ValueError):
+        list(read_json_stream(str(scalar), chunk_size))
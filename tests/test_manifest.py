@@ -0,0 +1,64 @@
+from src.core.manifest import Manifest, hash_bytes, hash_file
+
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / ".generator-manifest")
+    manifest = Manifest(path, range(2, 12))
+    manifest.traits = {"traits/0.png": hash_bytes(b"a")}
+    manifest.set(10, hash_bytes(b"b"), hash_bytes(b"c"))
+    manifest.set(2, hash_bytes(b"d"), hash_bytes(b"e"))
+    manifest.save()
+
+    loaded = Manifest.load(path)
+    assert loaded.tokens == range(2, 12)
+    assert loaded.traits == manifest.traits
+    assert len(loaded) == 2
+    assert loaded.get(10) == (hash_bytes(b"b"), hash_bytes(b"c"))
+    assert loaded.get(2) == (hash_bytes(b"d"), hash_bytes(b"e"))
+    assert loaded.get(3) is None and loaded.get(100) is None
+
+    # only the requested tokens are read
+    shard = Manifest.load(path, range(8, 20))
+    assert shard.tokens == range(8, 20)
+    assert shard.get(10) == (hash_bytes(b"b"), hash_bytes(b"c"))
+    assert 2 not in shard
+
+
+def test_manifest_update(tmp_path):
+    first = Manifest(str(tmp_path / "first"), range(0, 5))
+    first.set(1, hash_bytes(b"a"), hash_bytes(b"b"))
+    second = Manifest(str(tmp_path / "second"), range(5, 10))
+    second.set(7, hash_bytes(b"c"), hash_bytes(b"d"))
+    second.discard(7)
+    second.set(8, hash_bytes(b"e"), hash_bytes(b"f"))
+
+    merged = Manifest(str(tmp_path / "merged"), range(10))
+    merged.update(first)
+    merged.update(second)
+    assert [token_id for token_id in range(10) if token_id in merged] == [1, 8]
+    assert merged.get(8) == (hash_bytes(b"e"), hash_bytes(b"f"))
+
+
+def test_manifest_memory_per_token(tmp_path):
+    manifest = Manifest(str(tmp_path / ".generator-manifest"), range(1_000_000))
+    assert manifest.nbytes <= 1_000_000 * 33
+
+
+def test_manifest_load_ignores_unreadable_files(tmp_path):
+    path = tmp_path / ".generator-manifest"
+    assert len(Manifest.load(str(path))) == 0
+
+    path.write_text('{"traits": {}, "tokens": {"1": ["a"')
+    assert len(Manifest.load(str(path))) == 0
+
+    manifest = Manifest(str(path), range(10))
+    manifest.set(1, hash_bytes(b"a"), hash_bytes(b"b"))
+    manifest.save()
+    path.write_bytes(path.read_bytes()[:-5])
+    assert len(Manifest.load(str(path), range(10))) == 0
+
+
+def test_hash_file_matches_contents(tmp_path):
+    path = tmp_path / "trait.png"
+    path.write_bytes(b"\x89PNG" * 1000)
+    assert hash_file(str(path)) == hash_bytes(b"\x89PNG" * 1000)
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from src.core.metadata import MetadataWriter
+
+DESCRIPTION = 'A "description"\nwith ✓ unicode'
+OBJECTS = [
+    {
+        "token_id": i,
+        "image": "./output/images/{}.png".format(i),
+        "name": "NFT #{}".format(i),
+        "description": DESCRIPTION if i % 3 else "overridden",
+        "attributes": [
+            {"trait_type": "Background", "value": "Blue"},
+            {"trait_type": "Nested", "value": {"a": [1, 2.5, None, True]}},
+        ],
+        "empty": {},
+        "none": [],
+    }
+    for i in range(200)
+]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_metadata_writer_matches_json_dump(compact):
+    writer = MetadataWriter(
+        "unused", static={"description": DESCRIPTION}, compact=compact
+    )
+    for obj in OBJECTS[:5] + [{}]:
+        if compact:
+            assert writer.dumps(obj) == json.dumps(obj, separators=(",", ":"))
+        else:
+            assert writer.dumps(obj) == json.dumps(obj, indent=4)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 1000])
+def test_metadata_writer_writes_every_file(tmp_path, batch_size):
+    folder = str(tmp_path / "output" / "metadata")
+    with MetadataWriter(
+        folder,
+        static={"description": DESCRIPTION},
+        workers=3,
+        batch_size=batch_size,
+    ) as writer:
+        for obj in OBJECTS:
+            writer.write(obj["token_id"], obj)
+
+    assert sorted(os.listdir(folder)) == sorted(
+        "{}.json".format(i) for i in range(len(OBJECTS))
+    )
+    for obj in OBJECTS:
+        with open(os.path.join(folder, "{}.json".format(obj["token_id"]))) as f:
+            assert f.read() == json.dumps(obj, indent=4)
+
+
+def test_metadata_writer_raises_write_errors(tmp_path):
+    folder = tmp_path / "metadata"
+    with pytest.raises(OSError):
+        with MetadataWriter(str(folder), batch_size=1) as writer:
+            # a folder in the way of a metadata file
+            os.makedirs(folder / "1.json")
+            for obj in OBJECTS[:5]:
+                writer.write(obj["token_id"], obj)
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from src.core.pipeline import Pipeline
+
+
+def test_pipeline_processes_every_item():
+    pipeline = Pipeline(
+        [("double", lambda x: x * 2, 3), ("increment", lambda x: x + 1, 2)],
+        queue_size=2,
+    )
+
+    assert sorted(pipeline.run(range(100))) == [x * 2 + 1 for x in range(100)]
+
+
+def test_pipeline_applies_backpressure():
+    produced = []
+    in_flight = []
+
+    def source():
+        for x in range(50):
+            produced.append(x)
+            yield x
+
+    def slow(x):
+        time.sleep(0.001)
+        return x
+
+    pipeline = Pipeline([("slow", slow, 1)], queue_size=2)
+    for x in pipeline.run(source()):
+        in_flight.append(len(produced) - x)
+
+    # two queues of two items, one in the stage and one in the feeder
+    assert max(in_flight) <= 2 + 2 + 2
+
+
+def test_pipeline_raises_stage_errors():
+    def fail(x):
+        raise ValueError(x)
+
+    with pytest.raises(ValueError):
+        list(Pipeline([("fail", fail, 2)], queue_size=2).run(range(10)))
+
+
+def test_pipeline_drains_before_raising_source_errors():
+    def source():
+        yield from range(5)
+        raise RuntimeError("sampling failed")
+
+    results = []
+    with pytest.raises(RuntimeError):
+        for x in Pipeline([("identity", lambda x: x, 1)], queue_size=2).run(source()):
+            results.append(x)
+
+    assert sorted(results) == list(range(5))
+
+
+def test_pipeline_raises_interrupts_from_stages():
+    def interrupt(x):
+        if x == 3:
+            raise KeyboardInterrupt
+        return x
+
+    pipeline = Pipeline(
+        [("interrupt", interrupt, 2), ("identity", lambda x: x, 2)], queue_size=2
+    )
+    with pytest.raises(KeyboardInterrupt):
+        list(pipeline.run(range(100)))
@@ -0,0 +1,75 @@
+import pstats
+
+import pytest
+
+from src.core.profiler import Profiler
+
+
+def test_profiler_times_stages():
+    profiler = Profiler()
+    with profiler.stage("sample"):
+        sum(range(1000))
+    double = profiler.wrap("encode", lambda value: value * 2)
+    assert [double(value) for value in range(3)] == [0, 2, 4]
+
+    stages = profiler.report()["stages"]
+    assert stages["sample"]["calls"] == 1
+    assert stages["encode"]["calls"] == 3
+    assert stages["encode"]["wall_seconds"] >= 0
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    function = lambda: None  # noqa: E731
+    assert profiler.wrap("encode", function) is function
+    with profiler.stage("sample"):
+        pass
+    profiler.count("hits")
+    profiler.latency(1.0)
+
+    report = profiler.report()
+    assert report["stages"] == {}
+    assert report["counters"] == {}
+    assert report["token_latency_seconds"]["count"] == 0
+
+
+def test_profiler_merges_drained_timings():
+    worker, parent = Profiler(), Profiler()
+    with worker.stage("composite"):
+        pass
+    worker.count("image_cache_hits", 3)
+
+    parent.merge(worker.drain())
+    parent.merge(worker.drain())
+    report = parent.report()
+    assert report["stages"]["composite"]["calls"] == 1
+    assert report["counters"] == {"image_cache_hits": 3}
+
+
+def test_profiler_latency_percentiles():
+    profiler = Profiler()
+    for value in range(1, 101):
+        profiler.latency(value / 100)
+
+    latency = profiler.report()["token_latency_seconds"]
+    assert latency["count"] == 100
+    assert latency["p50"] == pytest.approx(0.505)
+    assert latency["p99"] == pytest.approx(0.9901)
+    assert latency["max"] == 1.0
+
+
+def test_profiler_dumps_a_cprofile_per_stage(tmp_path):
+    profiler = Profiler(cprofile=True)
+    with profiler.stage("render"):
+        # nested stages are part of the enclosing stage's profile
+        with profiler.stage("encode"):
+            sorted(range(1000))
+    with profiler.stage("write"):
+        pass
+
+    paths = profiler.dump(str(tmp_path), suffix="-main")
+    assert sorted(paths) == [
+        str(tmp_path / "render-main.prof"),
+        str(tmp_path / "write-main.prof"),
+    ]
+    assert pstats.Stats(paths[0]).total_calls > 0
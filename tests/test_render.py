@@ -0,0 +1,81 @@
+import itertools
+import random
+import signal
+
+import pytest
+from PIL import Image
+
+from src.core.render import Renderer, init_worker, plan_prefixes
+from src.utils.cache import ImageCache, PrefixCache
+from src.utils.encoding import ImageEncoder
+
+
+@pytest.fixture
+def trait_paths(tmp_path):
+    rng = random.Random(1234)
+    trait_paths = []
+    for layer, count in enumerate([2, 3, 2, 2]):
+        paths = []
+        for value in range(count):
+            image = Image.new("RGBA", (4, 4))
+            image.putdata(
+                [tuple(rng.randrange(256) for _ in range(4)) for _ in range(16)]
+            )
+            path = str(tmp_path / "{}-{}.png".format(layer, value))
+            image.save(path)
+            paths.append(path)
+        trait_paths.append(paths)
+    return trait_paths
+
+
+def composite_from_scratch(trait_paths, genome):
+    layers = [
+        Image.open(paths[index]).convert("RGBA")
+        for paths, index in zip(trait_paths, genome)
+    ]
+    main_composite = layers[0]
+    for remaining in layers[1:]:
+        main_composite = Image.alpha_composite(main_composite, remaining)
+    return main_composite
+
+
+@pytest.mark.parametrize("prefix_bytes", [0, 1 << 20])
+def test_renderer_matches_compositing_from_scratch(trait_paths, prefix_bytes):
+    renderer = Renderer(
+        trait_paths,
+        ImageEncoder(),
+        ImageCache(1 << 20),
+        PrefixCache(prefix_bytes),
+    )
+    genomes = list(itertools.product(*[range(len(paths)) for paths in trait_paths]))
+
+    for genome, keep in zip(genomes, plan_prefixes(genomes)):
+        expected = composite_from_scratch(trait_paths, genome)
+        assert renderer.composite(genome, keep).tobytes() == expected.tobytes()
+
+    if prefix_bytes:
+        # only the first genome with each pair of leading values misses
+        assert renderer.prefixes.misses == 2 * 3
+        assert renderer.prefixes.hits == len(genomes) - 2 * 3
+        # prefixes are released once no later genome starts from them, and
+        # their memory is reused
+        assert len(renderer.prefixes.images) + len(renderer.prefixes.spares) == 2
+
+
+def test_plan_prefixes_caches_reused_prefixes_once():
+    genomes = [(0, 0, 0, 0), (0, 0, 0, 1), (0, 0, 1, 0), (0, 1, 0, 0), (1, 0, 0, 0)]
+
+    # the first genome composites every prefix the next three start from
+    assert plan_prefixes(genomes) == [(2, 3), (), (), (), ()]
+    assert plan_prefixes([(0, 1), (0, 1), (1, 1)]) == [(), (), ()]
+    assert plan_prefixes([(0, 1, 2), (0, 1, 2)]) == [(2,), ()]
+    assert plan_prefixes([]) == []
+
+
+def test_init_worker_leaves_interrupts_to_the_main_process(trait_paths):
+    previous = signal.getsignal(signal.SIGINT)
+    try:
+        init_worker(trait_paths, ImageEncoder(), 1 << 20, 0)
+        assert signal.getsignal(signal.SIGINT) is signal.SIG_IGN
+    finally:
+        signal.signal(signal.SIGINT, previous)
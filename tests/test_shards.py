@@ -0,0 +1,21 @@
+import pytest
+
+from src.core.shards import parse_shard, shard_range
+
+
+def test_parse_shard():
+    assert parse_shard(None) == (0, 1)
+    assert parse_shard("2/3") == (2, 3)
+    for shard in ["3/3", "1", "-1/3", "a/b", "1/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+
+@pytest.mark.parametrize("amount, shards", [(10, 3), (2, 4), (1000, 7)])
+def test_shard_ranges_cover_the_collection(amount, shards):
+    token_ids = [
+        token_id
+        for shard in range(shards)
+        for token_id in shard_range(5, amount, shard, shards)
+    ]
+    assert token_ids == list(range(5, 5 + amount))
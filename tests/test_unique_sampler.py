@@ -0,0 +1,94 @@
+import time
+
+import numpy as np
+
+from src.utils.random import BatchSampler, UniqueSampler
+
+
+def sample_all(sampler):
+    genomes = []
+    while (genome := sampler.sample()) is not None:
+        genomes.append(tuple(genome))
+    return genomes
+
+
+def test_unique_sampler_encode_decode_round_trip():
+    sampler = UniqueSampler([np.ones(3), np.ones(4), np.ones(5)])
+
+    assert sampler.size == 60
+    for index in range(sampler.size):
+        assert sampler.encode(sampler.decode(index)) == index
+
+
+def test_unique_sampler_exhausts_uniform_space():
+    sampler = UniqueSampler([np.ones(3), np.ones(4), np.ones(5)], seed=123456)
+    genomes = sample_all(sampler)
+
+    assert sampler.uniform
+    assert len(genomes) == len(set(genomes)) == 60
+
+
+def test_unique_sampler_exhausts_weighted_space():
+    weights = [np.array([5.0, 0.0, 95.0]), np.array([1.0, 99.0]), np.ones(3)]
+    sampler = UniqueSampler(weights, seed=123456)
+    genomes = sample_all(sampler)
+
+    assert not sampler.uniform
+    assert len(genomes) == len(set(genomes)) == 12
+    assert all(genome[0] != 1 for genome in genomes)
+
+
+def test_unique_sampler_favours_heavier_genomes():
+    weights = [np.array([1.0, 99.0]), np.array([1.0, 99.0])]
+    first_draws = [UniqueSampler(weights, seed=seed).sample() for seed in range(200)]
+
+    assert first_draws.count([1, 1]) > 150
+
+
+def test_unique_sampler_is_reproducible_with_seed():
+    weights = [np.array([1.0, 2.0, 3.0]), np.array([4.0, 5.0])]
+
+    assert sample_all(UniqueSampler(weights, seed=1)) == sample_all(
+        UniqueSampler(weights, seed=1)
+    )
+
+
+def test_unique_sampler_batches_exhaust_weighted_space():
+    weights = [np.array([1.0, 2.0, 9.0]), np.array([3.0, 1.0, 1.0, 5.0]), np.ones(5)]
+    sampler = UniqueSampler(weights, seed=42)
+    batches = []
+    while len(batch := sampler.sample_batch(7)):
+        batches.append(batch)
+    genomes = [tuple(genome) for genome in np.concatenate(batches).tolist()]
+
+    # drawn with replacement at first, then from the mass tree
+    assert sampler.seen is None
+    assert len(genomes) == len(set(genomes)) == 60
+    assert sampler.sample() is None
+
+
+def test_unique_sampler_keeps_up_with_batch_sampler():
+    rng = np.random.default_rng(0)
+    weights = [rng.integers(1, 10, 10).astype(float) for _ in range(10)]
+    count = 50000
+
+    def timed(function):
+        start = time.process_time()
+        function()
+        return time.process_time() - start
+
+    batch = min(
+        timed(
+            lambda: BatchSampler([np.cumsum(w) for w in weights], seed=1).sample(
+                range(count)
+            )
+        )
+        for _ in range(3)
+    )
+    unique = min(
+        timed(lambda: UniqueSampler(weights, seed=1).sample_batch(count))
+        for _ in range(3)
+    )
+    # drawing with replacement and rejecting repeats is within a small factor
+    # of the batch sampler, far from walking the mass tree per token
+    assert unique < 20 * batch
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from src.core.manifest import Manifest, hash_bytes
+from src.core.metadata import MetadataWriter, update_metadata
+from src.utils.io import JsonStreamWriter, read_json_stream
+
+
+def build_metadata(token_id, extension="png"):
+    return {
+        "token_id": token_id,
+        "image": "./output/images/{}.{}".format(token_id, extension),
+        "name": "NFT #{}".format(token_id),
+        "description": 'A "description"',
+        "attributes": [{"trait_type": "image", "value": '"image": "x.png"'}],
+    }
+
+
+def write_output(output, compact=False, objects_format="json"):
+    tokens = [build_metadata(i, "webp" if i == 3 else "png") for i in range(50)]
+    with MetadataWriter(str(output / "metadata"), compact=compact) as writer:
+        for token in tokens:
+            writer.write(token["token_id"], token)
+    with JsonStreamWriter(
+        str(output / "metadata" / "all-objects.{}".format(objects_format)),
+        lines=objects_format == "jsonl",
+    ) as writer:
+        for token in tokens:
+            writer.write(token)
+    return tokens
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("objects_format", ["json", "jsonl"])
+def test_update_metadata_patches_image_paths(tmp_path, compact, objects_format):
+    tokens = write_output(tmp_path, compact, objects_format)
+    update_metadata("ipfs://cid/", str(tmp_path), 0, workers=3, batch_size=7)
+
+    for token in tokens:
+        token["image"] = "ipfs://cid/{}.{}".format(
+            token["token_id"], "webp" if token["token_id"] == 3 else "png"
+        )
+        contents = (
+            tmp_path / "metadata" / "{}.json".format(token["token_id"])
+        ).read_text()
+        if compact:
+            assert contents == json.dumps(token, separators=(",", ":"))
+        else:
+            assert contents == json.dumps(token, indent=4)
+
+    path = tmp_path / "metadata" / "all-objects.{}".format(objects_format)
+    assert list(read_json_stream(str(path))) == tokens
+
+
+def test_update_metadata_parses_other_layouts(tmp_path):
+    (tmp_path / "metadata").mkdir()
+    token = {"name": "NFT #1", "image": "1.jpg", "token_id": 1}
+    (tmp_path / "metadata" / "1.json").write_text(json.dumps(token))
+
+    update_metadata("https://example.com/", str(tmp_path), 0)
+
+    token["image"] = "https://example.com/1.jpg"
+    assert (tmp_path / "metadata" / "1.json").read_text() == json.dumps(token, indent=4)
+
+
+def test_update_metadata_updates_manifest(tmp_path):
+    write_output(tmp_path)
+    manifest = Manifest(str(tmp_path / ".generator-manifest"), range(50))
+    for token_id in range(50):
+        manifest.set(token_id, hash_bytes(b"key"), hash_bytes(b"stale"))
+    manifest.save()
+
+    update_metadata("ipfs://cid/", str(tmp_path), 0)
+
+    manifest = Manifest.load(manifest.path)
+    for token_id in range(50):
+        contents = (tmp_path / "metadata" / "{}.json".format(token_id)).read_bytes()
+        assert manifest.get(token_id) == (hash_bytes(b"key"), hash_bytes(contents))
+
+
+def test_update_metadata_requires_trailing_slash(tmp_path):
+    with pytest.raises(ValueError):
+        update_metadata("ipfs://cid", str(tmp_path), 0)
@@ -1,9 +1,15 @@
+import os
 from unittest.mock import patch
 
 import pytest
+from PIL import Image
 
 from src.common.exceptions import ConfigValidationError
-from src.common.validate import validate_config
+from src.common.validate import (
+    default_validation_cache,
+    read_png_header,
+    validate_config,
+)
 
 
 @patch("os.path.isfile", return_value=True)
@@ -511,3 +517,160 @@ def test_validate_config_invalid_incompatibility_invalid_incompatibility_value(
 
     with pytest.raises(ConfigValidationError):
         validate_config(config)
+
+
+@patch("os.path.isfile", return_value=True)
+@pytest.mark.parametrize(
+    "output",
+    [[], {"format": "gif"}, {"compression": 9}, {"quality": 101}],
+)
+def test_validate_config_invalid_output(mock_isfile, output):
+    config = {
+        "layers": [
+            {
+                "name": "Background",
+                "values": ["Python Logo"],
+                "trait_path": "./trait-layers/foreground",
+                "filename": ["logo"],
+                "weights": [100],
+            }
+        ],
+        "incompatibilities": [],
+        "baseURI": ".",
+        "name": "NFT #",
+        "description": "This is a description for this NFT series.",
+        "output": output,
+    }
+
+    with pytest.raises(ConfigValidationError):
+        validate_config(config)
+
+
+def test_read_png_header(tmp_path):
+    Image.new("RGBA", (30, 20)).save(tmp_path / "rgba.png")
+    Image.new("P", (5, 6)).save(tmp_path / "palette.png")
+
+    assert read_png_header(str(tmp_path / "rgba.png")) == (30, 20, 8, 6)
+    assert read_png_header(str(tmp_path / "palette.png"))[:2] == (5, 6)
+
+
+def test_validate_config_reports_every_invalid_trait_file(tmp_path):
+    for name, size in [("a", (10, 10)), ("b", (10, 10)), ("c", (12, 10))]:
+        Image.new("RGBA", size).save(tmp_path / "{}.png".format(name))
+    (tmp_path / "text.png").write_text("not an image")
+    corrupt = bytearray((tmp_path / "a.png").read_bytes())
+    corrupt[20] ^= 0xFF
+    (tmp_path / "corrupt.png").write_bytes(bytes(corrupt))
+    config = {
+        "layers": [
+            {
+                "name": "Background",
+                "values": ["a", "b", "c", "text", "corrupt", "missing"],
+                "trait_path": str(tmp_path),
+                "filename": ["a", "b", "c", "text", "corrupt", "missing"],
+                "weights": [50, 10, 10, 10, 10, 10],
+            }
+        ],
+        "incompatibilities": [
+            {
+                "layer": "Background",
+                "value": "a",
+                "incompatible_with": ["b"],
+                "default": {"value": "none", "filename": str(tmp_path / "none")},
+            }
+        ],
+        "baseURI": ".",
+        "name": "NFT #",
+        "description": "This is a description for this NFT series.",
+    }
+
+    with pytest.raises(ConfigValidationError) as e:
+        validate_config(config)
+    message = str(e.value)
+    assert message.startswith("Found 5 invalid trait files")
+    assert 'config["layers"][0]["filename"][2]: Invalid image size: 12x10' in message
+    assert 'config["layers"][0]["filename"][3]: Not a PNG file' in message
+    assert 'config["layers"][0]["filename"][4]: Corrupt PNG header' in message
+    assert 'config["layers"][0]["filename"][5]: File not found' in message
+    assert 'config["incompatibilities"][0]["default"]["filename"]: File not found' in (
+        message
+    )
+
+
+def test_validate_config_invalid_default(tmp_path):
+    Image.new("RGBA", (10, 10)).save(tmp_path / "a.png")
+    config = {
+        "layers": [
+            {
+                "name": "Background",
+                "values": ["a"],
+                "trait_path": str(tmp_path),
+                "filename": ["a"],
+                "weights": [100],
+            }
+        ],
+        "incompatibilities": [
+            {
+                "layer": "Background",
+                "value": "a",
+                "incompatible_with": ["a"],
+                "default": {"value": "none"},
+            }
+        ],
+        "baseURI": ".",
+        "name": "NFT #",
+        "description": "This is a description for this NFT series.",
+    }
+
+    with pytest.raises(ConfigValidationError, match="Invalid default filename"):
+        validate_config(config)
+
+
+def test_validate_config_cache(tmp_path):
+    for name in ["a", "b"]:
+        Image.new("RGBA", (10, 10)).save(tmp_path / "{}.png".format(name))
+    config = {
+        "layers": [
+            {
+                "name": "Background",
+                "values": ["a", "b"],
+                "trait_path": str(tmp_path),
+                "filename": ["a", "b"],
+                "weights": [50, 50],
+            }
+        ],
+        "incompatibilities": [],
+        "baseURI": ".",
+        "name": "NFT #",
+        "description": "This is a description for this NFT series.",
+    }
+    cache = str(tmp_path / "cache" / "validation.json")
+
+    with patch(
+        "src.common.validate.validate_trait_files", return_value=None
+    ) as validate_trait_files:
+        validate_config(config, cache=cache)
+        validate_config(config, cache=cache)
+        assert validate_trait_files.call_count == 1
+
+        # touching a trait file or changing the config validates it again
+        stat = os.stat(tmp_path / "a.png")
+        os.utime(tmp_path / "a.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        validate_config(config, cache=cache)
+        config["name"] = "Other #"
+        validate_config(config, cache=cache)
+        validate_config(config, cache=cache)
+        assert validate_trait_files.call_count == 3
+
+    # invalid configurations are never cached
+    (tmp_path / "b.png").write_text("not an image")
+    for _ in range(2):
+        with pytest.raises(ConfigValidationError, match="Not a PNG file"):
+            validate_config(config, cache=cache)
+
+
+def test_default_validation_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_validation_cache() == str(
+        tmp_path / "nft-generator-py" / "validation.json"
+    )